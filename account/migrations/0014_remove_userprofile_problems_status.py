@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 14:10
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0013_auto_20241207_0245'),
+        # 数据迁移到 user_problem_status 之后才能删除
+        ('problem', '0016_userproblemstatus'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='userprofile',
+            name='acm_problems_status',
+        ),
+        migrations.RemoveField(
+            model_name='userprofile',
+            name='oi_problems_status',
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-18 15:02
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# PostgreSQL 上 icontains 生成的条件是 UPPER("user"."username"::text) LIKE UPPER('%keyword%')
+# 直接建在字段上的 gin_trgm_ops 索引不能用于这个表达式，需要建在相同的表达式上
+# Django 3.2 的 Index 不支持表达式加 opclass，所以使用 RunSQL
+TRGM_INDEXES = [
+    ("user_username_trgm_idx", "user", "username"),
+    ("user_email_trgm_idx", "user", "email"),
+    ("user_real_name_trgm_idx", "user_profile", "real_name"),
+]
+
+
+class Migration(migrations.Migration):
+    # 并发创建索引不锁表
+    atomic = False
+
+    dependencies = [
+        ('account', '0014_remove_userprofile_problems_status'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+    ] + [
+        migrations.RunSQL(
+            sql=f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{name}" ON "{table}" '
+                f'USING gin (UPPER("{column}"::text) gin_trgm_ops)',
+            reverse_sql=f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"',
+        )
+        for name, table, column in TRGM_INDEXES
+    ]
@@ -67,12 +67,11 @@ class User(AbstractBaseUser):
 
     class Meta:
         db_table = "user"  # 数据库表名
+        # 用户名、邮箱的 icontains 查询使用 pg_trgm 的表达式索引，见 account/migrations/0015_user_search_trgm_indexes.py
 
 # 用户资料模型
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)  # 关联用户
-    acm_problems_status = JSONField(default=dict)  # ACM问题状态
-    oi_problems_status = JSONField(default=dict)  # OI问题状态
 
     real_name = models.TextField(null=True)  # 真实姓名
     avatar = models.TextField(default=f"{settings.AVATAR_URI_PREFIX}/default.png")  # 头像
@@ -104,3 +103,4 @@ class UserProfile(models.Model):
 
     class Meta:
         db_table = "user_profile"  # 数据库表名
+        # real_name 的 icontains 查询使用 pg_trgm 的表达式索引，见 account/migrations/0015_user_search_trgm_indexes.py
@@ -1,5 +1,6 @@
 from django import forms
 
+from problem.models import ProblemRuleType, UserProblemStatus
 from utils.api import serializers, UsernameSerializer
 
 from .models import AdminType, ProblemPermission, User, UserProfile
@@ -71,6 +72,8 @@ class UserSerializer(serializers.ModelSerializer):
 class UserProfileSerializer(serializers.ModelSerializer):
     user = UserSerializer()  # 嵌套的用户序列化器
     real_name = serializers.SerializerMethodField()  # 实名字段，通过方法获取
+    acm_problems_status = serializers.SerializerMethodField()  # ACM问题状态，由 user_problem_status 表生成
+    oi_problems_status = serializers.SerializerMethodField()  # OI问题状态，由 user_problem_status 表生成
 
     class Meta:
         model = UserProfile  # 关联的模型
@@ -78,11 +81,32 @@ class UserProfileSerializer(serializers.ModelSerializer):
 
     def __init__(self, *args, **kwargs):
         self.show_real_name = kwargs.pop("show_real_name", False)  # 是否显示实名
+        self._problems_status = {}
         super(UserProfileSerializer, self).__init__(*args, **kwargs)
 
     def get_real_name(self, obj):
         return obj.real_name if self.show_real_name else None  # 根据条件返回实名
 
+    def _get_problems_status(self, obj):
+        # 保持原 JSON 的结构 {"problems": {...}, "contest_problems": {...}}，两个字段共用一次查询
+        if obj.user_id not in self._problems_status:
+            ret = {ProblemRuleType.ACM: {}, ProblemRuleType.OI: {}}
+            statuses = UserProblemStatus.objects.filter(user_id=obj.user_id) \
+                .values_list("problem_id", "problem___id", "problem__rule_type", "contest_id", "status", "score")
+            for problem_id, _id, rule_type, contest_id, status, score in statuses:
+                section = ret[rule_type].setdefault("contest_problems" if contest_id else "problems", {})
+                section[str(problem_id)] = {"status": status, "_id": _id}
+                if rule_type == ProblemRuleType.OI:
+                    section[str(problem_id)]["score"] = score
+            self._problems_status[obj.user_id] = ret
+        return self._problems_status[obj.user_id]
+
+    def get_acm_problems_status(self, obj):
+        return self._get_problems_status(obj)[ProblemRuleType.ACM]
+
+    def get_oi_problems_status(self, obj):
+        return self._get_problems_status(obj)[ProblemRuleType.OI]
+
 
 # 编辑用户序列化器
 class EditUserSerializer(serializers.Serializer):
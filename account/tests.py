@@ -0,0 +1,28 @@
+from unittest import mock
+
+from utils.api.tests import APITestCase
+from .models import UserProfile
+
+
+class UserAdminAPITest(APITestCase):
+    def setUp(self):
+        self.create_super_admin()
+        for username, real_name in (("user1", "Alice"), ("user2", "Alina"), ("alfred", "Bob")):
+            user = self.create_user(username, "test123", login=False)
+            UserProfile.objects.filter(user=user).update(real_name=real_name)
+        self.url = self.reverse("user_admin_api")
+
+    def search(self, keyword):
+        resp = self.client.get(self.url, data={"keyword": keyword})
+        self.assertSuccess(resp)
+        return sorted(item["username"] for item in resp.data["data"]["results"])
+
+    def test_search_real_name(self):
+        self.assertEqual(self.search("ali"), ["user1", "user2"])
+        self.assertEqual(self.search("al"), ["alfred", "user1", "user2"])
+
+    def test_search_many_real_names(self):
+        # 匹配的用户超过上限时使用子查询，结果不变
+        with mock.patch("account.views.admin.REAL_NAME_ID_LIMIT", 1):
+            self.assertEqual(self.search("ali"), ["user1", "user2"])
+            self.assertEqual(self.search("al"), ["alfred", "user1", "user2"])
@@ -11,6 +11,9 @@ from ..models import AdminType, ProblemPermission, User, UserProfile
 from ..serializers import EditUserSerializer, UserAdminSerializer
 from ..serializers import ImportUserSeralizer
 
+# 真实姓名匹配的用户超过该数量时（关键字很短）改用子查询，避免生成过长的 IN 列表
+REAL_NAME_ID_LIMIT = 1000
+
 
 class UserAdminAPI(APIView):
     @validate_serializer(ImportUserSeralizer)
@@ -111,8 +114,15 @@ class UserAdminAPI(APIView):
 
         keyword = request.GET.get("keyword", None)
         if keyword:
+            # 先通过 user_profile 的 pg_trgm 索引查出真实姓名匹配的用户 id
+            # 使用子查询时 OR 条件中的 hashed SubPlan 会让 user 表退化为顺序扫描，使用 id 列表时三个条件可以合并为 BitmapOr
+            # 匹配的用户太多时 id 列表本身的开销更大，仍然使用子查询
+            real_name_users = UserProfile.objects.filter(real_name__icontains=keyword).values_list("user_id", flat=True)
+            ids = list(real_name_users[:REAL_NAME_ID_LIMIT + 1])
+            if len(ids) <= REAL_NAME_ID_LIMIT:
+                real_name_users = ids
             user = user.filter(Q(username__icontains=keyword) |
-                               Q(userprofile__real_name__icontains=keyword) |
+                               Q(id__in=real_name_users) |
                                Q(email__icontains=keyword))
         return self.success(self.paginate_data(request, user, UserAdminSerializer))
 
@@ -17,3 +17,8 @@ class JudgeServerHeartbeatSerializer(serializers.Serializer):
     cpu = serializers.FloatField(min_value=0, max_value=100)
     action = serializers.ChoiceField(choices=("heartbeat", ))
     service_url = serializers.CharField(max_length=256)
+
+
+class JudgeServerTestCaseSyncSerializer(serializers.Serializer):
+    hostname = serializers.CharField(max_length=128)
+    journal_seq = serializers.IntegerField(min_value=0)
@@ -1,28 +1,58 @@
 import hashlib
+import json
 from datetime import datetime
 
 import pytz
+from django.http import HttpResponseNotModified
 from django.utils import timezone
+from django.utils.http import parse_etags, quote_etag
 
 from account.decorators import super_admin_required
 from account.models import User
 from contest.models import Contest
-from judge.dispatcher import process_pending_task
+from judge.backlog import judge_backlog
+from judge.payload import config_cache
+from judge.slots import judge_slots
+from judge.spj import spj_cache
+from judge.tasks import warm_spj_task
 from options.options import SysOptions
+from problem.test_case_journal import test_case_journal
 from submission.models import Submission
 from utils.api import APIView, CSRFExemptAPIView, validate_serializer
+from utils.constants import CacheKey
 from utils.shortcuts import get_env
 from utils.xss_filter import XSSHtml
 from .models import JudgeServer
-from .serializers import (CreateEditWebsiteConfigSerializer,JudgeServerHeartbeatSerializer)
+from .serializers import (CreateEditWebsiteConfigSerializer,JudgeServerHeartbeatSerializer,
+                          JudgeServerTestCaseSyncSerializer)
+
+
+WEBSITE_CONFIG_KEYS = ["website_base_url", "website_name", "website_name_shortcut",
+                       "website_footer", "allow_register", "submission_list_show_all"]
+
+
+def build_website_config(options):
+    """
+    返回序列化好的网站配置和对应的 ETag，结果缓存到其中任意一个选项被修改
+    """
+    data = json.dumps({key: options[key] for key in WEBSITE_CONFIG_KEYS})
+    return data, quote_etag(hashlib.md5(data.encode("utf-8")).hexdigest())
 
 
 class WebsiteConfigAPI(APIView):
     def get(self, request):
-        ret = {key: getattr(SysOptions, key) for key in
-               ["website_base_url", "website_name", "website_name_shortcut",
-                "website_footer", "allow_register", "submission_list_show_all"]}
-        return self.success(ret)
+        # 每次打开页面都会请求，返回缓存的 JSON，内容没有变化时返回 304
+        data, etag = SysOptions.get_derived(CacheKey.website_config, WEBSITE_CONFIG_KEYS, build_website_config)
+        # 经过 nginx gzip 之后 ETag 会变成弱校验的 W/"..."
+        etags = [item[2:] if item.startswith("W/") else item
+                 for item in parse_etags(request.META.get("HTTP_IF_NONE_MATCH", ""))]
+        if etag in etags or "*" in etags:
+            resp = HttpResponseNotModified()
+        else:
+            resp = self.success_raw(data)
+        resp["ETag"] = etag
+        resp["Cache-Control"] = "no-cache"
+        return resp
 
     @super_admin_required
     @validate_serializer(CreateEditWebsiteConfigSerializer)
@@ -46,6 +76,14 @@ class JudgeServerHeartbeatAPI(CSRFExemptAPIView):
 
         try:
             server = JudgeServer.objects.get(hostname=data["hostname"])
+            # 新上线或者长时间没有心跳后重新上线的判题服务器需要预先编译特殊判题
+            warm = server.status != "normal"
+            if server.service_url != data["service_url"]:
+                # 判题服务器地址变化，之前编译的特殊判题也不一定还在
+                # 连接池在判题进程中，下次请求时发现地址变化会自动重建
+                spj_cache.clear(server.id)
+                config_cache.clear(server.id)
+                warm = True
             server.judger_version = data["judger_version"]
             server.cpu_core = data["cpu_core"]
             server.memory_usage = data["memory"]
@@ -55,21 +93,52 @@ class JudgeServerHeartbeatAPI(CSRFExemptAPIView):
             server.last_heartbeat = timezone.now()
             server.save(update_fields=["judger_version", "cpu_core", "memory_usage", "service_url", "ip", "last_heartbeat"])
         except JudgeServer.DoesNotExist:
-            JudgeServer.objects.create(hostname=data["hostname"],
-                                       judger_version=data["judger_version"],
-                                       cpu_core=data["cpu_core"],
-                                       memory_usage=data["memory"],
-                                       cpu_usage=data["cpu"],
-                                       ip=request.META["REMOTE_ADDR"],
-                                       service_url=data["service_url"],
-                                       last_heartbeat=timezone.now(),
-                                       )
+            server = JudgeServer.objects.create(hostname=data["hostname"],
+                                                judger_version=data["judger_version"],
+                                                cpu_core=data["cpu_core"],
+                                                memory_usage=data["memory"],
+                                                cpu_usage=data["cpu"],
+                                                ip=request.META["REMOTE_ADDR"],
+                                                service_url=data["service_url"],
+                                                last_heartbeat=timezone.now(),
+                                                )
+            warm = True
+        # 同步判题服务器的槽位信息
+        judge_slots.heartbeat(server)
         # 新server上线 处理队列中的，防止没有新的提交而导致一直waiting
-        process_pending_task()
+        judge_backlog.drain()
+        if warm:
+            warm_spj_task.send(server.id)
 
         return self.success()
 
 
+class JudgeServerTestCaseSyncAPI(CSRFExemptAPIView):
+    @validate_serializer(JudgeServerTestCaseSyncSerializer)
+    def post(self, request):
+        """
+        判题服务器的 rsync 节点上报已经同步到的测试用例日志序号
+        """
+        data = request.data
+        client_token = request.META.get("HTTP_X_JUDGE_SERVER_TOKEN")
+        if hashlib.sha256(SysOptions.judge_server_token.encode("utf-8")).hexdigest() != client_token:
+            return self.error("Invalid token")
+        try:
+            server = JudgeServer.objects.get(hostname=data["hostname"])
+        except JudgeServer.DoesNotExist:
+            return self.error("Judge server does not exist")
+        judge_slots.set_synced(server.id, data["journal_seq"])
+        return self.success({"journal_head": test_case_journal.head()})
+
+
+class JudgeQueueAPI(APIView):
+    @super_admin_required
+    def get(self, request):
+        stats = judge_backlog.stats()
+        stats["affinity"] = judge_slots.affinity_stats()
+        return self.success(stats)
+
+
 class LanguagesAPI(APIView):
     def get(self, request):
         return self.success({"languages": SysOptions.languages, "spj_languages": SysOptions.spj_languages})
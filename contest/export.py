@@ -0,0 +1,98 @@
+import csv
+import tempfile
+
+import xlsxwriter
+
+from problem.models import Problem
+from utils.constants import ContestRuleType
+from .scoreboard import ContestScoreboard, FrozenScoreboard
+
+# 每次从数据库游标读取的行数
+EXPORT_CHUNK_SIZE = 2000
+
+
+class _Echo(object):
+    """
+    csv.writer 需要一个文件对象，直接返回写入的内容供 StreamingHttpResponse 逐行输出
+    """
+    def write(self, value):
+        return value
+
+
+class ContestRankExporter(object):
+    """
+    导出比赛排名，逐行读取排名数据，不在内存中保存整个排名
+    题目 id 到列号的映射只计算一次，表头只查询一次数据库
+    """
+    def __init__(self, contest, is_contest_admin=False, frozen=False):
+        self.contest = contest
+        self.is_contest_admin = is_contest_admin
+        self.frozen = frozen
+        self.is_acm = contest.rule_type == ContestRuleType.ACM
+        self.problems = list(Problem.objects.filter(contest=contest, visible=True)
+                             .order_by("_id").values_list("id", "title"))
+        self.fixed_columns = ["User ID", "Username", "Real Name"]
+        if self.is_acm:
+            self.fixed_columns += ["AC", "Total Submission", "Total Time"]
+        else:
+            self.fixed_columns += ["Total Score"]
+        self.problem_column = {str(problem_id): len(self.fixed_columns) + index
+                               for index, (problem_id, _) in enumerate(self.problems)}
+
+    @property
+    def header(self):
+        return self.fixed_columns + [title for _, title in self.problems]
+
+    def _iter_ranks(self):
+        """
+        返回 (user_id, username, real_name, submission_info, *counters)
+        普通用户导出与排名页面相同的数据：封榜期间为封榜快照，不实时更新排名时为缓存的排名
+        管理员或者实时排名时通过数据库游标逐块读取
+        """
+        if self.frozen or (not self.is_contest_admin and not self.contest.real_time_rank):
+            scoreboard = FrozenScoreboard(self.contest) if self.frozen else ContestScoreboard(self.contest)
+            for item in scoreboard.rows():
+                counters = [item["accepted_number"], item["submission_number"], item["total_time"]] \
+                    if self.is_acm else [item["total_score"]]
+                yield [item["user"]["id"], item["user"]["username"], None, item["submission_info"], *counters]
+            return
+
+        counters = ["accepted_number", "submission_number", "total_time"] if self.is_acm else ["total_score"]
+        qs = ContestScoreboard(self.contest).get_rank_queryset() \
+            .values_list("user_id", "user__username", "user__userprofile__real_name", "submission_info", *counters)
+        yield from qs.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+    def rows(self):
+        width = len(self.fixed_columns) + len(self.problems)
+        for user_id, username, real_name, submission_info, *counters in self._iter_ranks():
+            row = [""] * width
+            row[0] = str(user_id)
+            row[1] = username
+            row[2] = (real_name if self.is_contest_admin else None) or ""
+            for index, value in enumerate(counters):
+                row[3 + index] = str(value)
+            for problem_id, info in submission_info.items():
+                column = self.problem_column.get(problem_id)
+                if column is not None:
+                    row[column] = str(info["is_ac"] if self.is_acm else info)
+            yield row
+
+    def iter_csv(self):
+        writer = csv.writer(_Echo())
+        yield writer.writerow(self.header)
+        for row in self.rows():
+            yield writer.writerow(row)
+
+    def to_xlsx(self):
+        """
+        使用 constant_memory 模式逐行写入临时文件，返回已经定位到开头的文件对象
+        """
+        f = tempfile.TemporaryFile()
+        workbook = xlsxwriter.Workbook(f, {"constant_memory": True})
+        worksheet = workbook.add_worksheet()
+        worksheet.write_row(0, 0, self.header)
+        for index, row in enumerate(self.rows()):
+            worksheet.write_row(index + 1, 0, row)
+        workbook.close()
+        f.seek(0)
+        return f
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 14:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contest', '0011_auto_20241207_0245'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contest',
+            name='freeze_time',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='contest',
+            name='unfreeze_time',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
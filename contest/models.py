@@ -13,6 +13,9 @@ class Contest(models.Model):
     description = RichTextField()
     # show real time rank or cached rank
     real_time_rank = models.BooleanField()
+    # 封榜时间和揭晓时间，封榜期间普通用户只能看到封榜时的排名
+    freeze_time = models.DateTimeField(null=True)
+    unfreeze_time = models.DateTimeField(null=True)
     password = models.TextField(null=True)
     # enum of ContestRuleType
     rule_type = models.TextField()
@@ -37,6 +40,12 @@ class Contest(models.Model):
             # 正在进行 返回0
             return ContestStatus.CONTEST_UNDERWAY
 
+    @property
+    def is_rank_frozen(self):
+        if not self.freeze_time or self.freeze_time > now():
+            return False
+        return not self.unfreeze_time or self.unfreeze_time > now()
+
     @property
     def contest_type(self):
         if self.password:
@@ -0,0 +1,82 @@
+from account.models import AdminType, User
+from problem.models import Problem
+from submission.models import JudgeStatus, Submission
+from .models import ACMContestRank, ContestRuleType, OIContestRank
+
+REPLAY_CHUNK_SIZE = 500
+# 不计入统计的结果，与 JudgeDispatcher 一致：还没有判完的，以及系统错误
+UNCOUNTED_RESULTS = (JudgeStatus.PENDING, JudgeStatus.JUDGING, JudgeStatus.SYSTEM_ERROR)
+
+
+class ContestReplay(object):
+    """
+    按提交时间重放比赛中的提交，计算题目计数、用户题目状态和排名，规则与 JudgeDispatcher 中的比赛部分一致
+    比赛管理员的提交和比赛时间之外的提交不计入，end_time 可以提前到封榜时间，得到封榜时的排名
+    结果都是还没有保存的对象：
+     - problems: {problem_id: {"submission_number", "accepted_number", "statistic_info"}}
+     - statuses: {(user_id, problem_id): [result, score]}
+     - ranks: {user_id: ACMContestRank / OIContestRank}
+    """
+    def __init__(self, contest, end_time=None):
+        self.contest = contest
+        self.end_time = min(end_time, contest.end_time) if end_time else contest.end_time
+        self.is_acm = contest.rule_type == ContestRuleType.ACM
+        self.problem_ids = list(Problem.objects.filter(contest=contest).values_list("id", flat=True))
+        self.problems = {problem_id: {"submission_number": 0, "accepted_number": 0, "statistic_info": {}}
+                         for problem_id in self.problem_ids}
+        self.statuses = {}
+        self.ranks = {}
+
+    def submissions(self):
+        admins = set(User.objects.filter(admin_type=AdminType.SUPER_ADMIN).values_list("id", flat=True))
+        admins.add(self.contest.created_by_id)
+        return Submission.objects.filter(contest=self.contest, create_time__gte=self.contest.start_time,
+                                         create_time__lt=self.end_time) \
+            .exclude(result__in=UNCOUNTED_RESULTS).exclude(user_id__in=admins).order_by("create_time")
+
+    def run(self):
+        rows = self.submissions().values_list("user_id", "problem_id", "result", "statistic_info", "create_time")
+        for row in rows.iterator(chunk_size=REPLAY_CHUNK_SIZE):
+            self._replay(*row)
+        if not self.is_acm:
+            for rank in self.ranks.values():
+                rank.total_score = sum(rank.submission_info.values())
+        return self
+
+    def _replay(self, user_id, problem_id, result, statistic_info, create_time):
+        if problem_id not in self.problems:
+            return
+        contest = self.contest
+        score = statistic_info.get("score", 0)
+        status = self.statuses.get((user_id, problem_id))
+        if status:
+            if self.is_acm and status[0] == JudgeStatus.ACCEPTED:
+                return
+            status[0] = result
+            if not self.is_acm:
+                status[1] = score
+        else:
+            self.statuses[(user_id, problem_id)] = [result, score]
+
+        counters = self.problems[problem_id]
+        counters["submission_number"] += 1
+        counters["statistic_info"][str(result)] = counters["statistic_info"].get(str(result), 0) + 1
+        if result == JudgeStatus.ACCEPTED:
+            counters["accepted_number"] += 1
+
+        if self.is_acm:
+            rank = self.ranks.setdefault(user_id, ACMContestRank(user_id=user_id, contest=contest, submission_info={}))
+            info = rank.submission_info.setdefault(str(problem_id), {"is_ac": False, "ac_time": 0,
+                                                                     "error_number": 0, "is_first_ac": False})
+            rank.submission_number += 1
+            if result == JudgeStatus.ACCEPTED:
+                rank.accepted_number += 1
+                info["is_ac"] = True
+                info["ac_time"] = (create_time - contest.start_time).total_seconds()
+                rank.total_time += info["ac_time"] + info["error_number"] * 20 * 60
+                info["is_first_ac"] = counters["accepted_number"] == 1
+            elif result != JudgeStatus.COMPILE_ERROR:
+                info["error_number"] += 1
+        else:
+            rank = self.ranks.setdefault(user_id, OIContestRank(user_id=user_id, contest=contest, submission_info={}))
+            rank.submission_info[str(problem_id)] = score
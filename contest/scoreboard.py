@@ -0,0 +1,314 @@
+import json
+
+from account.models import AdminType, User
+from utils.cache import cache, RedisScript
+from utils.constants import CacheKey, ContestRuleType
+from .models import ACMContestRank, OIContestRank
+from .replay import ContestReplay
+from .serializers import ACMContestRankSerializer, OIContestRankSerializer
+
+# ACM 排名按 AC 数降序、罚时升序，合并成一个分数，罚时不会超过这个值
+ACM_TIME_BASE = 10 ** 10
+# 序列化后的分页缓存时间，排名有变化时会立即失效
+PAGE_CACHE_TIMEOUT = 300
+# 重建排名的锁，同一时间只有一个 worker 从数据库重建
+REBUILD_LOCK_TIMEOUT = 60
+
+# KEYS: built, order, rows, building, building_order, building_rows, version, pages
+# ARGV: user_id, score, row
+_update_script = RedisScript("""
+if redis.call("EXISTS", KEYS[1]) == 1 then
+    redis.call("ZADD", KEYS[2], ARGV[2], ARGV[1])
+    redis.call("HSET", KEYS[3], ARGV[1], ARGV[3])
+    redis.call("INCR", KEYS[7])
+    redis.call("DEL", KEYS[8])
+end
+if redis.call("EXISTS", KEYS[4]) == 1 then
+    redis.call("ZADD", KEYS[5], ARGV[2], ARGV[1])
+    redis.call("HSET", KEYS[6], ARGV[1], ARGV[3])
+end
+""")
+
+# KEYS: built, order, rows, building, building_order, building_rows, version, pages
+_finish_build_script = RedisScript("""
+redis.call("DEL", KEYS[2], KEYS[3])
+if redis.call("EXISTS", KEYS[5]) == 1 then
+    redis.call("RENAME", KEYS[5], KEYS[2])
+    redis.call("RENAME", KEYS[6], KEYS[3])
+end
+redis.call("SET", KEYS[1], 1)
+redis.call("DEL", KEYS[4])
+redis.call("INCR", KEYS[7])
+redis.call("DEL", KEYS[8])
+""")
+
+# KEYS: version, pages
+# ARGV: version, field, body, timeout
+# 生成分页期间排名发生了变化则不写入，避免缓存旧数据
+_set_page_script = RedisScript("""
+if (redis.call("GET", KEYS[1]) or "0") == ARGV[1] then
+    redis.call("HSET", KEYS[2], ARGV[2], ARGV[3])
+    if redis.call("TTL", KEYS[2]) < 0 then
+        redis.call("EXPIRE", KEYS[2], ARGV[4])
+    end
+end
+""")
+
+# KEYS: built, order, rows, building, building_order, building_rows, version, pages, pending
+# ARGV: 封榜后有提交的用户 id
+# 快照生成完成，pending 中的用户按快照中的分数排队，生成期间 buffer 加入的用户同样重新计算分数
+_finish_freeze_script = RedisScript("""
+redis.call("DEL", KEYS[2], KEYS[3])
+if redis.call("EXISTS", KEYS[5]) == 1 then
+    redis.call("RENAME", KEYS[5], KEYS[2])
+    redis.call("RENAME", KEYS[6], KEYS[3])
+end
+for _, user_id in ipairs(ARGV) do
+    redis.call("ZADD", KEYS[9], "NX", "-inf", user_id)
+end
+for _, user_id in ipairs(redis.call("ZRANGE", KEYS[9], 0, -1)) do
+    redis.call("ZADD", KEYS[9], redis.call("ZSCORE", KEYS[2], user_id) or "-inf", user_id)
+end
+redis.call("SET", KEYS[1], 1)
+redis.call("DEL", KEYS[4])
+redis.call("INCR", KEYS[7])
+redis.call("DEL", KEYS[8])
+""")
+
+# KEYS: order, pending
+# ARGV: user_id
+# 封榜后有变化的用户按快照中的分数排队，揭晓时从排名靠后的用户开始
+# 快照还在生成时同样加入，生成完成时重新计算分数
+_buffer_script = RedisScript("""
+local score = redis.call("ZSCORE", KEYS[1], ARGV[1]) or "-inf"
+redis.call("ZADD", KEYS[2], "NX", score, ARGV[1])
+""")
+
+# KEYS: live order, live rows, order, rows, version, pages, pending
+# ARGV: stop
+_reveal_script = RedisScript("""
+local users = redis.call("ZRANGE", KEYS[7], 0, tonumber(ARGV[1]))
+for _, user_id in ipairs(users) do
+    local score = redis.call("ZSCORE", KEYS[1], user_id)
+    if score then
+        redis.call("ZADD", KEYS[3], score, user_id)
+        redis.call("HSET", KEYS[4], user_id, redis.call("HGET", KEYS[2], user_id))
+    end
+    redis.call("ZREM", KEYS[7], user_id)
+end
+if #users > 0 then
+    redis.call("INCR", KEYS[5])
+    redis.call("DEL", KEYS[6])
+end
+return users
+""")
+
+
+class ContestScoreboard(object):
+    """
+    比赛排名保存在 Redis 中：sorted set 保存排序，hash 保存每个用户序列化后的排名数据
+    每次判题只更新一个用户，分页读取为 O(log n + page)，不需要访问数据库
+    重建过程中到达的更新同时写入新旧两份数据，重建数据只在用户不存在时写入，保证不会覆盖更新的数据
+    """
+    def __init__(self, contest, prefix=None):
+        self.contest = contest
+        prefix = prefix or f"{CacheKey.contest_rank_cache}:{contest.id}"
+        self.prefix = prefix
+        self.built_key = f"{prefix}:built"
+        self.order_key = f"{prefix}:order"
+        self.rows_key = f"{prefix}:rows"
+        self.building_key = f"{prefix}:building"
+        self.building_order_key = f"{prefix}:building:order"
+        self.building_rows_key = f"{prefix}:building:rows"
+        self.version_key = f"{prefix}:version"
+        self.pages_key = f"{prefix}:pages"
+        self.rebuild_lock_key = f"{prefix}:rebuild_lock"
+
+    @property
+    def _keys(self):
+        return [self.built_key, self.order_key, self.rows_key,
+                self.building_key, self.building_order_key, self.building_rows_key,
+                self.version_key, self.pages_key]
+
+    @property
+    def is_acm(self):
+        return self.contest.rule_type == ContestRuleType.ACM
+
+    def get_rank_queryset(self):
+        model = ACMContestRank if self.is_acm else OIContestRank
+        qs = model.objects.filter(contest=self.contest,
+                                  user__admin_type=AdminType.REGULAR_USER,
+                                  user__is_disabled=False).select_related("user__userprofile")
+        if self.is_acm:
+            return qs.order_by("-accepted_number", "total_time")
+        return qs.order_by("-total_score")
+
+    def _score(self, rank):
+        if self.is_acm:
+            return rank.accepted_number * ACM_TIME_BASE - rank.total_time
+        return rank.total_score
+
+    def _serialize(self, rank):
+        serializer = ACMContestRankSerializer if self.is_acm else OIContestRankSerializer
+        return json.dumps(serializer(rank, is_contest_admin=True).data)
+
+    def exists(self):
+        return bool(cache.exists(self.built_key))
+
+    def rebuild(self):
+        with cache.pipeline() as pipe:
+            pipe.set(self.building_key, 1, ex=3600)
+            pipe.delete(self.building_order_key, self.building_rows_key)
+            pipe.execute()
+        with cache.pipeline() as pipe:
+            for rank in self.get_rank_queryset().iterator(chunk_size=1000):
+                pipe.zadd(self.building_order_key, {rank.user_id: self._score(rank)}, nx=True)
+                pipe.hsetnx(self.building_rows_key, rank.user_id, self._serialize(rank))
+            pipe.execute()
+        _finish_build_script(keys=self._keys)
+
+    def update(self, rank, user):
+        """
+        判题结束后更新一个用户的排名，排名数据还没有生成时忽略，下次读取时会从数据库重建
+        """
+        if user.admin_type != AdminType.REGULAR_USER or user.is_disabled:
+            return
+        rank.user = user
+        frozen = None
+        if self.contest.is_rank_frozen:
+            # 封榜后的第一次更新之前先生成快照，之后的变化只进入实时排名，等待揭晓
+            frozen = FrozenScoreboard(self.contest)
+            frozen.freeze()
+        _update_script(keys=self._keys, args=[rank.user_id, self._score(rank), self._serialize(rank)])
+        if frozen:
+            frozen.buffer(rank.user_id)
+
+    def ensure_built(self, force=False):
+        """
+        排名数据不存在时重建，并发请求只有拿到锁的 worker 访问数据库，其他请求等待重建完成
+        force 为 True 时即使已经存在也重新生成（管理员强制刷新），同样需要拿到锁，避免两次重建交替执行
+        """
+        if not force and self.exists():
+            return
+        lock = cache.lock(self.rebuild_lock_key, timeout=REBUILD_LOCK_TIMEOUT)
+        if not lock.acquire(blocking_timeout=REBUILD_LOCK_TIMEOUT):
+            return
+        try:
+            if force or not self.exists():
+                self.rebuild()
+        finally:
+            lock.release()
+
+    def page(self, offset, limit):
+        self.ensure_built()
+        with cache.pipeline() as pipe:
+            pipe.zrevrange(self.order_key, offset, offset + limit - 1)
+            pipe.zcard(self.order_key)
+            user_ids, total = pipe.execute()
+        if not user_ids:
+            return [], total
+        rows = cache.hmget(self.rows_key, user_ids)
+        return [json.loads(item) for item in rows if item], total
+
+    def rows(self):
+        """
+        按排名顺序返回全部数据，用于导出
+        """
+        self.ensure_built()
+        user_ids = cache.zrevrange(self.order_key, 0, -1)
+        if not user_ids:
+            return []
+        return [json.loads(item) for item in cache.hmget(self.rows_key, user_ids) if item]
+
+    def page_json(self, offset, limit, is_contest_admin):
+        """
+        返回序列化好的分页 json 字符串，按 (是否比赛管理员, offset, limit) 缓存
+        """
+        field = f"{int(bool(is_contest_admin))}:{offset}:{limit}"
+        with cache.pipeline() as pipe:
+            pipe.exists(self.built_key)
+            pipe.get(self.version_key)
+            pipe.hget(self.pages_key, field)
+            built, version, body = pipe.execute()
+        if built and body:
+            return body.decode("utf-8")
+
+        rows, total = self.page(offset, limit)
+        if not is_contest_admin:
+            for item in rows:
+                item["user"]["real_name"] = None
+        body = json.dumps({"results": rows, "total": total})
+        if built:
+            version = version.decode("utf-8") if version else "0"
+            _set_page_script(keys=[self.version_key, self.pages_key],
+                             args=[version, field, body, PAGE_CACHE_TIMEOUT])
+        return body
+
+    def delete(self):
+        with cache.pipeline() as pipe:
+            pipe.delete(self.built_key, self.order_key, self.rows_key, self.pages_key)
+            pipe.incr(self.version_key)
+            pipe.execute()
+
+
+class FrozenScoreboard(ContestScoreboard):
+    """
+    封榜快照，在封榜后第一次更新或读取时按提交重放到封榜时间生成，之后只有揭晓操作会修改
+    封榜期间有变化的用户记录在 pending 中，揭晓时把这些用户的实时数据逐个复制到快照，不需要重新计算整个排名
+    """
+    def __init__(self, contest):
+        super().__init__(contest, prefix=f"{CacheKey.contest_rank_cache}:{contest.id}:frozen")
+        self.pending_key = f"{self.prefix}:pending"
+        self.live = ContestScoreboard(contest)
+
+    def ensure_built(self, force=False):
+        # 快照只在封榜时生成一次，不会强制刷新
+        self.freeze()
+
+    def freeze(self):
+        super().ensure_built()
+
+    def rebuild(self):
+        # 实时排名和排名表可能已经包含封榜后判完（或者重判）的结果，快照只能从封榜前的提交重放得到
+        replay = ContestReplay(self.contest, end_time=self.contest.freeze_time).run()
+        model = ACMContestRank if self.is_acm else OIContestRank
+        rank_ids = dict(model.objects.filter(contest=self.contest).values_list("user_id", "id"))
+        users = User.objects.filter(id__in=list(replay.ranks), admin_type=AdminType.REGULAR_USER,
+                                    is_disabled=False).select_related("userprofile")
+        pending = ContestReplay(self.contest).submissions().filter(create_time__gte=self.contest.freeze_time) \
+            .values_list("user_id", flat=True).distinct()
+
+        with cache.pipeline() as pipe:
+            pipe.set(self.building_key, 1, ex=3600)
+            pipe.delete(self.building_order_key, self.building_rows_key)
+            for user in users.iterator(chunk_size=1000):
+                rank = replay.ranks[user.id]
+                rank.id = rank_ids.get(user.id)
+                rank.user = user
+                pipe.zadd(self.building_order_key, {user.id: self._score(rank)})
+                pipe.hset(self.building_rows_key, user.id, self._serialize(rank))
+            pipe.execute()
+        _finish_freeze_script(keys=self._keys + [self.pending_key], args=list(pending))
+
+    def buffer(self, user_id):
+        _buffer_script(keys=[self.order_key, self.pending_key], args=[user_id])
+
+    def pending(self):
+        return cache.zcard(self.pending_key)
+
+    def reveal(self, count=0):
+        """
+        揭晓 count 个封榜后有变化的用户，count 为 0 时全部揭晓，返回揭晓的用户 id
+        """
+        # 揭晓的数据来自实时排名，不存在时先重建，否则这些用户会直接从 pending 中移除
+        self.live.ensure_built()
+        keys = [self.live.order_key, self.live.rows_key, self.order_key, self.rows_key,
+                self.version_key, self.pages_key, self.pending_key]
+        users = _reveal_script(keys=keys, args=[count - 1 if count > 0 else -1])
+        return [int(item) for item in users]
+
+    def delete(self):
+        with cache.pipeline() as pipe:
+            pipe.delete(self.built_key, self.order_key, self.rows_key, self.pages_key, self.pending_key)
+            pipe.incr(self.version_key)
+            pipe.execute()
@@ -13,6 +13,8 @@ class CreateConetestSeriaizer(serializers.Serializer):
     password = serializers.CharField(allow_blank=True, max_length=32)
     visible = serializers.BooleanField()
     real_time_rank = serializers.BooleanField()
+    freeze_time = serializers.DateTimeField(required=False, allow_null=True)
+    unfreeze_time = serializers.DateTimeField(required=False, allow_null=True)
     allowed_ip_ranges = serializers.ListField(child=serializers.CharField(max_length=32), allow_empty=True)
 
 
@@ -25,6 +27,8 @@ class EditConetestSeriaizer(serializers.Serializer):
     password = serializers.CharField(allow_blank=True, allow_null=True, max_length=32)
     visible = serializers.BooleanField()
     real_time_rank = serializers.BooleanField()
+    freeze_time = serializers.DateTimeField(required=False, allow_null=True)
+    unfreeze_time = serializers.DateTimeField(required=False, allow_null=True)
     allowed_ip_ranges = serializers.ListField(child=serializers.CharField(max_length=32))
 
 
@@ -66,6 +70,12 @@ class EditContestAnnouncementSerializer(serializers.Serializer):
     visible = serializers.BooleanField(required=False)
 
 
+class ContestRankRevealSerializer(serializers.Serializer):
+    contest_id = serializers.IntegerField()
+    # 0 表示全部揭晓
+    count = serializers.IntegerField(min_value=0)
+
+
 class ContestPasswordVerifySerializer(serializers.Serializer):
     contest_id = serializers.IntegerField()
     password = serializers.CharField(max_length=30, required=True)
@@ -0,0 +1,174 @@
+import json
+from datetime import timedelta
+
+from django.utils import timezone
+
+from account.models import UserProfile
+from submission.models import JudgeStatus, Submission
+from submission.tests import create_problem
+from utils.api.tests import APITestCase
+from .models import ACMContestRank, Contest, ContestRuleType
+from .scoreboard import ContestScoreboard, FrozenScoreboard
+
+
+class ContestTestMixin(object):
+    def create_contest(self, rule_type=ContestRuleType.ACM, real_time_rank=True, **kwargs):
+        now = timezone.now()
+        data = {"title": "test contest", "description": "test description", "real_time_rank": real_time_rank,
+                "rule_type": rule_type, "start_time": now - timedelta(hours=2), "end_time": now + timedelta(hours=1),
+                "created_by": self.admin, "visible": True}
+        data.update(kwargs)
+        contest = Contest.objects.create(**data)
+        # 排名数据保存在 Redis 中，不随测试数据库回滚
+        ContestScoreboard(contest).delete()
+        FrozenScoreboard(contest).delete()
+        return contest
+
+    def create_rank(self, username, accepted_number, total_time, **kwargs):
+        user = self.create_user(username, "test123", login=False, **kwargs)
+        return ACMContestRank.objects.create(user=user, contest=self.contest, accepted_number=accepted_number,
+                                             submission_number=accepted_number + 1, total_time=total_time)
+
+
+class ContestRankExportTest(ContestTestMixin, APITestCase):
+    def setUp(self):
+        self.admin = self.create_super_admin(login=False)
+        self.user = self.create_user("test", "test123")
+        self.contest = self.create_contest(real_time_rank=False)
+        self.rank = ACMContestRank.objects.create(user=self.user, contest=self.contest, accepted_number=1,
+                                                  submission_number=1, total_time=60)
+        self.url = self.reverse("contest_rank_api")
+
+    def export(self):
+        resp = self.client.get(self.url, data={"contest_id": self.contest.id, "download_csv": 1, "format": "csv"})
+        lines = b"".join(resp.streaming_content).decode("utf-8").splitlines()
+        return [line.split(",") for line in lines[1:]]
+
+    def test_stale_board_for_regular_user(self):
+        # 排名页面读取的是缓存的排名，之后数据库中的排名发生变化
+        ContestScoreboard(self.contest).ensure_built()
+        ACMContestRank.objects.filter(id=self.rank.id).update(accepted_number=2, submission_number=3)
+        rows = self.export()
+        self.assertEqual(rows, [[str(self.user.id), "test", "", "1", "1", "60"]])
+
+    def test_live_board_for_contest_admin(self):
+        ContestScoreboard(self.contest).ensure_built()
+        ACMContestRank.objects.filter(id=self.rank.id).update(accepted_number=2, submission_number=3)
+        self.client.login(username="root", password="root")
+        rows = self.export()
+        self.assertEqual(rows, [[str(self.user.id), "test", "", "2", "3", "60"]])
+
+
+class ContestScoreboardTest(ContestTestMixin, APITestCase):
+    def setUp(self):
+        self.admin = self.create_super_admin(login=False)
+        self.contest = self.create_contest()
+        self.scoreboard = ContestScoreboard(self.contest)
+        self.create_rank("user1", 1, 100)
+        self.create_rank("user2", 2, 300)
+        self.create_rank("user3", 1, 50)
+        # 管理员不参与排名
+        ACMContestRank.objects.create(user=self.admin, contest=self.contest, accepted_number=5)
+
+    def usernames(self, rows):
+        return [item["user"]["username"] for item in rows]
+
+    def test_rebuild(self):
+        self.assertFalse(self.scoreboard.exists())
+        rows, total = self.scoreboard.page(0, 10)
+        self.assertTrue(self.scoreboard.exists())
+        self.assertEqual(total, 3)
+        # AC 数降序，罚时升序
+        self.assertEqual(self.usernames(rows), ["user2", "user3", "user1"])
+
+        ACMContestRank.objects.filter(user__username="user1").update(accepted_number=3)
+        self.assertEqual(self.usernames(self.scoreboard.rows())[0], "user2")
+        self.scoreboard.ensure_built(force=True)
+        self.assertEqual(self.usernames(self.scoreboard.rows())[0], "user1")
+
+    def test_page(self):
+        rows, total = self.scoreboard.page(1, 1)
+        self.assertEqual((self.usernames(rows), total), (["user3"], 3))
+        rows, total = self.scoreboard.page(3, 10)
+        self.assertEqual((rows, total), ([], 3))
+
+    def test_update_invalidates_page(self):
+        body = json.loads(self.scoreboard.page_json(0, 10, True))
+        self.assertEqual(self.usernames(body["results"]), ["user2", "user3", "user1"])
+        rank = ACMContestRank.objects.get(user__username="user1")
+        rank.accepted_number = 3
+        self.scoreboard.update(rank, rank.user)
+        body = json.loads(self.scoreboard.page_json(0, 10, True))
+        self.assertEqual(self.usernames(body["results"]), ["user1", "user2", "user3"])
+        self.assertEqual(body["results"][0]["accepted_number"], 3)
+        self.assertEqual(body["total"], 3)
+
+
+class ContestRankAPITest(ContestTestMixin, APITestCase):
+    def setUp(self):
+        self.admin = self.create_super_admin(login=False)
+        self.contest = self.create_contest()
+        rank = self.create_rank("user1", 1, 100)
+        UserProfile.objects.filter(user=rank.user).update(real_name="real name")
+        self.create_user("test", "test123")
+        self.url = self.reverse("contest_rank_api")
+
+    def get_rank(self):
+        resp = self.client.get(self.url, data={"contest_id": self.contest.id})
+        self.assertSuccess(resp)
+        return resp.data["data"]
+
+    def test_real_name_hidden(self):
+        data = self.get_rank()
+        self.assertEqual(data["total"], 1)
+        self.assertIsNone(data["results"][0]["user"]["real_name"])
+
+    def test_real_name_for_contest_admin(self):
+        # 先以普通用户读取，管理员读取的分页单独缓存
+        self.get_rank()
+        self.client.login(username="root", password="root")
+        self.assertEqual(self.get_rank()["results"][0]["user"]["real_name"], "real name")
+
+
+class FrozenScoreboardTest(ContestTestMixin, APITestCase):
+    def setUp(self):
+        self.admin = self.create_super_admin(login=False)
+        self.contest = self.create_contest(freeze_time=timezone.now() - timedelta(hours=1))
+        self.problem = create_problem(self.admin, contest=self.contest)
+        self.user1 = self.create_rank("user1", 1, 600).user
+        self.user2 = self.create_rank("user2", 1, 5400).user
+        self.submit(self.user1, JudgeStatus.ACCEPTED, minutes=10)
+        self.submit(self.user2, JudgeStatus.WRONG_ANSWER, minutes=20)
+        # 封榜后的提交只进入实时排名
+        self.submit(self.user2, JudgeStatus.ACCEPTED, minutes=70)
+        self.frozen = FrozenScoreboard(self.contest)
+
+    def submit(self, user, result, minutes):
+        submission = Submission.objects.create(user_id=user.id, username=user.username, code="", language="C",
+                                               problem=self.problem, contest=self.contest, result=result)
+        Submission.objects.filter(id=submission.id).update(
+            create_time=self.contest.start_time + timedelta(minutes=minutes))
+
+    def board(self):
+        rows, _ = self.frozen.page(0, 10)
+        return [(item["user"]["username"], item["accepted_number"]) for item in rows]
+
+    def test_replay_until_freeze_time(self):
+        self.assertEqual(self.board(), [("user1", 1), ("user2", 0)])
+        self.assertEqual(self.frozen.pending(), 1)
+
+    def test_live_update_is_buffered(self):
+        self.frozen.freeze()
+        rank = ACMContestRank.objects.get(user=self.user1)
+        rank.accepted_number = 2
+        ContestScoreboard(self.contest).update(rank, self.user1)
+        self.assertEqual(self.board(), [("user1", 1), ("user2", 0)])
+        self.assertEqual(self.frozen.pending(), 2)
+
+    def test_reveal(self):
+        self.frozen.freeze()
+        # 从快照中排名靠后的用户开始揭晓
+        self.assertEqual(self.frozen.reveal(1), [self.user2.id])
+        self.assertEqual(self.board(), [("user1", 1), ("user2", 1)])
+        self.assertEqual(self.frozen.pending(), 0)
+        self.assertEqual(self.frozen.reveal(), [])
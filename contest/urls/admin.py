@@ -1,10 +1,12 @@
 from django.urls import re_path
 from ..views.admin import ContestAnnouncementAPI, ContestAPI, ACMContestHelper, DownloadContestSubmissions
+from ..views.admin import ContestRankRevealAPI
 
 urlpatterns = [
     re_path(r"^contest/?$", ContestAPI.as_view(), name="contest_admin_api"),
     re_path(r"^contest/announcement/?$", ContestAnnouncementAPI.as_view(), name="contest_announcement_admin_api"),
     re_path(r"^contest/acm_helper/?$", ACMContestHelper.as_view(), name="acm_contest_helper"),
+    re_path(r"^contest/rank_reveal/?$", ContestRankRevealAPI.as_view(), name="contest_rank_reveal_api"),
     re_path(r"^download_submissions/?$", DownloadContestSubmissions.as_view(), name="acm_contest_helper"),
 ]
 
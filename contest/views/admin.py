@@ -10,18 +10,31 @@ from account.decorators import check_contest_permission, ensure_created_by
 from account.models import User
 from submission.models import Submission, JudgeStatus
 from utils.api import APIView, validate_serializer
-from utils.cache import cache
-from utils.constants import CacheKey
 from utils.shortcuts import rand_str
 from utils.tasks import delete_files
 from ..models import Contest, ContestAnnouncement, ACMContestRank
+from ..scoreboard import ContestScoreboard, FrozenScoreboard
 from ..serializers import (ContestAnnouncementSerializer, ContestAdminSerializer,
                            CreateConetestSeriaizer, CreateContestAnnouncementSerializer,
                            EditConetestSeriaizer, EditContestAnnouncementSerializer,
-                           ACMContesHelperSerializer, )
+                           ACMContesHelperSerializer, ContestRankRevealSerializer, )
 
 
 class ContestAPI(APIView):
+    def _parse_freeze_time(self, data):
+        for key in ("freeze_time", "unfreeze_time"):
+            if data.get(key):
+                data[key] = dateutil.parser.parse(data[key])
+            else:
+                data[key] = None
+        if data["freeze_time"]:
+            if not data["start_time"] < data["freeze_time"] <= data["end_time"]:
+                return "Freeze time must be between start time and end time"
+            if data["unfreeze_time"] and data["unfreeze_time"] < data["freeze_time"]:
+                return "Unfreeze time must occur later than freeze time"
+        elif data["unfreeze_time"]:
+            return "Unfreeze time requires a freeze time"
+
     @validate_serializer(CreateConetestSeriaizer)
     def post(self, request):
         data = request.data
@@ -30,6 +43,9 @@ class ContestAPI(APIView):
         data["created_by"] = request.user
         if data["end_time"] <= data["start_time"]:
             return self.error("Start time must occur earlier than end time")
+        error = self._parse_freeze_time(data)
+        if error:
+            return self.error(error)
         if data.get("password") and data["password"] == "":
             data["password"] = None
         for ip_range in data["allowed_ip_ranges"]:
@@ -52,6 +68,9 @@ class ContestAPI(APIView):
         data["end_time"] = dateutil.parser.parse(data["end_time"])
         if data["end_time"] <= data["start_time"]:
             return self.error("Start time must occur earlier than end time")
+        error = self._parse_freeze_time(data)
+        if error:
+            return self.error(error)
         if not data["password"]:
             data["password"] = None
         for ip_range in data["allowed_ip_ranges"]:
@@ -60,8 +79,10 @@ class ContestAPI(APIView):
             except ValueError:
                 return self.error(f"{ip_range} is not a valid cidr network")
         if not contest.real_time_rank and data.get("real_time_rank"):
-            cache_key = f"{CacheKey.contest_rank_cache}:{contest.id}"
-            cache.delete(cache_key)
+            ContestScoreboard(contest).delete()
+        if contest.freeze_time != data["freeze_time"]:
+            # 封榜时间修改后重新生成快照
+            FrozenScoreboard(contest).delete()
 
         for k, v in data.items():
             setattr(contest, k, v)
@@ -192,9 +213,40 @@ class ACMContestHelper(APIView):
             return self.error("Problem id does not exist")
         problem_rank_status["checked"] = data["checked"]
         rank.save(update_fields=("submission_info",))
+        ContestScoreboard(self.contest).update(rank, rank.user)
         return self.success()
 
 
+class ContestRankRevealAPI(APIView):
+    def get(self, request):
+        try:
+            contest = Contest.objects.get(id=request.GET.get("contest_id"))
+            ensure_created_by(contest, request.user)
+        except (Contest.DoesNotExist, ValueError):
+            return self.error("Contest does not exist")
+        frozen = FrozenScoreboard(contest)
+        return self.success({"is_rank_frozen": contest.is_rank_frozen,
+                             "has_snapshot": frozen.exists(),
+                             "pending": frozen.pending()})
+
+    @validate_serializer(ContestRankRevealSerializer)
+    def put(self, request):
+        """
+        滚榜：按封榜快照中从后往前的顺序揭晓封榜后有变化的用户
+        """
+        data = request.data
+        try:
+            contest = Contest.objects.get(id=data["contest_id"])
+            ensure_created_by(contest, request.user)
+        except Contest.DoesNotExist:
+            return self.error("Contest does not exist")
+        frozen = FrozenScoreboard(contest)
+        if not frozen.exists():
+            return self.error("Rank is not frozen")
+        users = frozen.reveal(data["count"])
+        return self.success({"revealed": users, "pending": frozen.pending()})
+
+
 class DownloadContestSubmissions(APIView):
     def _dump_submissions(self, contest, exclude_admin=True):
         problem_ids = contest.problem_set.all().values_list("id", "_id")
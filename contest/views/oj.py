@@ -1,22 +1,17 @@
-import io
-
-import xlsxwriter
-from django.http import HttpResponse
+from django.http import FileResponse, StreamingHttpResponse
 from django.utils.timezone import now
-from django.core.cache import cache
 
-from problem.models import Problem
 from utils.api import APIView, validate_serializer
-from utils.constants import CacheKey, CONTEST_PASSWORD_SESSION_KEY
+from utils.constants import CONTEST_PASSWORD_SESSION_KEY
 from utils.shortcuts import datetime2str, check_is_id
-from account.models import AdminType
 from account.decorators import login_required, check_contest_permission, check_contest_password
 
-from utils.constants import ContestRuleType, ContestStatus
-from ..models import ContestAnnouncement, Contest, OIContestRank, ACMContestRank
+from utils.constants import ContestStatus
+from ..export import ContestRankExporter
+from ..models import ContestAnnouncement, Contest
+from ..scoreboard import ContestScoreboard, FrozenScoreboard
 from ..serializers import ContestAnnouncementSerializer
 from ..serializers import ContestSerializer, ContestPasswordVerifySerializer
-from ..serializers import OIContestRankSerializer, ACMContestRankSerializer
 
 
 class ContestAnnouncementListAPI(APIView):
@@ -103,90 +98,27 @@ class ContestAccessAPI(APIView):
 
 
 class ContestRankAPI(APIView):
-    def get_rank(self):
-        if self.contest.rule_type == ContestRuleType.ACM:
-            return ACMContestRank.objects.filter(contest=self.contest,
-                                                 user__admin_type=AdminType.REGULAR_USER,
-                                                 user__is_disabled=False).\
-                select_related("user").order_by("-accepted_number", "total_time")
-        else:
-            return OIContestRank.objects.filter(contest=self.contest,
-                                                user__admin_type=AdminType.REGULAR_USER,
-                                                user__is_disabled=False). \
-                select_related("user").order_by("-total_score")
-
-    def column_string(self, n):
-        string = ""
-        while n > 0:
-            n, remainder = divmod(n - 1, 26)
-            string = chr(65 + remainder) + string
-        return string
-
     @check_contest_permission(check_type="ranks")
     def get(self, request):
         download_csv = request.GET.get("download_csv")
         force_refresh = request.GET.get("force_refresh")
         is_contest_admin = request.user.is_authenticated and request.user.is_contest_admin(self.contest)
-        if self.contest.rule_type == ContestRuleType.OI:
-            serializer = OIContestRankSerializer
-        else:
-            serializer = ACMContestRankSerializer
-
-        if force_refresh == "1" and is_contest_admin:
-            qs = self.get_rank()
-        else:
-            cache_key = f"{CacheKey.contest_rank_cache}:{self.contest.id}"
-            qs = cache.get(cache_key)
-            if not qs:
-                qs = self.get_rank()
-                cache.set(cache_key, qs)
+        # 封榜期间普通用户只能看到封榜快照
+        frozen = not is_contest_admin and self.contest.is_rank_frozen
 
         if download_csv:
-            data = serializer(qs, many=True, is_contest_admin=is_contest_admin).data
-            contest_problems = Problem.objects.filter(contest=self.contest, visible=True).order_by("_id")
-            problem_ids = [item.id for item in contest_problems]
-
-            f = io.BytesIO()
-            workbook = xlsxwriter.Workbook(f)
-            worksheet = workbook.add_worksheet()
-            worksheet.write("A1", "User ID")
-            worksheet.write("B1", "Username")
-            worksheet.write("C1", "Real Name")
-            if self.contest.rule_type == ContestRuleType.OI:
-                worksheet.write("D1", "Total Score")
-                for item in range(contest_problems.count()):
-                    worksheet.write(self.column_string(5 + item) + "1", f"{contest_problems[item].title}")
-                for index, item in enumerate(data):
-                    worksheet.write_string(index + 1, 0, str(item["user"]["id"]))
-                    worksheet.write_string(index + 1, 1, item["user"]["username"])
-                    worksheet.write_string(index + 1, 2, item["user"]["real_name"] or "")
-                    worksheet.write_string(index + 1, 3, str(item["total_score"]))
-                    for k, v in item["submission_info"].items():
-                        worksheet.write_string(index + 1, 4 + problem_ids.index(int(k)), str(v))
-            else:
-                worksheet.write("D1", "AC")
-                worksheet.write("E1", "Total Submission")
-                worksheet.write("F1", "Total Time")
-                for item in range(contest_problems.count()):
-                    worksheet.write(self.column_string(7 + item) + "1", f"{contest_problems[item].title}")
-
-                for index, item in enumerate(data):
-                    worksheet.write_string(index + 1, 0, str(item["user"]["id"]))
-                    worksheet.write_string(index + 1, 1, item["user"]["username"])
-                    worksheet.write_string(index + 1, 2, item["user"]["real_name"] or "")
-                    worksheet.write_string(index + 1, 3, str(item["accepted_number"]))
-                    worksheet.write_string(index + 1, 4, str(item["submission_number"]))
-                    worksheet.write_string(index + 1, 5, str(item["total_time"]))
-                    for k, v in item["submission_info"].items():
-                        worksheet.write_string(index + 1, 6 + problem_ids.index(int(k)), str(v["is_ac"]))
-
-            workbook.close()
-            f.seek(0)
-            response = HttpResponse(f.read())
+            exporter = ContestRankExporter(self.contest, is_contest_admin=is_contest_admin, frozen=frozen)
+            if request.GET.get("format") == "csv":
+                response = StreamingHttpResponse(exporter.iter_csv(), content_type="text/csv")
+                response["Content-Disposition"] = f"attachment; filename=content-{self.contest.id}-rank.csv"
+                return response
+            response = FileResponse(exporter.to_xlsx())
             response["Content-Disposition"] = f"attachment; filename=content-{self.contest.id}-rank.xlsx"
             response["Content-Type"] = "application/xlsx"
             return response
 
-        page_qs = self.paginate_data(request, qs)
-        page_qs["results"] = serializer(page_qs["results"], many=True, is_contest_admin=is_contest_admin).data
-        return self.success(page_qs)
+        scoreboard = FrozenScoreboard(self.contest) if frozen else ContestScoreboard(self.contest)
+        if force_refresh == "1" and is_contest_admin:
+            scoreboard.ensure_built(force=True)
+        limit, offset = self.get_limit_offset(request)
+        return self.success_raw(scoreboard.page_json(offset, limit, is_contest_admin))
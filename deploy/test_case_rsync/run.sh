@@ -1,10 +1,89 @@
 #!/usr/bin/env sh
 
+# 从节点只拉取 journal 中新增的测试用例，不再每次遍历整个目录
+# 设置 JUDGE_SERVER_HOSTNAME、BACKEND_URL、JUDGE_SERVER_TOKEN 后会向后端上报同步进度，
+# 后端只会把题目分配给已经同步了对应测试用例的判题服务器
+MASTER="$RSYNC_USER@$RSYNC_MASTER_ADDR::testcase"
+RSYNC="rsync -aH --password-file=/etc/rsync_slave.passwd"
+APPLIED=/log/test_case_journal_applied
+WORK=/tmp/test_case_journal
+# 主节点的临时文件、去重索引和变更日志只在主节点上使用，日志由 journal_sync 单独拉取到 $WORK
+# --delete-excluded 同时删除之前全量同步时复制过来的这些目录
+EXCLUDE="--exclude=/tmp/ --exclude=/manifests/ --exclude=/journal/ --delete-excluded"
+
+report()
+{
+    if [ -z "$JUDGE_SERVER_HOSTNAME" ] || [ -z "$BACKEND_URL" ]; then
+        return
+    fi
+    token=$(printf "%s" "$JUDGE_SERVER_TOKEN" | sha256sum | cut -d " " -f 1)
+    wget -q -O /dev/null --header "Content-Type: application/json" --header "X-Judge-Server-Token: $token" \
+        --post-data "{\"hostname\": \"$JUDGE_SERVER_HOSTNAME\", \"journal_seq\": $1}" \
+        "$BACKEND_URL/api/judge_server_test_case_sync" || true
+}
+
+full_sync()
+{
+    $RSYNC "$MASTER/journal/head" $WORK/head 2>/dev/null || echo 0 > $WORK/head
+    $RSYNC -zP --delete $EXCLUDE "$MASTER" /test_case >> /log/rsync_slave.log || return 1
+    cp $WORK/head $APPLIED
+}
+
+journal_sync()
+{
+    $RSYNC "$MASTER/journal/head" $WORK/head || return 1
+    head=$(cat $WORK/head)
+    applied=$(cat $APPLIED 2>/dev/null || echo 0)
+    if [ "$head" -le "$applied" ]; then
+        report "$applied"
+        return 0
+    fi
+    rm -rf $WORK/entries && mkdir -p $WORK/entries
+    seq $((applied + 1)) "$head" > $WORK/seqs
+    # 落后太多，日志已经被清理，改为全量同步
+    if ! $RSYNC --files-from=$WORK/seqs "$MASTER/journal/" $WORK/entries/ >> /log/rsync_slave.log; then
+        full_sync && report "$(cat $APPLIED)"
+        return
+    fi
+
+    : > $WORK/files
+    : > $WORK/removed
+    for s in $(cat $WORK/seqs); do
+        read -r action test_case_id < $WORK/entries/$s
+        if [ "$action" = "add" ]; then
+            tail -n +2 $WORK/entries/$s >> $WORK/files
+        else
+            echo "$test_case_id" >> $WORK/removed
+        fi
+    done
+    if [ -s $WORK/files ]; then
+        $RSYNC -rz --files-from=$WORK/files "$MASTER/" /test_case/ >> /log/rsync_slave.log
+        # 23/24 表示部分文件在主节点上已经被删除，随后的 remove 日志会处理
+        code=$?
+        if [ $code -ne 0 ] && [ $code -ne 23 ] && [ $code -ne 24 ]; then
+            return 1
+        fi
+    fi
+    if [ -s $WORK/removed ]; then
+        for test_case_id in $(cat $WORK/removed); do
+            rm -rf "/test_case/$test_case_id"
+        done
+        # 已经没有测试用例引用的 blob
+        find /test_case/blobs -type f -links 1 -delete 2>/dev/null
+    fi
+    echo "$head" > $APPLIED
+    report "$head"
+}
+
 slave_runner()
 {
+    mkdir -p $WORK
+    until full_sync; do
+        sleep 5
+    done
     while true
     do
-        rsync -avzP --delete --progress --password-file=/etc/rsync_slave.passwd $RSYNC_USER@$RSYNC_MASTER_ADDR::testcase /test_case >> /log/rsync_slave.log
+        journal_sync
         sleep 5
     done
 }
@@ -0,0 +1,197 @@
+import json
+import time
+
+from django.conf import settings
+
+from utils.cache import cache, RedisScript
+from utils.constants import CacheKey, JudgeLane
+from judge.slots import HEARTBEAT_TIMEOUT, JUDGE_MAX_DURATION, judge_slots
+
+# 出队后在该时间内没有确认的任务会被重新放回队列，保证至少投递一次
+# 开始判题时重新计时（extend），之后至少要能容纳一次最长的判题，正在判题的任务不会被重复投递
+VISIBILITY_TIMEOUT = JUDGE_MAX_DURATION + 300
+# 保留最近若干次排队等待时间，用于计算分位数
+WAIT_TIME_SAMPLES = 1000
+
+# KEYS: processing, busy, capacity, heartbeat, credit, 之后每个通道依次为 queue, lane_leases
+# ARGV: now, heartbeat_timeout, visible_at, default_lane, 之后每个通道依次为 name, weight, cap
+# 按空闲槽位数出队，多个通道都有排队的任务时使用平滑加权轮询（smooth weighted round robin），
+# 每个通道的当前权重保存在 credit 中，多次出队之间保持按 weight 的比例分配
+_drain_script = RedisScript("""
+local now = tonumber(ARGV[1])
+local lanes = {}
+local index = {}
+for i = 0, (#KEYS - 5) / 2 - 1 do
+    local lane = {name = ARGV[5 + i * 3], weight = tonumber(ARGV[6 + i * 3]), cap = tonumber(ARGV[7 + i * 3]),
+                  queue = KEYS[6 + i * 2], leases = KEYS[7 + i * 2]}
+    lanes[#lanes + 1] = lane
+    index[lane.name] = lane
+end
+
+-- 超时未确认的任务重新放回所在通道的队首
+local expired = redis.call("ZRANGEBYSCORE", KEYS[1], "-inf", now)
+for _, item in ipairs(expired) do
+    redis.call("ZREM", KEYS[1], item)
+    local lane = index[string.match(item, '"lane": "([%w_]+)"') or ""] or index[ARGV[4]]
+    redis.call("RPUSH", lane.queue, item)
+end
+
+local free = 0
+local servers = redis.call("ZRANGE", KEYS[2], 0, -1, "WITHSCORES")
+for i = 1, #servers, 2 do
+    local capacity = tonumber(redis.call("HGET", KEYS[3], servers[i]) or "0")
+    local heartbeat = tonumber(redis.call("HGET", KEYS[4], servers[i]) or "0")
+    if now - heartbeat <= tonumber(ARGV[2]) and capacity > tonumber(servers[i + 1]) then
+        free = free + capacity - tonumber(servers[i + 1])
+    end
+end
+
+for _, lane in ipairs(lanes) do
+    lane.depth = redis.call("LLEN", lane.queue)
+    lane.allowance = free
+    if lane.cap > 0 then
+        lane.allowance = lane.cap - redis.call("ZCOUNT", lane.leases, now, "+inf")
+    end
+    lane.current = tonumber(redis.call("HGET", KEYS[5], lane.name) or "0")
+end
+
+local items = {}
+for i = 1, free do
+    local total = 0
+    local chosen = nil
+    for _, lane in ipairs(lanes) do
+        if lane.depth > 0 and lane.allowance > 0 then
+            lane.current = lane.current + lane.weight
+            total = total + lane.weight
+            if not chosen or lane.current > chosen.current then
+                chosen = lane
+            end
+        end
+    end
+    if not chosen then
+        break
+    end
+    chosen.current = chosen.current - total
+    chosen.depth = chosen.depth - 1
+    chosen.allowance = chosen.allowance - 1
+    local item = redis.call("RPOP", chosen.queue)
+    redis.call("ZADD", KEYS[1], ARGV[3], item)
+    items[#items + 1] = item
+end
+
+for _, lane in ipairs(lanes) do
+    -- 没有排队任务的通道不累积权重
+    if lane.depth == 0 then
+        lane.current = 0
+    end
+    redis.call("HSET", KEYS[5], lane.name, lane.current)
+end
+return items
+""")
+
+# KEYS: queue, processing
+# ARGV: item
+_requeue_script = RedisScript("""
+redis.call("ZREM", KEYS[2], ARGV[1])
+redis.call("RPUSH", KEYS[1], ARGV[1])
+""")
+
+
+class JudgeBacklog(object):
+    """
+    没有空闲判题服务器时提交进入所在优先级通道的队列，有槽位释放或判题服务器心跳时按空闲槽位数批量出队
+    出队的任务在确认前保存在 processing 中，超时后重新入队
+    """
+    def __init__(self, queue_key=CacheKey.waiting_queue, slots=judge_slots):
+        self.queue_key = queue_key
+        self.processing_key = f"{queue_key}:processing"
+        self.credit_key = f"{queue_key}:credit"
+        self.slots = slots
+
+    def lane_queue_key(self, lane):
+        return f"{self.queue_key}:{lane}"
+
+    def _wait_time_key(self, lane):
+        return f"{self.queue_key}:{lane}:wait_time"
+
+    def push(self, submission_id, problem_id, lane=JudgeLane.PRACTICE):
+        item = {"submission_id": submission_id, "problem_id": problem_id, "lane": lane, "enqueue_time": time.time()}
+        cache.lpush(self.lane_queue_key(lane), json.dumps(item))
+
+    def requeue(self, item):
+        """
+        已出队的任务仍然没有拿到槽位，放回队首等待下一次调度
+        """
+        lane = json.loads(item).get("lane", JudgeLane.PRACTICE)
+        _requeue_script(keys=[self.lane_queue_key(lane), self.processing_key], args=[item])
+
+    def ack(self, item):
+        cache.zrem(self.processing_key, item)
+
+    def extend(self, item):
+        """
+        拿到槽位开始判题时调用，出队后在 dramatiq 队列中等待的时间不计入判题时间
+        """
+        cache.zadd(self.processing_key, {item: time.time() + VISIBILITY_TIMEOUT}, xx=True)
+
+    def record_wait_time(self, item):
+        data = json.loads(item)
+        wait_time_key = self._wait_time_key(data.get("lane", JudgeLane.PRACTICE))
+        with cache.pipeline() as pipe:
+            pipe.lpush(wait_time_key, time.time() - data["enqueue_time"])
+            pipe.ltrim(wait_time_key, 0, WAIT_TIME_SAMPLES - 1)
+            pipe.execute()
+
+    def drain(self):
+        """
+        按当前空闲槽位数出队，返回出队的任务数量
+        """
+        # 防止循环引入
+        from judge.tasks import send_judge_task
+
+        now = time.time()
+        keys = [self.processing_key, self.slots.busy_key, self.slots.capacity_key, self.slots.heartbeat_key,
+                self.credit_key]
+        args = [now, HEARTBEAT_TIMEOUT, now + VISIBILITY_TIMEOUT, JudgeLane.PRACTICE]
+        for lane, config in settings.JUDGE_LANES.items():
+            keys += [self.lane_queue_key(lane), self.slots.lane_key(lane)]
+            args += [lane, max(config["weight"], 1), config["cap"]]
+        items = _drain_script(keys=keys, args=args)
+        for item in items:
+            item = item.decode("utf-8")
+            data = json.loads(item)
+            send_judge_task(data["submission_id"], data["problem_id"],
+                            lane=data.get("lane", JudgeLane.PRACTICE), backlog_item=item)
+        return len(items)
+
+    def stats(self):
+        lanes = list(settings.JUDGE_LANES)
+        with cache.pipeline() as pipe:
+            pipe.zcard(self.processing_key)
+            for lane in lanes:
+                pipe.llen(self.lane_queue_key(lane))
+                pipe.lrange(self._wait_time_key(lane), 0, -1)
+            in_flight, *results = pipe.execute()
+
+        def percentile(samples, p):
+            if not samples:
+                return None
+            return samples[min(int(len(samples) * p), len(samples) - 1)]
+
+        stats = {"depth": 0, "in_flight": in_flight, "lanes": {}}
+        for index, lane in enumerate(lanes):
+            depth, samples = results[index * 2], results[index * 2 + 1]
+            samples = sorted(float(item) for item in samples)
+            stats["depth"] += depth
+            stats["lanes"][lane] = {"depth": depth,
+                                    "judging": self.slots.lane_in_flight(lane),
+                                    "cap": settings.JUDGE_LANES[lane]["cap"],
+                                    "weight": settings.JUDGE_LANES[lane]["weight"],
+                                    "wait_time": {"samples": len(samples),
+                                                  "p50": percentile(samples, 0.5),
+                                                  "p90": percentile(samples, 0.9),
+                                                  "p99": percentile(samples, 0.99)}}
+        return stats
+
+
+judge_backlog = JudgeBacklog()
@@ -1,58 +1,89 @@
 import hashlib
-import json
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from urllib.parse import urljoin
 
 import requests
-from django.db import transaction, IntegrityError
-from django.db.models import F
+from django.conf import settings
+from django.db import connection, transaction, IntegrityError
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
 
 from account.models import User
 from conf.models import JudgeServer
 from contest.models import ContestRuleType, ACMContestRank, OIContestRank, ContestStatus
+from contest.scoreboard import ContestScoreboard
 from options.options import SysOptions
-from problem.models import Problem, ProblemRuleType
+from problem.models import Problem, ProblemRuleType, UserProblemStatus
+from problem.test_case_journal import test_case_journal
 from problem.utils import parse_problem_template
 from submission.models import JudgeStatus, Submission
-from utils.cache import cache
-from utils.constants import CacheKey
+from submission.status import submission_status
+from utils.constants import JudgeLane
+from judge.backlog import judge_backlog
+from judge.payload import judge_payload
+from judge.slots import HEARTBEAT_TIMEOUT, JudgeServerSlot, judge_slots
+from judge.spj import spj_cache
+from judge.statistic import statistic_buffer
 
 logger = logging.getLogger(__name__)
 
-
-# 继续处理在队列中的问题
-def process_pending_task():
-    if cache.llen(CacheKey.waiting_queue):
-        # 防止循环引入
-        from judge.tasks import judge_task
-        tmp_data = cache.rpop(CacheKey.waiting_queue)
-        if tmp_data:
-            data = json.loads(tmp_data.decode("utf-8"))
-            judge_task.send(**data)
+# 并行编译特殊判题的最大判题服务器数量
+SPJ_COMPILE_WORKERS = 16
 
 
 class ChooseJudgeServer:
+    def __init__(self, required_seq=0, affinity_key=None, lane=JudgeLane.PRACTICE):
+        self.slot = None
+        self.required_seq = required_seq
+        self.affinity_key = affinity_key
+        self.lane = lane
+
+    def __enter__(self) -> [JudgeServerSlot, None]:
+        # 从 Redis 中原子地申请一个空闲槽位，优先选择任务数量最少的判题服务器
+        # required_seq 不为 0 时只选择已经同步了对应测试用例的判题服务器
+        # 所在优先级通道正在判题的数量达到上限时同样返回 None
+        self.slot = judge_slots.claim(required_seq=self.required_seq, affinity_key=self.affinity_key, lane=self.lane)
+        return self.slot
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.slot:
+            # 任务完成后，归还槽位，并按空闲槽位数处理排队中的任务
+            judge_slots.release(self.slot)
+            judge_backlog.drain()
+
+
+class JudgeServerSessionPool(object):
+    """
+    每个进程内为每台判题服务器维护一个 keep-alive 的连接池，供所有 dramatiq 线程复用
+    service_url 变化后旧的连接池会被关闭并重建
+    """
     def __init__(self):
-        self.server = None
+        self._sessions = {}
+        self._lock = threading.Lock()
 
-    def __enter__(self) -> [JudgeServer, None]:
-        with transaction.atomic():
-            # 获取所有可用的判题服务器，并按任务数量排序
-            servers = JudgeServer.objects.select_for_update().filter(is_disabled=False).order_by("task_number")
-            servers = [s for s in servers if s.status == "normal"]
-            for server in servers:
-                # 如果任务数量小于等于CPU核心数的两倍，则选择该服务器
-                if server.task_number <= server.cpu_core * 2:
-                    server.task_number = F("task_number") + 1
-                    server.save(update_fields=["task_number"])
-                    self.server = server
-                    return server
-        return None
+    def _create_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.JUDGE_SERVER_POOL_SIZE, pool_block=True)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.server:
-            # 任务完成后，减少任务数量
-            JudgeServer.objects.filter(id=self.server.id).update(task_number=F("task_number") - 1)
+    def get(self, server):
+        with self._lock:
+            item = self._sessions.get(server.id)
+            if item and item[0] == server.service_url:
+                return item[1]
+            if item:
+                item[1].close()
+            session = self._create_session()
+            self._sessions[server.id] = (server.service_url, session)
+            return session
+
+
+judge_server_sessions = JudgeServerSessionPool()
 
 
 class DispatcherBase(object):
@@ -60,12 +91,16 @@ class DispatcherBase(object):
         # 生成判题服务器的token
         self.token = hashlib.sha256(SysOptions.judge_server_token.encode("utf-8")).hexdigest()
 
-    def _request(self, url, data=None):
-        kwargs = {"headers": {"X-Judge-Server-Token": self.token}}
+    def _request(self, server, path, data=None, body=None, headers=None):
+        kwargs = {"headers": {"X-Judge-Server-Token": self.token, **(headers or {})},
+                  "timeout": (settings.JUDGE_SERVER_CONNECT_TIMEOUT, settings.JUDGE_SERVER_READ_TIMEOUT)}
         if data:
             kwargs["json"] = data
+        if body:
+            kwargs["data"] = body
         try:
-            return requests.post(url, **kwargs).json()
+            session = judge_server_sessions.get(server)
+            return session.post(urljoin(server.service_url, path), **kwargs).json()
         except Exception as e:
             logger.exception(e)
 
@@ -74,31 +109,61 @@ class SPJCompiler(DispatcherBase):
     def __init__(self, spj_code, spj_version, spj_language):
         super().__init__()
         # 获取特殊判题的编译配置
-        spj_compile_config = list(filter(lambda config: spj_language == config["name"], SysOptions.spj_languages))[0]["spj"][
-            "compile"]
+        spj_compile_config = SysOptions.language_registry.spj_compile_config(spj_language)
+        self.spj_version = spj_version
         self.data = {
             "src": spj_code,
             "spj_version": spj_version,
             "spj_compile_config": spj_compile_config
         }
 
+    def _compile_on(self, server):
+        result = self._request(server, "compile_spj", data=self.data)
+        if not result:
+            return "Failed to call judge server"
+        if result["err"]:
+            return result["data"]
+        spj_cache.add(server.id, self.spj_version)
+
+    def compile_on(self, servers):
+        """
+        在还没有编译过该版本的判题服务器上并行编译，返回第一个错误信息，全部成功时返回 None
+        """
+        servers = spj_cache.missing(servers, self.spj_version)
+        if not servers:
+            return None
+        with ThreadPoolExecutor(max_workers=min(len(servers), SPJ_COMPILE_WORKERS)) as executor:
+            errors = list(executor.map(self._compile_on, servers))
+        # 编译错误在所有判题服务器上都相同，优先返回编译错误而不是调用失败
+        errors = [error for error in errors if error]
+        errors.sort(key=lambda error: error == "Failed to call judge server")
+        return errors[0] if errors else None
+
     def compile_spj(self):
-        with ChooseJudgeServer() as server:
-            if not server:
-                return "No available judge_server"
-            result = self._request(urljoin(server.service_url, "compile_spj"), data=self.data)
-            if not result:
-                return "Failed to call judge server"
-            if result["err"]:
-                return result["data"]
+        # 同时在所有正常的判题服务器上编译，避免各个判题服务器在第一次判题时才编译
+        alive_since = timezone.now() - timedelta(seconds=HEARTBEAT_TIMEOUT)
+        servers = list(JudgeServer.objects.filter(is_disabled=False, last_heartbeat__gte=alive_since))
+        if not servers:
+            return "No available judge_server"
+        return self.compile_on(servers)
 
 
 class JudgeDispatcher(DispatcherBase):
-    def __init__(self, submission_id, problem_id):
+    def __init__(self, submission_id, problem_id, backlog_item=None, lane=JudgeLane.PRACTICE, rejudge_job=None):
         super().__init__()
+        # 从等待队列中出队的任务
+        self.backlog_item = backlog_item
+        self.lane = lane
+        # 没有空闲的判题服务器、放回等待队列时为 True
+        self.requeued = False
         self.submission = Submission.objects.get(id=submission_id)
         self.contest_id = self.submission.contest_id
         self.last_result = self.submission.result if self.submission.info else None
+        # 系统错误没有计入统计，重新判题时按第一次判题处理
+        if self.last_result == JudgeStatus.SYSTEM_ERROR:
+            self.last_result = None
+        # 批量重判的任务 id，判题结束后不逐条更新统计数据，由 judge_task 记录完成
+        self.rejudge_job = rejudge_job
 
         if self.contest_id:
             self.problem = Problem.objects.select_related("contest").get(id=problem_id, contest_id=self.contest_id)
@@ -127,15 +192,29 @@ class JudgeDispatcher(DispatcherBase):
                 return
             self.submission.statistic_info["score"] = score
 
+    def _judge_request(self, server, data, language, config_version):
+        """
+        判题服务器已经有的特殊判题和配置只发送 hash，判题服务器报告缺少时发送完整内容重试一次
+        """
+        request = judge_payload.encode(server.id, data, language, self.problem.spj_language,
+                                       config_version=config_version)
+        resp = self._request(server, "/judge", body=request.body, headers=request.headers)
+        if request.is_slim and request.is_miss(resp):
+            judge_payload.forget(request)
+            request = judge_payload.encode(server.id, data, language, self.problem.spj_language, full=True,
+                                           config_version=config_version)
+            resp = self._request(server, "/judge", body=request.body, headers=request.headers)
+        # 判题服务器先编译特殊判题再编译提交的代码，编译错误时特殊判题也已经编译好了
+        if resp and resp["err"] in (None, "CompileError"):
+            judge_payload.remember(request, spj_version=self.problem.spj_version)
+        return resp
+
     def judge(self):
         language = self.submission.language
-        sub_config = list(filter(lambda item: language == item["name"], SysOptions.languages))[0]
+        registry = SysOptions.language_registry
         spj_config = {}
         if self.problem.spj_code:
-            for lang in SysOptions.spj_languages:
-                if lang["name"] == self.problem.spj_language:
-                    spj_config = lang["spj"]
-                    break
+            spj_config = registry.spj_config(self.problem.spj_language)
 
         if language in self.problem.template:
             template = parse_problem_template(self.problem.template[language])
@@ -144,7 +223,7 @@ class JudgeDispatcher(DispatcherBase):
             code = self.submission.code
 
         data = {
-            "language_config": sub_config["config"],
+            "language_config": registry.config(language),
             "src": code,
             "max_cpu_time": self.problem.time_limit,
             "max_memory": 1024 * 1024 * self.problem.memory_limit,
@@ -157,16 +236,28 @@ class JudgeDispatcher(DispatcherBase):
             "io_mode": self.problem.io_mode
         }
 
-        with ChooseJudgeServer() as server:
+        test_case_id = self.problem.test_case_id
+        required_seq = test_case_journal.required_seq(test_case_id)
+        with ChooseJudgeServer(required_seq, affinity_key=test_case_id, lane=self.lane) as server:
             if not server:
-                data = {"submission_id": self.submission.id, "problem_id": self.problem.id}
-                cache.lpush(CacheKey.waiting_queue, json.dumps(data))
+                if self.backlog_item:
+                    judge_backlog.requeue(self.backlog_item)
+                else:
+                    judge_backlog.push(self.submission.id, self.problem.id, lane=self.lane)
+                self.requeued = True
                 return
+            if self.backlog_item:
+                judge_backlog.extend(self.backlog_item)
+                judge_backlog.record_wait_time(self.backlog_item)
             Submission.objects.filter(id=self.submission.id).update(result=JudgeStatus.JUDGING)
-            resp = self._request(urljoin(server.service_url, "/judge"), data=data)
+            submission_status.publish(self.submission.id, JudgeStatus.JUDGING)
+            resp = self._judge_request(server, data, language, registry.version)
 
         if not resp:
-            Submission.objects.filter(id=self.submission.id).update(result=JudgeStatus.SYSTEM_ERROR)
+            self.submission.result = JudgeStatus.SYSTEM_ERROR
+            if self._save_result():
+                submission_status.publish(self.submission.id, JudgeStatus.SYSTEM_ERROR,
+                                          self.submission.statistic_info)
             return
 
         if resp["err"]:
@@ -186,143 +277,123 @@ class JudgeDispatcher(DispatcherBase):
                 self.submission.result = error_test_case[0]["result"]
             else:
                 self.submission.result = JudgeStatus.PARTIALLY_ACCEPTED
-        self.submission.save()
-
-        if self.contest_id:
-            if self.contest.status != ContestStatus.CONTEST_UNDERWAY or \
-                    User.objects.get(id=self.submission.user_id).is_contest_admin(self.contest):
-                logger.info(
-                    "Contest debug mode, id: " + str(self.contest_id) + ", submission id: " + self.submission.id)
-                return
-            with transaction.atomic():
-                self.update_contest_problem_status()
-                self.update_contest_rank()
+        if self.rejudge_job or self.submission.result == JudgeStatus.SYSTEM_ERROR:
+            # 批量重判全部判完后统一重新计算统计数据，系统错误不计入统计
+            saved = self._save_result()
+        elif self.contest_id:
+            saved = self._save_contest_result()
         else:
-            if self.last_result:
-                self.update_problem_status_rejudge()
-            else:
-                self.update_problem_status()
-
-        # 至此判题结束，尝试处理任务队列中剩余的任务
-        process_pending_task()
+            with transaction.atomic():
+                # 保存结果和累加增量期间持有题目的共享锁，多个判题之间不互相等待，
+                # 重新计算题目统计时的 select_for_update 会等待这些判题完成，读取到的提交与累加的增量一致
+                self._lock_problem_for_share()
+                saved = self._save_result()
+                if saved:
+                    if self.last_result:
+                        self.update_problem_status_rejudge()
+                    else:
+                        self.update_problem_status()
+        if saved:
+            submission_status.publish(self.submission.id, self.submission.result, self.submission.statistic_info)
+
+    def _save_result(self):
+        """
+        只在提交仍然处于 JUDGING 时写入结果，返回是否写入
+        同一个提交被重复投递、同时判了两次时，只有先完成的一次写入结果并更新统计数据
+        """
+        return Submission.objects.filter(id=self.submission.id, result=JudgeStatus.JUDGING).update(
+            result=self.submission.result, info=self.submission.info,
+            statistic_info=self.submission.statistic_info) == 1
+
+    def _lock_problem_for_share(self):
+        # Django 3.2 没有 FOR SHARE 的接口，不支持行锁的数据库（sqlite）不需要
+        if not connection.features.has_select_for_update:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT id FROM {connection.ops.quote_name(Problem._meta.db_table)} "
+                           "WHERE id = %s FOR SHARE", [self.problem.id])
+
+    def _save_contest_result(self):
+        if self.contest.status != ContestStatus.CONTEST_UNDERWAY or \
+                User.objects.get(id=self.submission.user_id).is_contest_admin(self.contest):
+            logger.info(
+                "Contest debug mode, id: " + str(self.contest_id) + ", submission id: " + self.submission.id)
+            return self._save_result()
+        with transaction.atomic():
+            # 先锁定题目再保存结果，重新计算比赛统计时同样先锁定题目，读取到的提交与统计数据一致
+            Problem.objects.select_for_update().filter(id=self.problem.id).values_list("id").get()
+            if not self._save_result():
+                return False
+            self.update_contest_problem_status()
+            self.update_contest_rank()
+        return True
+
+    def _get_user_problem_status(self):
+        # 只锁定该用户在这道题目上的一行状态，返回 (status, created)
+        defaults = {"contest_id": self.contest_id, "status": self.submission.result,
+                    "score": self.submission.statistic_info.get("score", 0)}
+        return UserProblemStatus.objects.select_for_update().get_or_create(user_id=self.submission.user_id,
+                                                                           problem_id=self.problem.id,
+                                                                           defaults=defaults)
+
+    def _update_user_problem_status(self):
+        """
+        更新用户在非比赛题目上的状态，返回用户计数的增量
+        """
+        user_deltas = {}
+        score = self.submission.statistic_info.get("score", 0)
+        with transaction.atomic():
+            status, created = self._get_user_problem_status()
+            if created:
+                if self.problem.rule_type == ProblemRuleType.OI:
+                    user_deltas["total_score"] = score
+                if self.submission.result == JudgeStatus.ACCEPTED:
+                    user_deltas["accepted_number"] = 1
+            elif status.status != JudgeStatus.ACCEPTED:
+                if self.problem.rule_type == ProblemRuleType.OI:
+                    # 减去上次得分，增加本次得分
+                    user_deltas["total_score"] = score - status.score
+                    status.score = score
+                status.status = self.submission.result
+                status.save(update_fields=["status", "score"])
+                if self.submission.result == JudgeStatus.ACCEPTED:
+                    user_deltas["accepted_number"] = 1
+        return user_deltas
 
     def update_problem_status_rejudge(self):
         result = str(self.submission.result)
-        problem_id = str(self.problem.id)
-        with transaction.atomic():
-            # 更新题目状态
-            problem = Problem.objects.select_for_update().get(contest_id=self.contest_id, id=self.problem.id)
-            if self.last_result != JudgeStatus.ACCEPTED and self.submission.result == JudgeStatus.ACCEPTED:
-                problem.accepted_number += 1
-            problem_info = problem.statistic_info
-            problem_info[self.last_result] = problem_info.get(self.last_result, 1) - 1
-            problem_info[result] = problem_info.get(result, 0) + 1
-            problem.save(update_fields=["accepted_number", "statistic_info"])
-
-            profile = User.objects.select_for_update().get(id=self.submission.user_id).userprofile
-            if problem.rule_type == ProblemRuleType.ACM:
-                acm_problems_status = profile.acm_problems_status.get("problems", {})
-                if acm_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    acm_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        profile.accepted_number += 1
-                profile.acm_problems_status["problems"] = acm_problems_status
-                profile.save(update_fields=["accepted_number", "acm_problems_status"])
-
-            else:
-                oi_problems_status = profile.oi_problems_status.get("problems", {})
-                score = self.submission.statistic_info["score"]
-                if oi_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    # 减去上次得分，增加本次得分
-                    profile.add_score(this_time_score=score,
-                                      last_time_score=oi_problems_status[problem_id]["score"])
-                    oi_problems_status[problem_id]["score"] = score
-                    oi_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        profile.accepted_number += 1
-                profile.oi_problems_status["problems"] = oi_problems_status
-                profile.save(update_fields=["accepted_number", "oi_problems_status"])
+        # 题目的计数增量交给 statistic_buffer 批量写入
+        problem_deltas = {f"result:{self.last_result}": -1}
+        problem_deltas[f"result:{result}"] = problem_deltas.get(f"result:{result}", 0) + 1
+        if self.last_result != JudgeStatus.ACCEPTED and self.submission.result == JudgeStatus.ACCEPTED:
+            problem_deltas["accepted_number"] = 1
+        user_deltas = self._update_user_problem_status()
+        statistic_buffer.add(problem_deltas=(self.problem.id, problem_deltas),
+                             user_id=self.submission.user_id, user_deltas=user_deltas)
 
     def update_problem_status(self):
         result = str(self.submission.result)
-        problem_id = str(self.problem.id)
-        with transaction.atomic():
-            # 更新题目状态
-            problem = Problem.objects.select_for_update().get(contest_id=self.contest_id, id=self.problem.id)
-            problem.submission_number += 1
-            if self.submission.result == JudgeStatus.ACCEPTED:
-                problem.accepted_number += 1
-            problem_info = problem.statistic_info
-            problem_info[result] = problem_info.get(result, 0) + 1
-            problem.save(update_fields=["accepted_number", "submission_number", "statistic_info"])
-
-            # 更新用户信息
-            user = User.objects.select_for_update().get(id=self.submission.user_id)
-            user_profile = user.userprofile
-            user_profile.submission_number += 1
-            if problem.rule_type == ProblemRuleType.ACM:
-                acm_problems_status = user_profile.acm_problems_status.get("problems", {})
-                if problem_id not in acm_problems_status:
-                    acm_problems_status[problem_id] = {"status": self.submission.result, "_id": self.problem._id}
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                elif acm_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    acm_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                user_profile.acm_problems_status["problems"] = acm_problems_status
-                user_profile.save(update_fields=["submission_number", "accepted_number", "acm_problems_status"])
-
-            else:
-                oi_problems_status = user_profile.oi_problems_status.get("problems", {})
-                score = self.submission.statistic_info["score"]
-                if problem_id not in oi_problems_status:
-                    user_profile.add_score(score)
-                    oi_problems_status[problem_id] = {"status": self.submission.result,
-                                                      "_id": self.problem._id,
-                                                      "score": score}
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                elif oi_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    # 减去上次得分，增加本次得分
-                    user_profile.add_score(this_time_score=score,
-                                           last_time_score=oi_problems_status[problem_id]["score"])
-                    oi_problems_status[problem_id]["score"] = score
-                    oi_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                user_profile.oi_problems_status["problems"] = oi_problems_status
-                user_profile.save(update_fields=["submission_number", "accepted_number", "oi_problems_status"])
+        # 题目和用户的计数增量交给 statistic_buffer 批量写入
+        problem_deltas = {"submission_number": 1, f"result:{result}": 1}
+        if self.submission.result == JudgeStatus.ACCEPTED:
+            problem_deltas["accepted_number"] = 1
+        user_deltas = self._update_user_problem_status()
+        user_deltas["submission_number"] = 1
+        statistic_buffer.add(problem_deltas=(self.problem.id, problem_deltas),
+                             user_id=self.submission.user_id, user_deltas=user_deltas)
 
     def update_contest_problem_status(self):
         with transaction.atomic():
-            user = User.objects.select_for_update().get(id=self.submission.user_id)
-            user_profile = user.userprofile
-            problem_id = str(self.problem.id)
-            if self.contest.rule_type == ContestRuleType.ACM:
-                contest_problems_status = user_profile.acm_problems_status.get("contest_problems", {})
-                if problem_id not in contest_problems_status:
-                    contest_problems_status[problem_id] = {"status": self.submission.result, "_id": self.problem._id}
-                elif contest_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    contest_problems_status[problem_id]["status"] = self.submission.result
-                else:
-                    # 如果已AC， 直接跳过 不计入任何计数器
-                    return
-                user_profile.acm_problems_status["contest_problems"] = contest_problems_status
-                user_profile.save(update_fields=["acm_problems_status"])
-
-            elif self.contest.rule_type == ContestRuleType.OI:
-                contest_problems_status = user_profile.oi_problems_status.get("contest_problems", {})
-                score = self.submission.statistic_info["score"]
-                if problem_id not in contest_problems_status:
-                    contest_problems_status[problem_id] = {"status": self.submission.result,
-                                                           "_id": self.problem._id,
-                                                           "score": score}
+            status, created = self._get_user_problem_status()
+            if not created:
+                if self.contest.rule_type == ContestRuleType.ACM:
+                    if status.status == JudgeStatus.ACCEPTED:
+                        # 如果已AC， 直接跳过 不计入任何计数器
+                        return
                 else:
-                    contest_problems_status[problem_id]["score"] = score
-                    contest_problems_status[problem_id]["status"] = self.submission.result
-                user_profile.oi_problems_status["contest_problems"] = contest_problems_status
-                user_profile.save(update_fields=["oi_problems_status"])
+                    status.score = self.submission.statistic_info["score"]
+                status.status = self.submission.result
+                status.save(update_fields=["status", "score"])
 
             problem = Problem.objects.select_for_update().get(contest_id=self.contest_id, id=self.problem.id)
             result = str(self.submission.result)
@@ -334,9 +405,6 @@ class JudgeDispatcher(DispatcherBase):
             problem.save(update_fields=["submission_number", "accepted_number", "statistic_info"])
 
     def update_contest_rank(self):
-        if self.contest.rule_type == ContestRuleType.OI or self.contest.real_time_rank:
-            cache.delete(f"{CacheKey.contest_rank_cache}:{self.contest.id}")
-
         def get_rank(model):
             return model.objects.select_for_update().get(user_id=self.submission.user_id, contest=self.contest)
 
@@ -357,6 +425,12 @@ class JudgeDispatcher(DispatcherBase):
                 rank = get_rank(model)
         func(rank)
 
+        if self.contest.rule_type == ContestRuleType.OI or self.contest.real_time_rank or self.contest.freeze_time:
+            user = User.objects.select_related("userprofile").get(id=self.submission.user_id)
+            scoreboard = ContestScoreboard(self.contest)
+            # 事务提交后再更新排名，避免回滚后排名与数据库不一致
+            transaction.on_commit(lambda: scoreboard.update(rank, user))
+
     def _update_acm_contest_rank(self, rank):
         info = rank.submission_info.get(str(self.submission.problem_id))
         # 因前面更改过，这里需要重新获取
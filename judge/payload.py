@@ -0,0 +1,135 @@
+import gzip
+import hashlib
+import json
+import threading
+
+from django.conf import settings
+
+from utils.constants import CacheKey
+from .spj import JudgeServerCache, spj_cache
+
+# 在判题服务器上按内容 hash 缓存的配置字段
+CONFIG_FIELDS = ("language_config", "spj_config", "spj_compile_config")
+# 判题服务器缺少缓存内容时返回的错误，收到后发送完整内容重试
+CONFIG_MISS_ERROR = "ConfigMissing"
+# 判题服务器上没有编译好的特殊判题、请求中又没有代码时返回的错误
+SPJ_MISS_ERRORS = ("JudgeClientError", "SPJCompileError")
+
+config_cache = JudgeServerCache(CacheKey.judge_server_config)
+
+
+class JudgeRequest(object):
+    def __init__(self, server_id, body, headers, omitted_spj=None, config_hashes=None, omitted_configs=None):
+        self.server_id = server_id
+        self.body = body
+        self.headers = headers
+        # 省略了代码的 spj_version
+        self.omitted_spj = omitted_spj
+        # 请求中所有配置的 hash
+        self.config_hashes = config_hashes or []
+        # 只发送了 hash 的配置
+        self.omitted_configs = omitted_configs or []
+
+    @property
+    def is_slim(self):
+        return bool(self.omitted_spj or self.omitted_configs)
+
+    def is_miss(self, resp):
+        if not resp or not resp["err"]:
+            return False
+        if self.omitted_configs and resp["err"] == CONFIG_MISS_ERROR:
+            return True
+        return bool(self.omitted_spj) and resp["err"] in SPJ_MISS_ERRORS
+
+
+class JudgePayloadEncoder(object):
+    """
+    生成 /judge 的请求体
+     - JUDGE_SERVER_PAYLOAD_PROTOCOL >= 2 时：
+       判题服务器上已经编译好的特殊判题不再发送代码和编译配置；
+       语言和特殊判题配置发送 config_hashes，判题服务器已经缓存的配置不再发送内容
+       协议为 1 时（原版 JudgeServer）始终发送完整内容，不依赖缺少内容时的重试
+     - 配置的 JSON 编码结果按 (字段, 语言) 缓存，语言配置的版本没有变化时直接拼接，不需要每次重新编码
+     - 超过 JUDGE_SERVER_GZIP_MIN_SIZE 的请求体使用 gzip 压缩
+    判题服务器报告缺少内容时，调用方忘记对应的记录并使用 full=True 重新生成完整的请求
+    """
+    def __init__(self):
+        self._configs = {}
+        self._lock = threading.Lock()
+
+    def _encode_config(self, field, language, value, version=None):
+        """
+        返回 (hash, JSON 编码结果)
+        version 为 LanguageRegistry.version，版本相同时配置一定相同，不需要比较配置内容
+        """
+        key = (field, language)
+        item = self._configs.get(key)
+        if item and (item[0] == version if version else item[1] == value):
+            return item[2], item[3]
+        encoded = json.dumps(value, sort_keys=True).encode("utf-8")
+        digest = hashlib.sha256(encoded).hexdigest()[:32]
+        with self._lock:
+            self._configs[key] = (version, value, digest, encoded)
+        return digest, encoded
+
+    def encode(self, server_id, data, language, spj_language=None, full=False, config_version=None):
+        protocol = settings.JUDGE_SERVER_PAYLOAD_PROTOCOL
+        omitted_spj = None
+        spj_version = data.get("spj_version")
+        if protocol >= 2 and not full and spj_version and data.get("spj_src") and \
+                spj_cache.has(server_id, spj_version):
+            omitted_spj = spj_version
+
+        fields = {}
+        config_hashes = {}
+        omitted_configs = []
+        for key, value in data.items():
+            if key in ("spj_src", "spj_compile_config") and omitted_spj:
+                fields[key] = b"null"
+            elif key in CONFIG_FIELDS and value is not None:
+                name = language if key == "language_config" else spj_language
+                digest, encoded = self._encode_config(key, name, value, config_version)
+                fields[key] = encoded
+                config_hashes[key] = digest
+            else:
+                fields[key] = json.dumps(value).encode("utf-8")
+
+        if protocol >= 2:
+            for key, digest in config_hashes.items():
+                if not full and config_cache.has(server_id, digest):
+                    fields[key] = b"null"
+                    omitted_configs.append(digest)
+            fields["protocol"] = str(protocol).encode("utf-8")
+            fields["config_hashes"] = json.dumps(config_hashes).encode("utf-8")
+
+        body = b"{" + b",".join(json.dumps(key).encode("utf-8") + b":" + value for key, value in fields.items()) + b"}"
+        headers = {"Content-Type": "application/json"}
+        min_size = settings.JUDGE_SERVER_GZIP_MIN_SIZE
+        if min_size and len(body) >= min_size:
+            body = gzip.compress(body, compresslevel=1)
+            headers["Content-Encoding"] = "gzip"
+        return JudgeRequest(server_id, body, headers, omitted_spj=omitted_spj,
+                            config_hashes=list(config_hashes.values()) if protocol >= 2 else [],
+                            omitted_configs=omitted_configs)
+
+    def forget(self, request):
+        """
+        判题服务器报告缺少内容，之后发送完整内容
+        """
+        if request.omitted_spj:
+            spj_cache.remove(request.server_id, request.omitted_spj)
+        if request.omitted_configs:
+            config_cache.remove(request.server_id, *request.omitted_configs)
+
+    def remember(self, request, spj_version=None):
+        """
+        请求成功后记录判题服务器上已经有的内容
+        """
+        if spj_version:
+            # 判题服务器在判题时会编译缺少的特殊判题
+            spj_cache.add(request.server_id, spj_version)
+        if request.config_hashes:
+            config_cache.add(request.server_id, *request.config_hashes)
+
+
+judge_payload = JudgePayloadEncoder()
@@ -0,0 +1,229 @@
+import time
+
+from django.conf import settings
+
+from utils.cache import cache, RedisScript
+from utils.constants import CacheKey, JudgeLane
+from utils.shortcuts import rand_str
+
+# 与 JudgeServer.status 保持一致，超过 6 秒没有心跳的判题服务器不再分配任务
+HEARTBEAT_TIMEOUT = 6
+# 一次判题最长的时间，_judge_request 最多发送两次请求（判题服务器缺少缓存的内容时带完整内容重试一次）
+JUDGE_MAX_DURATION = 2 * (settings.JUDGE_SERVER_CONNECT_TIMEOUT + settings.JUDGE_SERVER_READ_TIMEOUT)
+# 槽位租约时长，防止 worker 异常退出后槽位永远无法归还，必须长于最长的判题时间，否则判题中的槽位会被回收
+SLOT_LEASE_TIMEOUT = JUDGE_MAX_DURATION + 60
+
+# KEYS: busy, capacity, heartbeat, url, leases, synced, affinity_stats, lane_leases
+# ARGV: now, heartbeat_timeout, lease_expire_at, token, required_seq, affinity_key, affinity_load, lane_cap
+# lane_cap 大于 0 时，该优先级通道中正在判题的数量达到上限后不再分配槽位
+# 有 affinity_key 时按 rendezvous hash 选择该测试用例的首选、备选判题服务器，负载不超过 affinity_load 时优先使用，
+# 同一道题目会集中在少数几台判题服务器上，测试用例和 SPJ 程序更可能已经在缓存中；都已饱和时退回选择任务最少的
+_claim_script = RedisScript("""
+local servers = redis.call("ZRANGE", KEYS[1], 0, -1, "WITHSCORES")
+local now = tonumber(ARGV[1])
+local key = ARGV[6]
+redis.call("ZREMRANGEBYSCORE", KEYS[8], "-inf", now)
+if tonumber(ARGV[8]) > 0 and redis.call("ZCARD", KEYS[8]) >= tonumber(ARGV[8]) then
+    return false
+end
+local available = {}
+local ranked = {}
+for i = 1, #servers, 2 do
+    local id = servers[i]
+    local busy = tonumber(servers[i + 1])
+    local capacity = tonumber(redis.call("HGET", KEYS[2], id) or "0")
+    local heartbeat = tonumber(redis.call("HGET", KEYS[3], id) or "0")
+    -- 没有上报过同步进度的判题服务器使用全量同步，视为已经同步
+    local synced = redis.call("HGET", KEYS[6], id)
+    local ready = not synced or tonumber(synced) >= tonumber(ARGV[5])
+    if now - heartbeat <= tonumber(ARGV[2]) and ready then
+        if busy < capacity then
+            available[#available + 1] = {id = id, busy = busy, capacity = capacity}
+        end
+        if key ~= "" then
+            ranked[#ranked + 1] = {id = id, busy = busy, capacity = capacity, weight = redis.sha1hex(key .. ":" .. id)}
+        end
+    end
+end
+
+local chosen = nil
+local kind = "none"
+if key ~= "" then
+    table.sort(ranked, function(a, b) return a.weight > b.weight end)
+    local kinds = {"primary", "secondary"}
+    for i = 1, math.min(2, #ranked) do
+        local server = ranked[i]
+        if server.busy < server.capacity and server.busy < server.capacity * tonumber(ARGV[7]) then
+            chosen = server
+            kind = kinds[i]
+            break
+        end
+    end
+    if not chosen then
+        kind = "fallback"
+    end
+end
+-- servers 已经按任务数量升序排列
+if not chosen then
+    chosen = available[1]
+end
+if not chosen then
+    if key ~= "" then
+        redis.call("HINCRBY", KEYS[7], "unavailable", 1)
+    end
+    return false
+end
+if key ~= "" then
+    redis.call("HINCRBY", KEYS[7], kind, 1)
+end
+redis.call("ZINCRBY", KEYS[1], 1, chosen.id)
+redis.call("ZADD", KEYS[5], ARGV[3], chosen.id .. ":" .. ARGV[4])
+redis.call("ZADD", KEYS[8], ARGV[3], ARGV[4])
+return {chosen.id, redis.call("HGET", KEYS[4], chosen.id)}
+""")
+
+# KEYS: busy, leases, lane_leases
+# ARGV: server_id, token
+_release_script = RedisScript("""
+redis.call("ZREM", KEYS[3], ARGV[2])
+if redis.call("ZREM", KEYS[2], ARGV[1] .. ":" .. ARGV[2]) == 1 then
+    if redis.call("ZSCORE", KEYS[1], ARGV[1]) then
+        redis.call("ZINCRBY", KEYS[1], -1, ARGV[1])
+    end
+    return 1
+end
+return 0
+""")
+
+# KEYS: busy, capacity, heartbeat, url, leases, synced
+# ARGV: server_id, capacity, now, service_url, is_disabled
+_heartbeat_script = RedisScript("""
+local id = ARGV[1]
+if ARGV[5] == "1" then
+    redis.call("ZREM", KEYS[1], id)
+    redis.call("HDEL", KEYS[2], id)
+    redis.call("HDEL", KEYS[3], id)
+    redis.call("HDEL", KEYS[4], id)
+else
+    redis.call("ZADD", KEYS[1], "NX", 0, id)
+    redis.call("HSET", KEYS[2], id, ARGV[2])
+    redis.call("HSET", KEYS[3], id, ARGV[3])
+    redis.call("HSET", KEYS[4], id, ARGV[4])
+end
+-- 回收过期租约
+local expired = redis.call("ZRANGEBYSCORE", KEYS[5], "-inf", ARGV[3])
+for _, lease in ipairs(expired) do
+    redis.call("ZREM", KEYS[5], lease)
+    local server_id = string.match(lease, "^(.-):")
+    local busy = redis.call("ZSCORE", KEYS[1], server_id)
+    if busy and tonumber(busy) > 0 then
+        redis.call("ZINCRBY", KEYS[1], -1, server_id)
+    end
+end
+return #expired
+""")
+
+
+class JudgeServerSlot(object):
+    def __init__(self, id, service_url, token, lane=JudgeLane.PRACTICE):
+        self.id = id
+        self.service_url = service_url
+        self.token = token
+        self.lane = lane
+
+
+class JudgeSlotAllocator(object):
+    """
+    在 Redis 中维护每台判题服务器的空闲槽位（cpu_core * 2），
+    申请和归还槽位都是一次 Lua 脚本调用，不需要访问数据库
+    """
+    def __init__(self, prefix=CacheKey.judge_server_slots):
+        self.prefix = prefix
+        self.busy_key = f"{prefix}:busy"
+        self.capacity_key = f"{prefix}:capacity"
+        self.heartbeat_key = f"{prefix}:heartbeat"
+        self.url_key = f"{prefix}:url"
+        self.lease_key = f"{prefix}:leases"
+        self.synced_key = f"{prefix}:synced"
+        self.affinity_stats_key = f"{prefix}:affinity_stats"
+
+    @property
+    def _keys(self):
+        return [self.busy_key, self.capacity_key, self.heartbeat_key, self.url_key, self.lease_key, self.synced_key]
+
+    def lane_key(self, lane):
+        return f"{self.prefix}:lane:{lane}"
+
+    @property
+    def _lane_keys(self):
+        return [self.lane_key(lane) for lane in JudgeLane.choices()]
+
+    def lane_in_flight(self, lane):
+        """
+        该优先级通道中正在判题的数量
+        """
+        return cache.zcount(self.lane_key(lane), time.time(), "+inf")
+
+    def claim(self, required_seq=0, affinity_key=None, lane=JudgeLane.PRACTICE):
+        """
+        :param required_seq: 测试用例日志的序号，只选择已经同步到该序号的判题服务器
+        :param affinity_key: 一般为 test_case_id，相同的 key 优先分配到相同的判题服务器
+        :param lane: 优先级通道，正在判题的数量达到 JUDGE_LANES 中的 cap 时返回 None
+        """
+        now = time.time()
+        token = rand_str(8)
+        if settings.JUDGE_SERVER_SCHEDULER != "affinity":
+            affinity_key = None
+        args = [now, HEARTBEAT_TIMEOUT, now + SLOT_LEASE_TIMEOUT, token, required_seq,
+                affinity_key or "", settings.JUDGE_SERVER_AFFINITY_LOAD, settings.JUDGE_LANES[lane]["cap"]]
+        ret = _claim_script(keys=self._keys + [self.affinity_stats_key, self.lane_key(lane)], args=args)
+        if not ret:
+            return None
+        server_id, service_url = ret
+        return JudgeServerSlot(int(server_id), service_url.decode("utf-8") if service_url else None, token, lane)
+
+    def release(self, slot):
+        keys = [self.busy_key, self.lease_key, self.lane_key(slot.lane)]
+        return bool(_release_script(keys=keys, args=[slot.id, slot.token]))
+
+    def heartbeat(self, server):
+        """
+        根据判题服务器的心跳同步槽位容量、服务地址，并回收过期的租约
+        """
+        args = [server.id, server.cpu_core * 2, time.time(), server.service_url or "",
+                "1" if server.is_disabled else "0"]
+        return _heartbeat_script(keys=self._keys, args=args)
+
+    def set_synced(self, server_id, seq):
+        """
+        记录判题服务器已经同步到的测试用例日志序号
+        """
+        cache.hset(self.synced_key, server_id, seq)
+
+    def affinity_stats(self):
+        """
+        primary/secondary 为命中首选、备选判题服务器的次数，fallback 为两者都已饱和时选择其他判题服务器的次数
+        """
+        stats = {k.decode("utf-8"): int(v) for k, v in cache.hgetall(self.affinity_stats_key).items()}
+        for kind in ("primary", "secondary", "fallback", "unavailable"):
+            stats.setdefault(kind, 0)
+        dispatched = stats["primary"] + stats["secondary"] + stats["fallback"]
+        stats["hit_rate"] = (stats["primary"] + stats["secondary"]) / dispatched if dispatched else None
+        return stats
+
+    def reset(self):
+        """
+        服务重启时调用，清空所有正在进行的任务计数
+        """
+        servers = cache.zrange(self.busy_key, 0, -1)
+        with cache.pipeline() as pipe:
+            pipe.delete(self.lease_key, *self._lane_keys)
+            if servers:
+                pipe.zadd(self.busy_key, {item: 0 for item in servers})
+            pipe.execute()
+
+    def clear(self):
+        cache.delete_many(self._keys + [self.affinity_stats_key] + self._lane_keys)
+
+
+judge_slots = JudgeSlotAllocator()
@@ -0,0 +1,51 @@
+import hashlib
+
+from utils.cache import cache
+from utils.constants import CacheKey
+
+
+def get_spj_version(spj_language, spj_code):
+    """
+    由语言和代码计算，相同的特殊判题在所有题目中共用同一个编译结果
+    """
+    return hashlib.md5(f"{spj_language}:{spj_code}".encode("utf-8")).hexdigest()
+
+
+class JudgeServerCache(object):
+    """
+    记录每台判题服务器上已经有的内容，每台判题服务器保存为一个 Redis 的 set
+    spj_cache 记录已经编译好的 spj_version，判题服务器编译成功或者用特殊判题完成一次判题后加入，地址变化（可能是新的机器）时清空
+    """
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    def _key(self, server_id):
+        return f"{self.prefix}:{server_id}"
+
+    def add(self, server_id, *items):
+        cache.sadd(self._key(server_id), *items)
+
+    def remove(self, server_id, *items):
+        cache.srem(self._key(server_id), *items)
+
+    def has(self, server_id, item):
+        return bool(cache.sismember(self._key(server_id), item))
+
+    def missing(self, servers, item):
+        """
+        返回 servers 中还没有 item 的判题服务器
+        """
+        with cache.pipeline() as pipe:
+            for server in servers:
+                pipe.sismember(self._key(server.id), item)
+            compiled = pipe.execute()
+        return [server for server, ok in zip(servers, compiled) if not ok]
+
+    def items(self, server_id):
+        return {item.decode("utf-8") for item in cache.smembers(self._key(server_id))}
+
+    def clear(self, server_id):
+        cache.delete(self._key(server_id))
+
+
+spj_cache = JudgeServerCache(CacheKey.judge_server_spj)
@@ -0,0 +1,159 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F
+
+from account.models import UserProfile
+from problem.models import Problem
+from utils.cache import cache, RedisScript
+from utils.constants import CacheKey
+
+# 计数增量在 Redis 中缓冲的时间（毫秒），到期后批量写入数据库
+FLUSH_DELAY = 1000
+# 重新计算题目统计时暂停缓冲的最长时间（秒），重新计算的进程异常退出时自动恢复
+PAUSE_TTL = 600
+# 等待其他 worker 写入完成的最长时间（秒）
+FLUSH_WAIT_TIMEOUT = 60
+
+# 累加题目和用户的计数增量，并设置调度标记
+# KEYS: delta, paused, scheduled
+# ARGV: 题目 field 的数量，之后依次为题目和用户的 field, value
+# 题目正在重新计算统计时不累加该题目的增量，只在 paused 上计数，由重新计算的一方重新读取提交
+# 返回是否需要调度一次写入
+_add_script = RedisScript("""
+local problem_fields = tonumber(ARGV[1])
+local paused = problem_fields > 0 and redis.call("EXISTS", KEYS[2]) == 1
+if paused then
+    redis.call("INCR", KEYS[2])
+end
+for i = 2, #ARGV, 2 do
+    if not (paused and i <= problem_fields * 2) then
+        redis.call("HINCRBY", KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+end
+if redis.call("SET", KEYS[3], 1, "NX", "EX", 60) then
+    return 1
+end
+return 0
+""")
+
+
+class StatisticBuffer(object):
+    """
+    判题结束后不再逐条锁定 Problem / UserProfile 行，而是把计数增量累加到 Redis 的 hash 中，
+    由 flush_statistic_task 定期合并成 UPDATE ... SET x = x + n 写回数据库
+    field 的格式为 problem:<id>:<counter>、problem:<id>:result:<result>、user:<id>:<counter>
+    重新计算题目统计期间通过 pause / resume 暂停累加该题目的增量
+    """
+    def __init__(self, key=CacheKey.statistic_delta):
+        self.key = key
+        self.flushing_key = f"{key}:flushing"
+        self.scheduled_key = f"{key}:scheduled"
+        self.lock_key = f"{key}:lock"
+        self.paused_prefix = f"{key}:paused"
+
+    def _paused_key(self, problem_id):
+        return f"{self.paused_prefix}:{problem_id}"
+
+    def add(self, problem_deltas=None, user_id=None, user_deltas=None):
+        """
+        :param problem_deltas: (problem_id, {"submission_number": 1, "accepted_number": 1, "result:0": 1})
+        :param user_deltas: {"submission_number": 1, "accepted_number": 1, "total_score": 100}
+        """
+        # 防止循环引入
+        from judge.tasks import flush_statistic_task
+
+        problem_id, args = None, []
+        if problem_deltas:
+            problem_id, deltas = problem_deltas
+            for field, value in deltas.items():
+                if value:
+                    args += [f"problem:{problem_id}:{field}", value]
+        problem_fields = len(args) // 2
+        if user_deltas:
+            for field, value in user_deltas.items():
+                if value:
+                    args += [f"user:{user_id}:{field}", value]
+        keys = [self.key, self._paused_key(problem_id), self.scheduled_key]
+        if _add_script(keys=keys, args=[problem_fields] + args):
+            flush_statistic_task.send_with_options(delay=FLUSH_DELAY)
+
+    def pause(self, problem_id):
+        """
+        暂停累加该题目的增量，之后判完的提交由重新计算的一方从数据库中读取
+        """
+        cache.setex(self._paused_key(problem_id), PAUSE_TTL, 0)
+
+    def resume(self, problem_id):
+        """
+        恢复累加，返回暂停期间被跳过的增量数量，不为 0 时需要重新计算
+        """
+        with cache.pipeline() as pipe:
+            pipe.get(self._paused_key(problem_id))
+            pipe.delete(self._paused_key(problem_id))
+            skipped = pipe.execute()[0]
+        return int(skipped or 0)
+
+    def _load(self):
+        problems = defaultdict(dict)
+        users = defaultdict(dict)
+        for field, value in cache.hgetall(self.flushing_key).items():
+            kind, id, counter = field.decode("utf-8").split(":", 2)
+            target = problems if kind == "problem" else users
+            target[int(id)][counter] = int(value)
+        return problems, users
+
+    def _apply(self, problems, users):
+        with transaction.atomic():
+            for problem_id in sorted(problems):
+                deltas = problems[problem_id]
+                update = {"submission_number": F("submission_number") + deltas.get("submission_number", 0),
+                          "accepted_number": F("accepted_number") + deltas.get("accepted_number", 0)}
+                results = {k.split(":", 1)[1]: v for k, v in deltas.items() if k.startswith("result:")}
+                if results:
+                    try:
+                        statistic_info = Problem.objects.select_for_update().values_list(
+                            "statistic_info", flat=True).get(id=problem_id)
+                    except Problem.DoesNotExist:
+                        continue
+                    for result, value in results.items():
+                        statistic_info[result] = max(statistic_info.get(result, 0) + value, 0)
+                    update["statistic_info"] = statistic_info
+                Problem.objects.filter(id=problem_id).update(**update)
+
+            for user_id in sorted(users):
+                deltas = users[user_id]
+                UserProfile.objects.filter(user_id=user_id).update(
+                    submission_number=F("submission_number") + deltas.get("submission_number", 0),
+                    accepted_number=F("accepted_number") + deltas.get("accepted_number", 0),
+                    total_score=F("total_score") + deltas.get("total_score", 0))
+
+    def flush(self, wait=False):
+        """
+        wait 为 True 时等待其他 worker 写入完成，返回时之前累加的增量都已经写入数据库
+        """
+        lock = cache.lock(self.lock_key, timeout=60)
+        if wait:
+            if not lock.acquire(blocking_timeout=FLUSH_WAIT_TIMEOUT):
+                raise RuntimeError("Timeout waiting for statistic buffer flush")
+        elif not lock.acquire(blocking=False):
+            # 已经有其他 worker 在写入，稍后重试
+            from judge.tasks import flush_statistic_task
+            flush_statistic_task.send_with_options(delay=FLUSH_DELAY)
+            return
+        try:
+            # 先清除调度标记，之后到达的增量会重新调度一次写入
+            cache.delete(self.scheduled_key)
+            # 上次写入失败遗留的数据优先处理
+            if cache.exists(self.flushing_key):
+                self._apply(*self._load())
+                cache.delete(self.flushing_key)
+            if cache.exists(self.key):
+                cache.rename(self.key, self.flushing_key)
+                self._apply(*self._load())
+                cache.delete(self.flushing_key)
+        finally:
+            lock.release()
+
+
+statistic_buffer = StatisticBuffer()
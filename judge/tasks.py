@@ -1,14 +1,71 @@
 import dramatiq
+from django.utils import timezone
 
 from account.models import User
+from conf.models import JudgeServer
+from problem.models import Problem
 from submission.models import Submission
-from judge.dispatcher import JudgeDispatcher
+from judge.backlog import judge_backlog
+from judge.dispatcher import JudgeDispatcher, SPJCompiler
+from judge.statistic import statistic_buffer
+from submission.rejudge import rejudge_jobs
+from utils.constants import JudgeLane
 from utils.shortcuts import DRAMATIQ_WORKER_ARGS
 
 
 @dramatiq.actor(**DRAMATIQ_WORKER_ARGS())
-def judge_task(submission_id, problem_id):
-    uid = Submission.objects.get(id=submission_id).user_id
-    if User.objects.get(id=uid).is_disabled:
+def judge_task(submission_id, problem_id, backlog_item=None, lane=JudgeLane.PRACTICE, rejudge_job=None):
+    dispatcher = None
+    try:
+        uid = Submission.objects.get(id=submission_id).user_id
+        # 消息中带有任务 id 时，即使第一次判题已经删除了提交属于该任务的标记，重复投递时也能识别
+        rejudge_job = rejudge_job or rejudge_jobs.job_of(submission_id)
+        if User.objects.get(id=uid).is_disabled:
+            return
+        dispatcher = JudgeDispatcher(submission_id, problem_id, backlog_item=backlog_item, lane=lane,
+                                     rejudge_job=rejudge_job)
+        dispatcher.judge()
+    finally:
+        # 从等待队列中出队的任务，处理结束后确认
+        if backlog_item:
+            judge_backlog.ack(backlog_item)
+        # 批量重判的提交无论判题是否成功、用户是否已被禁用都计为完成，放回等待队列的除外
+        if rejudge_job and not (dispatcher and dispatcher.requeued):
+            rejudge_jobs.finish_one(rejudge_job, submission_id)
+
+
+# 比赛和重判使用单独的 dramatiq 队列，大量重判的消息不会排在比赛提交的前面
+@dramatiq.actor(queue_name="judge_contest", **DRAMATIQ_WORKER_ARGS())
+def contest_judge_task(submission_id, problem_id, backlog_item=None, rejudge_job=None):
+    judge_task(submission_id, problem_id, backlog_item=backlog_item, lane=JudgeLane.CONTEST, rejudge_job=rejudge_job)
+
+
+@dramatiq.actor(queue_name="judge_rejudge", **DRAMATIQ_WORKER_ARGS())
+def rejudge_task(submission_id, problem_id, backlog_item=None, rejudge_job=None):
+    judge_task(submission_id, problem_id, backlog_item=backlog_item, lane=JudgeLane.REJUDGE, rejudge_job=rejudge_job)
+
+
+def send_judge_task(submission_id, problem_id, lane=JudgeLane.PRACTICE, backlog_item=None, rejudge_job=None):
+    actor = {JudgeLane.CONTEST: contest_judge_task, JudgeLane.REJUDGE: rejudge_task}.get(lane, judge_task)
+    actor.send(submission_id, problem_id, backlog_item=backlog_item, rejudge_job=rejudge_job)
+
+
+@dramatiq.actor(**DRAMATIQ_WORKER_ARGS())
+def flush_statistic_task():
+    statistic_buffer.flush()
+
+
+@dramatiq.actor(**DRAMATIQ_WORKER_ARGS())
+def warm_spj_task(server_id):
+    """
+    判题服务器上线后预先编译正在进行的比赛中的特殊判题
+    """
+    try:
+        server = JudgeServer.objects.get(id=server_id)
+    except JudgeServer.DoesNotExist:
         return
-    JudgeDispatcher(submission_id, problem_id).judge()
+    now = timezone.now()
+    spjs = Problem.objects.filter(spj=True, contest__start_time__lte=now, contest__end_time__gt=now) \
+        .exclude(spj_version=None).values_list("spj_code", "spj_version", "spj_language").distinct()
+    for spj_code, spj_version, spj_language in spjs:
+        SPJCompiler(spj_code, spj_version, spj_language).compile_on([server])
@@ -0,0 +1,155 @@
+import json
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from account.models import UserProfile
+from submission.models import JudgeStatus
+from submission.tests import create_problem
+from utils.api.tests import APITestCase
+from utils.cache import cache
+from utils.constants import JudgeLane
+from .payload import JudgePayloadEncoder
+from .slots import JUDGE_MAX_DURATION, SLOT_LEASE_TIMEOUT, JudgeSlotAllocator
+from .spj import spj_cache
+from .statistic import StatisticBuffer
+
+
+class JudgeSlotAllocatorTest(TestCase):
+    def setUp(self):
+        self.slots = JudgeSlotAllocator(prefix="test:judge_server_slots")
+        self.slots.clear()
+        self.addCleanup(self.slots.clear)
+        # 1 核，2 个槽位
+        self.server = SimpleNamespace(id=1, cpu_core=1, service_url="http://judge", is_disabled=False)
+        self.slots.heartbeat(self.server)
+
+    def busy(self):
+        return int(cache.zscore(self.slots.busy_key, self.server.id) or 0)
+
+    def test_lease_outlives_judge(self):
+        self.assertGreater(SLOT_LEASE_TIMEOUT, JUDGE_MAX_DURATION)
+
+    def test_claim_and_release(self):
+        slot = self.slots.claim(lane=JudgeLane.PRACTICE)
+        self.assertEqual(slot.id, self.server.id)
+        self.assertEqual(self.busy(), 1)
+        self.assertTrue(self.slots.release(slot))
+        self.assertEqual(self.busy(), 0)
+        # 重复归还不会再减少计数
+        self.assertFalse(self.slots.release(slot))
+        self.assertEqual(self.busy(), 0)
+
+    def test_release_expired_lease(self):
+        slot = self.slots.claim(lane=JudgeLane.PRACTICE)
+        later = time.time() + SLOT_LEASE_TIMEOUT + 1
+        with mock.patch("judge.slots.time.time", return_value=later):
+            # 心跳回收过期的租约，槽位被其他任务重新申请
+            self.slots.heartbeat(self.server)
+            self.assertEqual(self.busy(), 0)
+            other = self.slots.claim(lane=JudgeLane.PRACTICE)
+            self.assertEqual(self.busy(), 1)
+            # 过期的 token 归还时不能释放其他任务持有的槽位
+            self.assertFalse(self.slots.release(slot))
+            self.assertEqual(self.busy(), 1)
+            self.assertTrue(self.slots.release(other))
+            self.assertEqual(self.busy(), 0)
+
+
+class JudgePayloadEncoderTest(TestCase):
+    server_id = 999999
+
+    def setUp(self):
+        spj_cache.add(self.server_id, "spj_v1")
+        self.addCleanup(spj_cache.remove, self.server_id, "spj_v1")
+        self.data = {"language_config": {"compile": "gcc"}, "src": "int main(){}", "spj_version": "spj_v1",
+                     "spj_config": {"exe": "spj"}, "spj_compile_config": {"compile": "gcc"},
+                     "spj_src": "int main(){}"}
+
+    def decode(self, request):
+        return json.loads(request.body)
+
+    @override_settings(JUDGE_SERVER_PAYLOAD_PROTOCOL=1, JUDGE_SERVER_GZIP_MIN_SIZE=0)
+    def test_protocol_1_keeps_spj_src(self):
+        request = JudgePayloadEncoder().encode(self.server_id, self.data, "C", "C")
+        self.assertFalse(request.is_slim)
+        self.assertEqual(self.decode(request)["spj_src"], "int main(){}")
+        self.assertNotIn("config_hashes", self.decode(request))
+
+    @override_settings(JUDGE_SERVER_PAYLOAD_PROTOCOL=2, JUDGE_SERVER_GZIP_MIN_SIZE=0)
+    def test_protocol_2_omits_compiled_spj(self):
+        request = JudgePayloadEncoder().encode(self.server_id, self.data, "C", "C")
+        self.assertEqual(request.omitted_spj, "spj_v1")
+        self.assertIsNone(self.decode(request)["spj_src"])
+        request = JudgePayloadEncoder().encode(self.server_id, self.data, "C", "C", full=True)
+        self.assertEqual(self.decode(request)["spj_src"], "int main(){}")
+
+
+class StatisticBufferTest(APITestCase):
+    def setUp(self):
+        self.admin = self.create_super_admin(login=False)
+        self.user = self.create_user("test", "test123", login=False)
+        self.problem = create_problem(self.admin)
+        self.buffer = StatisticBuffer(key=f"test:statistic_delta:{time.time()}")
+        patcher = mock.patch("judge.tasks.flush_statistic_task.send_with_options")
+        self.flush_task = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add(self, result=JudgeStatus.ACCEPTED):
+        accepted = int(result == JudgeStatus.ACCEPTED)
+        self.buffer.add(problem_deltas=(self.problem.id, {"submission_number": 1, "accepted_number": accepted,
+                                                          f"result:{result}": 1}),
+                        user_id=self.user.id, user_deltas={"submission_number": 1, "accepted_number": accepted})
+
+    def test_flush(self):
+        self.add()
+        self.add(JudgeStatus.WRONG_ANSWER)
+        # 同一个写入周期内只调度一次
+        self.assertEqual(self.flush_task.call_count, 1)
+        self.problem.refresh_from_db()
+        self.assertEqual(self.problem.submission_number, 0)
+
+        self.buffer.flush()
+        self.problem.refresh_from_db()
+        self.assertEqual((self.problem.submission_number, self.problem.accepted_number), (2, 1))
+        self.assertEqual(self.problem.statistic_info, {str(JudgeStatus.ACCEPTED): 1,
+                                                       str(JudgeStatus.WRONG_ANSWER): 1})
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual((profile.submission_number, profile.accepted_number), (2, 1))
+        self.assertFalse(cache.exists(self.buffer.key, self.buffer.flushing_key))
+
+        # 写入后到达的增量重新调度
+        self.add()
+        self.assertEqual(self.flush_task.call_count, 2)
+
+    def test_flush_busy(self):
+        self.add()
+        lock = cache.lock(self.buffer.lock_key, timeout=60)
+        lock.acquire()
+        self.addCleanup(lock.release)
+        self.buffer.flush()
+        # 其他 worker 正在写入时稍后重试，增量保留在 Redis 中
+        self.assertEqual(self.flush_task.call_count, 2)
+        self.assertTrue(cache.exists(self.buffer.key))
+        with mock.patch("judge.statistic.FLUSH_WAIT_TIMEOUT", 0.1):
+            with self.assertRaises(RuntimeError):
+                self.buffer.flush(wait=True)
+
+    def test_pause_and_resume(self):
+        self.buffer.pause(self.problem.id)
+        self.add()
+        self.add()
+        self.assertEqual(self.buffer.resume(self.problem.id), 2)
+        self.buffer.flush()
+        # 暂停期间只跳过题目的增量，用户的增量照常写入
+        self.problem.refresh_from_db()
+        self.assertEqual((self.problem.submission_number, self.problem.statistic_info), (0, {}))
+        self.assertEqual(UserProfile.objects.get(user=self.user).submission_number, 2)
+
+        self.assertEqual(self.buffer.resume(self.problem.id), 0)
+        self.add()
+        self.buffer.flush()
+        self.problem.refresh_from_db()
+        self.assertEqual(self.problem.submission_number, 1)
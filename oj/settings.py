@@ -126,6 +126,11 @@ STATIC_URL = '/public/'
 AUTH_USER_MODEL = 'account.User'
 
 TEST_CASE_DIR = os.path.join(DATA_DIR, "test_case")
+# 测试用例下载压缩包，不放在 TEST_CASE_DIR 中以免被同步到判题服务器
+TEST_CASE_ARCHIVE_DIR = os.path.join(DATA_DIR, "test_case_archive")
+# nginx 中 internal location 的前缀，设置后通过 X-Accel-Redirect 由 nginx 发送文件
+TEST_CASE_ARCHIVE_ACCEL_PREFIX = get_env("TEST_CASE_ARCHIVE_ACCEL_PREFIX",
+                                         "/internal/test_case_archive/" if production_env else "")
 LOG_PATH = os.path.join(DATA_DIR, "log")
 
 AVATAR_URI_PREFIX = "/public/avatar"
@@ -245,4 +250,27 @@ RAVEN_CONFIG = {
 
 IP_HEADER = "HTTP_X_REAL_IP"
 
+# 请求判题服务器的连接超时、读取超时（秒）以及每台判题服务器的最大连接数
+JUDGE_SERVER_CONNECT_TIMEOUT = float(get_env("JUDGE_SERVER_CONNECT_TIMEOUT", "3"))
+JUDGE_SERVER_READ_TIMEOUT = float(get_env("JUDGE_SERVER_READ_TIMEOUT", "600"))
+JUDGE_SERVER_POOL_SIZE = int(get_env("JUDGE_SERVER_POOL_SIZE", "8"))
+# 判题服务器调度方式：affinity 优先选择最近判过同一测试用例的服务器，least_loaded 只按任务数量选择
+JUDGE_SERVER_SCHEDULER = get_env("JUDGE_SERVER_SCHEDULER", "affinity")
+# affinity 模式下首选服务器的任务数超过槽位数的该比例时视为饱和
+JUDGE_SERVER_AFFINITY_LOAD = float(get_env("JUDGE_SERVER_AFFINITY_LOAD", "0.75"))
+# 判题队列的优先级通道，没有空闲槽位时按 weight 的比例在排队的通道之间分配释放的槽位
+# cap 为该通道同时判题的最大数量，0 表示不限制，避免大量重判占满所有判题服务器
+JUDGE_LANES = {
+    "contest": {"weight": int(get_env("JUDGE_LANE_CONTEST_WEIGHT", "8")),
+                "cap": int(get_env("JUDGE_LANE_CONTEST_CAP", "0"))},
+    "practice": {"weight": int(get_env("JUDGE_LANE_PRACTICE_WEIGHT", "3")),
+                 "cap": int(get_env("JUDGE_LANE_PRACTICE_CAP", "0"))},
+    "rejudge": {"weight": int(get_env("JUDGE_LANE_REJUDGE_WEIGHT", "1")),
+                "cap": int(get_env("JUDGE_LANE_REJUDGE_CAP", "4"))},
+}
+# /judge 请求协议版本，2 表示判题服务器支持按 config_hashes 缓存语言和特殊判题配置
+JUDGE_SERVER_PAYLOAD_PROTOCOL = int(get_env("JUDGE_SERVER_PAYLOAD_PROTOCOL", "1"))
+# 超过该大小的 /judge 请求体使用 gzip 压缩，需要判题服务器支持 Content-Encoding: gzip，0 表示不压缩
+JUDGE_SERVER_GZIP_MIN_SIZE = int(get_env("JUDGE_SERVER_GZIP_MIN_SIZE", "0"))
+
 DEFAULT_AUTO_FIELD='django.db.models.AutoField'
\ No newline at end of file
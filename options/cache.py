@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from utils.cache import cache
+from utils.constants import CacheKey
+
+logger = logging.getLogger(__name__)
+
+# 订阅断开后重新连接的间隔（秒）
+RECONNECT_INTERVAL = 1
+# 等待失效通知的超时时间（秒），超时后检查进程是否已经 fork
+LISTEN_TIMEOUT = 5
+# 连接异常但没有断开时可能收不到失效通知，缓存的值最多使用这么久
+MAX_AGE = 60
+
+_MISSING = object()
+
+
+class OptionsCache(object):
+    """
+    进程内共享的系统选项缓存，读取时只需要查一次 dict
+     - 修改选项的事务提交后发布失效通知，每个进程的后台线程订阅后删除对应的缓存，下次读取时重新查询数据库
+     - 订阅成功之前、订阅断开期间不缓存，直接查询数据库；重新订阅成功时清空缓存，避免使用断开期间错过通知的值
+     - 查询数据库期间收到失效通知时不保存查询结果
+     - derived 缓存由选项计算得到的值（例如序列化好的网站配置），依赖的选项失效时一起失效
+    """
+    def __init__(self, channel=CacheKey.options_invalidate):
+        self.channel = channel
+        self._values = {}
+        self._derived = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._subscribed = threading.Event()
+        self._pid = None
+
+    def _ensure_listener(self):
+        # gunicorn、dramatiq 的 worker 由 fork 产生，后台线程不会被继承，每个进程第一次读取时启动
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._values = {}
+            self._derived = {}
+            self._subscribed = threading.Event()
+            threading.Thread(target=self._listen, name="options-cache", daemon=True).start()
+
+    def get(self, key, loader, preload=None):
+        """
+        loader 接收 key 的列表，返回 {key: value}；没有缓存时一次读取 preload 中的所有选项
+        """
+        item = self._values.get(key, _MISSING)
+        if item is not _MISSING and time.monotonic() < item[1] and self._pid == os.getpid():
+            return item[0]
+        return self.get_many(preload or [key], loader)[key]
+
+    def get_many(self, keys, loader):
+        self._ensure_listener()
+        now = time.monotonic()
+        result = {}
+        missing = []
+        for key in keys:
+            item = self._values.get(key, _MISSING)
+            if item is not _MISSING and now < item[1]:
+                result[key] = item[0]
+            else:
+                missing.append(key)
+        if not missing:
+            return result
+        generation = self._generation
+        values = loader(missing)
+        if self._subscribed.is_set():
+            with self._lock:
+                # 读取期间收到了失效通知，读到的可能是旧值
+                if generation == self._generation:
+                    expire_at = time.monotonic() + MAX_AGE
+                    self._values.update((key, (value, expire_at)) for key, value in values.items())
+        result.update(values)
+        return result
+
+    def derived(self, name, keys, loader, builder):
+        """
+        缓存由 keys 对应的选项计算得到的值，其中任意一个选项失效时重新计算
+        builder 接收 {key: value}
+        """
+        self._ensure_listener()
+        item = self._derived.get(name)
+        if item is not None and time.monotonic() < item[1]:
+            return item[0]
+        generation = self._generation
+        value = builder(self.get_many(keys, loader))
+        if self._subscribed.is_set():
+            with self._lock:
+                if generation == self._generation:
+                    self._derived[name] = (value, time.monotonic() + MAX_AGE, frozenset(keys))
+        return value
+
+    def invalidate(self, *keys):
+        """
+        在修改选项的事务提交后调用，删除本进程的缓存并通知其他进程
+        """
+        self._drop(keys)
+        try:
+            cache.publish(self.channel, json.dumps(keys))
+        except Exception:
+            # 其他进程的订阅也会断开，断开期间不使用缓存
+            logger.exception("Failed to publish options invalidation")
+
+    def _drop(self, keys=None):
+        with self._lock:
+            self._generation += 1
+            if keys is None:
+                self._values = {}
+                self._derived = {}
+            else:
+                for key in keys:
+                    self._values.pop(key, None)
+                self._derived = {name: item for name, item in self._derived.items() if item[2].isdisjoint(keys)}
+
+    def _listen(self):
+        pid = os.getpid()
+        subscribed = self._subscribed
+        while self._pid == pid:
+            pubsub = None
+            try:
+                pubsub = cache.pubsub()
+                pubsub.subscribe(self.channel)
+                while self._pid == pid:
+                    message = pubsub.get_message(timeout=LISTEN_TIMEOUT)
+                    if not message:
+                        continue
+                    if message["type"] == "subscribe":
+                        self._drop()
+                        subscribed.set()
+                    elif message["type"] == "message":
+                        self._drop(json.loads(message["data"]))
+            except Exception:
+                logger.exception("Options cache subscription lost")
+            finally:
+                subscribed.clear()
+                self._drop()
+                if pubsub is not None:
+                    pubsub.close()
+            time.sleep(RECONNECT_INTERVAL)
+
+
+options_cache = OptionsCache()
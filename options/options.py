@@ -1,91 +1,39 @@
 import functools
+import hashlib
+import json
 import os
-import threading
-import time
 
-from django.db import transaction, IntegrityError
+from django.db import transaction
 
 from utils.shortcuts import rand_str
 from judge.languages import languages
+from .cache import options_cache
 from .models import SysOptions as SysOptionsModel
 
 
 class my_property:
     """
-    在 metaclass 中使用，以实现：
-    1. ttl = None，不缓存
-    2. ttl is callable，条件缓存
-    3. 缓存 ttl 秒
+    在 metaclass 中使用的 property，选项的值由 options_cache 在进程内缓存，修改后通过 Redis 通知所有进程失效
     """
-    def __init__(self, func=None, fset=None, ttl=None):
+    def __init__(self, func=None, fset=None):
         self.fset = fset
-        self.local = threading.local()
-        self.ttl = ttl
-        self._check_ttl(ttl)
         self.func = func
         functools.update_wrapper(self, func)
 
-    def _check_ttl(self, value):
-        if value is None or callable(value):
-            return
-        return self._check_timeout(value)
-
-    def _check_timeout(self, value):
-        if not isinstance(value, int):
-            raise ValueError(f"Invalid timeout type: {type(value)}")
-        if value < 0:
-            raise ValueError("Invalid timeout value, it must >= 0")
-
     def __get__(self, obj, cls):
         if obj is None:
             return self
-
-        now = time.time()
-        if self.ttl:
-            if hasattr(self.local, "value"):
-                value, expire_at = self.local.value
-                if now < expire_at:
-                    return value
-
-            value = self.func(obj)
-
-            # 如果定义了条件缓存, ttl 是一个函数，返回要缓存多久；返回 0 代表不要缓存
-            if callable(self.ttl):
-                # 而且条件缓存说不要缓存，那就直接返回，不要设置 local
-                timeout = self.ttl(value)
-                self._check_timeout(timeout)
-
-                if timeout == 0:
-                    return value
-                elif timeout > 0:
-                    self.local.value = (value, now + timeout)
-            else:
-                # ttl 是一个数字
-                self.local.value = (value, now + self.ttl)
-            return value
-        else:
-            return self.func(obj)
+        return self.func(obj)
 
     def __set__(self, obj, value):
         if not self.fset:
             raise AttributeError("can't set attribute")
         self.fset(obj, value)
-        if hasattr(self.local, "value"):
-            del self.local.value
 
     def setter(self, func):
         self.fset = func
         return self
 
-    def __call__(self, func, *args, **kwargs) -> "my_property":
-        if self.func is None:
-            self.func = func
-            functools.update_wrapper(self, func)
-        return self
-
-
-DEFAULT_SHORT_TTL = 2
-
 
 def default_token():
     token = os.environ.get("JUDGE_SERVER_TOKEN")
@@ -105,6 +53,10 @@ class OptionKeys:
     languages = "languages"
 
 
+# 所有 OptionKeys 中定义的键
+OPTION_KEYS = [key for key in OptionKeys.__dict__ if not key.startswith("__")]
+
+
 class OptionDefaultValue:
     website_base_url = "http://127.0.0.1"
     website_name = "Online Judge"
@@ -119,35 +71,65 @@ class OptionDefaultValue:
     languages = languages
 
 
+class LanguageRegistry(object):
+    """
+    按名称索引的语言配置，由 languages 选项生成，选项修改之前一直使用同一个对象
+    version 由配置内容计算，内容相同时不变，judge_payload 用它判断缓存的配置编码结果是否还能使用
+    """
+    def __init__(self, languages):
+        self.languages = languages
+        self.version = hashlib.md5(json.dumps(languages, sort_keys=True).encode("utf-8")).hexdigest()
+        self.by_name = {item["name"]: item for item in languages}
+        self.spj_languages = [item for item in languages if "spj" in item]
+        self.names = frozenset(self.by_name)
+        self.spj_names = frozenset(item["name"] for item in self.spj_languages)
+
+    def config(self, name):
+        return self.by_name[name]["config"]
+
+    def spj_config(self, name):
+        # 不支持特殊判题的语言返回空的配置
+        return self.by_name.get(name, {}).get("spj", {})
+
+    def spj_compile_config(self, name):
+        return self.by_name[name]["spj"]["compile"]
+
+
 class _SysOptionsMeta(type):
     @classmethod
     def _get_keys(cls):
         # 获取所有 OptionKeys 中定义的键
-        return [key for key in OptionKeys.__dict__ if not key.startswith("__")]
+        return OPTION_KEYS
 
     @classmethod
     def _init_option(mcs):
-        # 初始化选项，如果数据库中不存在则创建
-        for item in mcs._get_keys():
-            if not SysOptionsModel.objects.filter(key=item).exists():
+        # 初始化选项，数据库中不存在的选项使用默认值创建
+        keys = mcs._get_keys()
+        existing = set(SysOptionsModel.objects.filter(key__in=keys).values_list("key", flat=True))
+        options = []
+        for item in keys:
+            if item not in existing:
                 default_value = getattr(OptionDefaultValue, item)
                 if callable(default_value):
                     default_value = default_value()
-                try:
-                    SysOptionsModel.objects.create(key=item, value=default_value)
-                except IntegrityError:
-                    pass
+                options.append(SysOptionsModel(key=item, value=default_value))
+        if options:
+            # 其他进程同时初始化时忽略已经存在的选项
+            SysOptionsModel.objects.bulk_create(options, ignore_conflicts=True)
 
     @classmethod
-    def _get_option(mcs, option_key):
-        # 获取选项的值，如果不存在则初始化并重新获取
-        try:
-            option = SysOptionsModel.objects.get(key=option_key)
-            value = option.value
-            return value
-        except SysOptionsModel.DoesNotExist:
+    def _load_options(mcs, option_keys):
+        # 一次查询从数据库读取多个选项的值，如果有不存在的则初始化并重新读取
+        values = dict(SysOptionsModel.objects.filter(key__in=option_keys).values_list("key", "value"))
+        if len(values) < len(set(option_keys)):
             mcs._init_option()
-            return mcs._get_option(option_key)
+            values = dict(SysOptionsModel.objects.filter(key__in=option_keys).values_list("key", "value"))
+        return values
+
+    @classmethod
+    def _get_option(mcs, option_key):
+        # 获取选项的值，优先使用进程内缓存，没有缓存时一次读取所有选项
+        return options_cache.get(option_key, mcs._load_options, preload=OPTION_KEYS)
 
     @classmethod
     def _set_option(mcs, option_key: str, option_value):
@@ -157,6 +139,8 @@ class _SysOptionsMeta(type):
                 option = SysOptionsModel.objects.select_for_update().get(key=option_key)
                 option.value = option_value
                 option.save()
+                # 事务提交后其他进程才能读到新的值
+                transaction.on_commit(functools.partial(options_cache.invalidate, option_key))
         except SysOptionsModel.DoesNotExist:
             mcs._init_option()
             mcs._set_option(option_key, option_value)
@@ -170,6 +154,7 @@ class _SysOptionsMeta(type):
                 value = option.value + 1
                 option.value = value
                 option.save()
+                transaction.on_commit(functools.partial(options_cache.invalidate, option_key))
         except SysOptionsModel.DoesNotExist:
             mcs._init_option()
             return mcs._increment(option_key)
@@ -183,12 +168,14 @@ class _SysOptionsMeta(type):
     @classmethod
     def get_options(mcs, keys):
         # 批量获取选项的值
-        result = {}
-        for key in keys:
-            result[key] = mcs._get_option(key)
-        return result
+        return options_cache.get_many(keys, mcs._load_options)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @classmethod
+    def get_derived(mcs, name, keys, builder):
+        # 获取由多个选项计算得到的值，builder 接收 {key: value}，结果缓存到其中任意一个选项被修改
+        return options_cache.derived(name, keys, mcs._load_options, builder)
+
+    @my_property
     def website_base_url(cls):
         # 获取网站基础 URL
         return cls._get_option(OptionKeys.website_base_url)
@@ -198,7 +185,7 @@ class _SysOptionsMeta(type):
         # 设置网站基础 URL
         cls._set_option(OptionKeys.website_base_url, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def website_name(cls):
         # 获取网站名称
         return cls._get_option(OptionKeys.website_name)
@@ -208,7 +195,7 @@ class _SysOptionsMeta(type):
         # 设置网站名称
         cls._set_option(OptionKeys.website_name, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def website_name_shortcut(cls):
         # 获取网站名称缩写
         return cls._get_option(OptionKeys.website_name_shortcut)
@@ -218,7 +205,7 @@ class _SysOptionsMeta(type):
         # 设置网站名称缩写
         cls._set_option(OptionKeys.website_name_shortcut, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def website_footer(cls):
         # 获取网站页脚
         return cls._get_option(OptionKeys.website_footer)
@@ -238,7 +225,7 @@ class _SysOptionsMeta(type):
         # 设置是否允许注册
         cls._set_option(OptionKeys.allow_register, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def submission_list_show_all(cls):
         # 获取是否显示所有提交列表
         return cls._get_option(OptionKeys.submission_list_show_all)
@@ -278,7 +265,7 @@ class _SysOptionsMeta(type):
         # 设置限流配置
         cls._set_option(OptionKeys.throttling, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def languages(cls):
         # 获取语言配置
         return cls._get_option(OptionKeys.languages)
@@ -288,20 +275,26 @@ class _SysOptionsMeta(type):
         # 设置语言配置
         cls._set_option(OptionKeys.languages, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
+    def language_registry(cls):
+        # 获取按名称索引的语言配置，languages 修改后重新生成
+        return cls.get_derived("language_registry", [OptionKeys.languages],
+                               lambda options: LanguageRegistry(options[OptionKeys.languages]))
+
+    @my_property
     def spj_languages(cls):
         # 获取特定语言配置
-        return [item for item in cls.languages if "spj" in item]
+        return cls.language_registry.spj_languages
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def language_names(cls):
-        # 获取语言名称列表
-        return [item["name"] for item in cls.languages]
+        # 获取语言名称集合
+        return cls.language_registry.names
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def spj_language_names(cls):
-        # 获取特定语言名称列表
-        return [item["name"] for item in cls.languages if "spj" in item]
+        # 获取特定语言名称集合
+        return cls.language_registry.spj_names
 
     def reset_languages(cls):
         # 重置语言配置
@@ -0,0 +1,95 @@
+import json
+import os
+import time
+from unittest import mock
+
+from django.test import TestCase
+
+from utils.cache import cache
+from .cache import OptionsCache
+
+
+class OptionsCacheTest(TestCase):
+    def setUp(self):
+        self.options = OptionsCache(channel=f"test:options_invalidate:{time.time()}")
+        self.values = {"website_name": "oj", "allow_register": True}
+        self.loads = []
+
+    def loader(self, keys):
+        self.loads.append(sorted(keys))
+        return {key: self.values[key] for key in keys}
+
+    def subscribe(self):
+        # 不启动后台线程，直接当作已经订阅成功
+        self.options._pid = os.getpid()
+        self.options._subscribed.set()
+
+    def test_no_cache_before_subscribed(self):
+        self.options._pid = os.getpid()
+        self.assertEqual(self.options.get("website_name", self.loader), "oj")
+        self.assertEqual(self.options.get("website_name", self.loader), "oj")
+        self.assertEqual(len(self.loads), 2)
+
+    def test_invalidate(self):
+        self.subscribe()
+        preload = list(self.values)
+        self.assertEqual(self.options.get("website_name", self.loader, preload=preload), "oj")
+        self.assertTrue(self.options.get("allow_register", self.loader, preload=preload))
+        self.assertEqual(self.loads, [sorted(preload)])
+
+        self.values["website_name"] = "new oj"
+        with mock.patch("options.cache.cache.publish") as publish:
+            self.options.invalidate("website_name")
+        publish.assert_called_once_with(self.options.channel, json.dumps(["website_name"]))
+        self.assertEqual(self.options.get("website_name", self.loader), "new oj")
+        self.assertTrue(self.options.get("allow_register", self.loader))
+        # 只重新读取失效的选项
+        self.assertEqual(self.loads[1:], [["website_name"]])
+
+    def test_invalidate_derived(self):
+        self.subscribe()
+
+        def builder(values):
+            return values["website_name"].upper()
+
+        self.assertEqual(self.options.derived("name", ["website_name"], self.loader, builder), "OJ")
+        self.options._drop(["allow_register"])
+        self.assertEqual(self.options.derived("name", ["website_name"], self.loader, builder), "OJ")
+        self.assertEqual(len(self.loads), 1)
+        self.values["website_name"] = "new oj"
+        self.options._drop(["website_name"])
+        self.assertEqual(self.options.derived("name", ["website_name"], self.loader, builder), "NEW OJ")
+
+    def test_invalidated_while_loading(self):
+        self.subscribe()
+
+        def loader(keys):
+            # 读取数据库期间其他进程修改了选项
+            self.options._drop(keys)
+            return self.loader(keys)
+
+        self.assertEqual(self.options.get("website_name", loader), "oj")
+        # 读到的可能是旧值，不保存
+        self.assertEqual(self.options.get("website_name", self.loader), "oj")
+        self.assertEqual(len(self.loads), 2)
+        self.options.get("website_name", self.loader)
+        self.assertEqual(len(self.loads), 2)
+
+    def test_listener(self):
+        self.options.get("website_name", self.loader)
+        self.addCleanup(setattr, self.options, "_pid", None)
+        self.assertTrue(self.options._subscribed.wait(timeout=5))
+        self.options.get("website_name", self.loader)
+        self.assertEqual(len(self.loads), 2)
+        self.options.get("website_name", self.loader)
+        self.assertEqual(len(self.loads), 2)
+
+        # 其他进程发布的失效通知
+        generation = self.options._generation
+        cache.publish(self.options.channel, json.dumps(["website_name"]))
+        for _ in range(50):
+            if self.options._generation != generation:
+                break
+            time.sleep(0.1)
+        self.options.get("website_name", self.loader)
+        self.assertEqual(len(self.loads), 3)
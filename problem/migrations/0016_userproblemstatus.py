@@ -0,0 +1,86 @@
+# Generated by Django 3.2.25 on 2026-10-18 14:10
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_user_problem_status(apps, schema_editor):
+    UserProfile = apps.get_model("account", "UserProfile")
+    Problem = apps.get_model("problem", "Problem")
+    UserProblemStatus = apps.get_model("problem", "UserProblemStatus")
+
+    problem_contest = dict(Problem.objects.values_list("id", "contest_id"))
+    items = []
+    profiles = UserProfile.objects.only("user_id", "acm_problems_status", "oi_problems_status").iterator()
+    for profile in profiles:
+        for blob in (profile.acm_problems_status, profile.oi_problems_status):
+            for key in ("problems", "contest_problems"):
+                for problem_id, info in (blob or {}).get(key, {}).items():
+                    problem_id = int(problem_id)
+                    # 题目已被删除
+                    if problem_id not in problem_contest:
+                        continue
+                    items.append(UserProblemStatus(user_id=profile.user_id,
+                                                   problem_id=problem_id,
+                                                   contest_id=problem_contest[problem_id],
+                                                   status=info["status"],
+                                                   score=info.get("score") or 0))
+        if len(items) >= 1000:
+            UserProblemStatus.objects.bulk_create(items, ignore_conflicts=True)
+            items = []
+    UserProblemStatus.objects.bulk_create(items, ignore_conflicts=True)
+
+
+def restore_problems_status(apps, schema_editor):
+    UserProfile = apps.get_model("account", "UserProfile")
+    UserProblemStatus = apps.get_model("problem", "UserProblemStatus")
+
+    profiles = {}
+    statuses = UserProblemStatus.objects.values_list("user_id", "problem_id", "problem___id", "problem__rule_type",
+                                                     "contest_id", "status", "score").order_by("user_id").iterator()
+    for user_id, problem_id, _id, rule_type, contest_id, status, score in statuses:
+        blobs = profiles.setdefault(user_id, {"ACM": {}, "OI": {}})
+        section = blobs[rule_type].setdefault("contest_problems" if contest_id else "problems", {})
+        section[str(problem_id)] = {"status": status, "_id": _id}
+        if rule_type == "OI":
+            section[str(problem_id)]["score"] = score
+    for user_id, blobs in profiles.items():
+        UserProfile.objects.filter(user_id=user_id).update(acm_problems_status=blobs["ACM"],
+                                                           oi_problems_status=blobs["OI"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('account', '0013_auto_20241207_0245'),
+        ('contest', '0011_auto_20241207_0245'),
+        ('problem', '0015_auto_20241207_0245'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserProblemStatus',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.IntegerField()),
+                ('score', models.IntegerField(default=0)),
+                ('contest', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='contest.contest')),
+                ('problem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='problem.problem')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'user_problem_status',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='userproblemstatus',
+            index=models.Index(fields=['user', 'contest'], name='user_proble_user_id_dc8255_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='userproblemstatus',
+            unique_together={('user', 'problem')},
+        ),
+        migrations.RunPython(backfill_user_problem_status, reverse_code=restore_problems_status),
+    ]
@@ -84,3 +84,17 @@ class Problem(models.Model):
     def add_ac_number(self):
         self.accepted_number = models.F("accepted_number") + 1
         self.save(update_fields=["accepted_number"])
+
+
+# 用户在每道题目上的状态，取代 UserProfile 中的 acm_problems_status / oi_problems_status
+class UserProblemStatus(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)  # 用户
+    problem = models.ForeignKey(Problem, on_delete=models.CASCADE)  # 题目
+    contest = models.ForeignKey(Contest, null=True, on_delete=models.CASCADE)  # 题目所属比赛
+    status = models.IntegerField()  # 最近一次有效的判题结果，AC 之后不再改变
+    score = models.IntegerField(default=0)  # 得分（OI模式）
+
+    class Meta:
+        db_table = "user_problem_status"  # 数据库表名
+        unique_together = (("user", "problem"),)  # 唯一约束
+        indexes = [models.Index(fields=["user", "contest"])]
@@ -0,0 +1,9 @@
+import dramatiq
+
+from utils.shortcuts import DRAMATIQ_WORKER_ARGS
+from .test_case_archive import TestCaseArchive
+
+
+@dramatiq.actor(**DRAMATIQ_WORKER_ARGS(time_limit=1800_000))
+def build_test_case_archive_task(test_case_id, spj):
+    TestCaseArchive(test_case_id, spj).build(blocking=False)
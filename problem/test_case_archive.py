@@ -0,0 +1,112 @@
+import glob
+import hashlib
+import json
+import os
+import zipfile
+
+from django.conf import settings
+
+from utils.cache import cache
+from utils.constants import CacheKey
+from utils.shortcuts import natural_sort_key, rand_str
+
+# 超过该大小的测试用例在后台打包，请求直接返回，避免长时间占用 web worker
+TEST_CASE_ARCHIVE_SYNC_SIZE = 64 * 1024 * 1024
+ARCHIVE_BUILD_TIMEOUT = 30 * 60
+
+
+class TestCaseArchive(object):
+    """
+    测试用例的下载压缩包，保存在 TEST_CASE_ARCHIVE_DIR 中，不在 rsync 同步的 TEST_CASE_DIR 下
+    文件名包含测试用例的版本，测试用例变化后版本随之变化，旧的压缩包在生成新版本时删除
+    先写入临时文件再重命名，并发下载不会读到写了一半的文件
+    """
+    def __init__(self, test_case_id, spj):
+        self.test_case_id = test_case_id
+        self.spj = spj
+        self.test_case_dir = os.path.join(settings.TEST_CASE_DIR, test_case_id)
+
+    def exists(self):
+        return os.path.isdir(self.test_case_dir)
+
+    def name_list(self):
+        with open(os.path.join(self.test_case_dir, "info"), encoding="utf-8") as f:
+            info = json.load(f)
+        names = []
+        for item in info["test_cases"].values():
+            names.append(item["input_name"])
+            if not self.spj:
+                names.append(item["output_name"])
+        return sorted(names, key=natural_sort_key) + ["info"]
+
+    def _stat(self):
+        return [(name, os.stat(os.path.join(self.test_case_dir, name))) for name in self.name_list()]
+
+    def size(self):
+        return sum(stat.st_size for _, stat in self._stat())
+
+    @property
+    def version(self):
+        """
+        由 manifest 中记录的内容摘要计算，不需要读取文件内容，blob 的修改时间变化（例如重复上传时刷新）不影响版本
+        还没有转换为 blob 存储的测试用例没有 manifest，由文件名、大小和修改时间计算
+        """
+        md5 = hashlib.md5(f"spj:{int(bool(self.spj))};".encode("utf-8"))
+        try:
+            with open(os.path.join(self.test_case_dir, "manifest"), encoding="utf-8") as f:
+                md5.update(json.load(f)["digest"].encode("utf-8"))
+        except FileNotFoundError:
+            for name, stat in self._stat():
+                md5.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns};".encode("utf-8"))
+        return md5.hexdigest()[:16]
+
+    @property
+    def path(self):
+        return os.path.join(settings.TEST_CASE_ARCHIVE_DIR, f"{self.test_case_id}-{self.version}.zip")
+
+    def is_built(self):
+        return os.path.isfile(self.path)
+
+    def build(self, blocking=True):
+        """
+        生成压缩包并返回路径，其他进程正在生成时等待，blocking 为 False 时直接返回 None
+        """
+        path = self.path
+        if os.path.isfile(path):
+            return path
+        lock = cache.lock(f"{CacheKey.test_case_archive_lock}:{self.test_case_id}", timeout=ARCHIVE_BUILD_TIMEOUT)
+        if not lock.acquire(blocking=blocking, blocking_timeout=ARCHIVE_BUILD_TIMEOUT):
+            return None
+        try:
+            if os.path.isfile(path):
+                return path
+            os.makedirs(settings.TEST_CASE_ARCHIVE_DIR, exist_ok=True)
+            tmp = os.path.join(settings.TEST_CASE_ARCHIVE_DIR, f".{rand_str()}.tmp")
+            try:
+                with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as f:
+                    for name in self.name_list():
+                        f.write(os.path.join(self.test_case_dir, name), name)
+                os.replace(tmp, path)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            for item in glob.glob(os.path.join(settings.TEST_CASE_ARCHIVE_DIR, f"{self.test_case_id}-*.zip")):
+                if item != path:
+                    os.remove(item)
+        finally:
+            lock.release()
+        return path
+
+    @classmethod
+    def gc(cls, referenced_ids):
+        """
+        删除已经没有题目引用的测试用例的压缩包，返回删除的数量
+        """
+        if not os.path.isdir(settings.TEST_CASE_ARCHIVE_DIR):
+            return 0
+        count = 0
+        for name in os.listdir(settings.TEST_CASE_ARCHIVE_DIR):
+            if name.endswith(".zip") and name.rsplit("-", 1)[0] not in referenced_ids:
+                os.remove(os.path.join(settings.TEST_CASE_ARCHIVE_DIR, name))
+                count += 1
+        return count
@@ -0,0 +1,69 @@
+import fcntl
+import os
+
+from django.conf import settings
+
+from utils.cache import cache
+from utils.constants import CacheKey
+from utils.shortcuts import rand_str
+
+JOURNAL_DIR = "journal"
+# 保留最近的日志条数，落后更多的判题服务器需要全量同步
+JOURNAL_RETENTION = 10000
+
+
+class TestCaseJournal(object):
+    """
+    测试用例变更日志，保存在 TEST_CASE_DIR/journal 中，随测试用例一起通过 rsync 提供给判题服务器
+     - journal/head 保存最新的序号
+     - journal/<seq> 第一行为 "add <test_case_id>" 或 "remove <test_case_id>"，之后每行是需要同步的路径
+    判题服务器只拉取新增的日志和其中列出的路径，不需要每次遍历整个目录
+    Redis 中记录每个测试用例是在哪个序号加入的，用于判断判题服务器是否已经同步了该测试用例
+    """
+    def __init__(self, root=None):
+        self._root = root
+
+    @property
+    def journal_dir(self):
+        return os.path.join(self._root or settings.TEST_CASE_DIR, JOURNAL_DIR)
+
+    def _write(self, name, content):
+        tmp = os.path.join(self.journal_dir, f".{rand_str()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, os.path.join(self.journal_dir, name))
+
+    def head(self):
+        try:
+            with open(os.path.join(self.journal_dir, "head"), encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def append(self, action, test_case_id, paths=()):
+        os.makedirs(self.journal_dir, exist_ok=True)
+        with open(os.path.join(self.journal_dir, ".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            seq = self.head() + 1
+            self._write(str(seq), "\n".join([f"{action} {test_case_id}", *paths]) + "\n")
+            self._write("head", f"{seq}\n")
+            try:
+                os.remove(os.path.join(self.journal_dir, str(seq - JOURNAL_RETENTION)))
+            except FileNotFoundError:
+                pass
+        if action == "add":
+            cache.hset(CacheKey.test_case_journal, test_case_id, seq)
+        else:
+            cache.hdel(CacheKey.test_case_journal, test_case_id)
+        return seq
+
+    def required_seq(self, test_case_id):
+        """
+        判题服务器至少要同步到该序号才有这个测试用例，没有记录时返回 0
+        """
+        seq = cache.hget(CacheKey.test_case_journal, test_case_id)
+        return int(seq) if seq else 0
+
+
+test_case_journal = TestCaseJournal()
@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+from django.conf import settings
+
+from utils.shortcuts import rand_str
+from .test_case_journal import JOURNAL_DIR, test_case_journal
+
+BLOB_DIR = "blobs"
+MANIFEST_DIR = "manifests"
+TMP_DIR = "tmp"
+# 上传后还没有保存到题目中的测试用例、刚写入还没有被引用的 blob 在该时间内不会被回收
+GC_GRACE_PERIOD = 24 * 3600
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class TestCaseStore(object):
+    """
+    按内容寻址的测试用例存储
+     - blobs/<sha256 前两位>/<sha256> 保存文件内容，相同内容只保存一次
+     - <test_case_id>/ 下的测试用例文件是 blob 的硬链接，判题服务器看到的目录结构不变，rsync -H 同步时每个 blob 只传输一次
+     - <test_case_id>/manifest 记录文件名到 blob 的映射，manifests/<digest> 记录相同内容的测试用例 id，重复上传时直接复用
+    blob 的硬链接数为 1 时说明已经没有测试用例引用，可以回收
+    """
+    def __init__(self, root=None):
+        self._root = root
+
+    @property
+    def root(self):
+        return self._root or settings.TEST_CASE_DIR
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, BLOB_DIR, digest[:2], digest)
+
+    def tmp_path(self):
+        tmp_dir = os.path.join(self.root, TMP_DIR)
+        os.makedirs(tmp_dir, exist_ok=True)
+        return os.path.join(tmp_dir, rand_str())
+
+    def put(self, path, digest):
+        """
+        把 path 移动到 blob 中，内容已经存在时删除 path
+        """
+        blob = self.blob_path(digest)
+        if os.path.exists(blob):
+            os.remove(path)
+            # 刷新修改时间，避免在建立硬链接之前被回收
+            os.utime(blob)
+        else:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.chmod(path, 0o640)
+            os.replace(path, blob)
+        return blob
+
+    def _manifest_digest(self, files, info):
+        return hashlib.sha256(json.dumps({"files": files, "info": info}, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _index_path(self, manifest_digest):
+        return os.path.join(self.root, MANIFEST_DIR, manifest_digest)
+
+    def _find(self, manifest_digest):
+        try:
+            with open(self._index_path(manifest_digest), encoding="utf-8") as f:
+                test_case_id = f.read().strip()
+        except FileNotFoundError:
+            return None
+        if os.path.isfile(os.path.join(self.root, test_case_id, "manifest")):
+            return test_case_id
+        return None
+
+    def _write_index(self, manifest_digest, test_case_id):
+        os.makedirs(os.path.join(self.root, MANIFEST_DIR), exist_ok=True)
+        tmp = self.tmp_path()
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(test_case_id)
+        os.replace(tmp, self._index_path(manifest_digest))
+
+    def _write_json(self, path, data):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(data, indent=4))
+        os.chmod(path, 0o640)
+
+    def create(self, files, info):
+        """
+        :param files: {文件名: blob 的 sha256}，blob 需要已经通过 put 写入
+        :param info: 判题服务器读取的 info 文件内容
+        :return: test_case_id，内容完全相同的测试用例已经存在时返回已有的 id
+        """
+        manifest_digest = self._manifest_digest(files, info)
+        test_case_id = self._find(manifest_digest)
+        if test_case_id:
+            # 刷新修改时间，避免保存到题目之前被回收
+            os.utime(os.path.join(self.root, test_case_id))
+            return test_case_id
+
+        test_case_id = rand_str()
+        test_case_dir = os.path.join(self.root, test_case_id)
+        os.mkdir(test_case_dir)
+        os.chmod(test_case_dir, 0o710)
+        for name, digest in files.items():
+            os.link(self.blob_path(digest), os.path.join(test_case_dir, name))
+        self._write_json(os.path.join(test_case_dir, "info"), info)
+        self._write_json(os.path.join(test_case_dir, "manifest"), {"files": files, "digest": manifest_digest})
+        self._write_index(manifest_digest, test_case_id)
+        blobs = sorted(set(os.path.relpath(self.blob_path(digest), self.root) for digest in files.values()))
+        test_case_journal.append("add", test_case_id, [test_case_id, *blobs])
+        return test_case_id
+
+    def adopt(self, test_case_id):
+        """
+        把之前直接保存在目录中的测试用例转换为 blob 的硬链接，返回新增的 blob 数量
+        """
+        test_case_dir = os.path.join(self.root, test_case_id)
+        if os.path.exists(os.path.join(test_case_dir, "manifest")):
+            return 0
+        with open(os.path.join(test_case_dir, "info"), encoding="utf-8") as f:
+            info = json.load(f)
+        files = {}
+        created = 0
+        for test_case in info["test_cases"].values():
+            for key in ("input_name", "output_name"):
+                name = test_case.get(key)
+                if not name:
+                    continue
+                path = os.path.join(test_case_dir, name)
+                digest = file_sha256(path)
+                blob = self.blob_path(digest)
+                if os.path.exists(blob):
+                    if not os.path.samefile(blob, path):
+                        tmp = self.tmp_path()
+                        os.link(blob, tmp)
+                        os.replace(tmp, path)
+                else:
+                    os.makedirs(os.path.dirname(blob), exist_ok=True)
+                    os.link(path, blob)
+                    created += 1
+                files[name] = digest
+        manifest_digest = self._manifest_digest(files, info)
+        self._write_json(os.path.join(test_case_dir, "manifest"), {"files": files, "digest": manifest_digest})
+        if not self._find(manifest_digest):
+            self._write_index(manifest_digest, test_case_id)
+        return created
+
+    def _expired(self, path, now, grace):
+        return now - os.lstat(path).st_mtime > grace
+
+    def gc(self, referenced_ids, grace=GC_GRACE_PERIOD, dry_run=False):
+        """
+        回收没有被题目引用的测试用例目录和没有被任何测试用例引用的 blob
+        只回收由本存储创建（有 manifest）的目录，旧的目录需要先通过 adopt 转换
+        """
+        now = time.time()
+        referenced_ids = set(referenced_ids)
+        stats = {"test_cases": 0, "blobs": 0, "blob_bytes": 0, "manifests": 0, "tmp": 0}
+
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name in (BLOB_DIR, MANIFEST_DIR, TMP_DIR, JOURNAL_DIR) or name in referenced_ids:
+                continue
+            if os.path.isfile(os.path.join(path, "manifest")) and self._expired(path, now, grace):
+                stats["test_cases"] += 1
+                if not dry_run:
+                    shutil.rmtree(path)
+                    test_case_journal.append("remove", name)
+
+        manifest_dir = os.path.join(self.root, MANIFEST_DIR)
+        if os.path.isdir(manifest_dir):
+            for name in os.listdir(manifest_dir):
+                if not self._find(name):
+                    stats["manifests"] += 1
+                    if not dry_run:
+                        os.remove(os.path.join(manifest_dir, name))
+
+        blob_dir = os.path.join(self.root, BLOB_DIR)
+        if os.path.isdir(blob_dir):
+            for prefix in os.listdir(blob_dir):
+                for name in os.listdir(os.path.join(blob_dir, prefix)):
+                    path = os.path.join(blob_dir, prefix, name)
+                    stat = os.lstat(path)
+                    if stat.st_nlink == 1 and now - stat.st_mtime > grace:
+                        stats["blobs"] += 1
+                        stats["blob_bytes"] += stat.st_size
+                        if not dry_run:
+                            os.remove(path)
+
+        tmp_dir = os.path.join(self.root, TMP_DIR)
+        if os.path.isdir(tmp_dir):
+            for name in os.listdir(tmp_dir):
+                path = os.path.join(tmp_dir, name)
+                if self._expired(path, now, grace):
+                    stats["tmp"] += 1
+                    if not dry_run:
+                        os.remove(path)
+        return stats
+
+
+test_case_store = TestCaseStore()
@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+import zipfile
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from utils.api import APIError
+from .test_case_archive import TestCaseArchive
+from .test_case_store import TestCaseStore, file_sha256
+from .views.admin import TestCaseZipProcessor
+
+
+class TestCaseArchiveTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        settings = override_settings(TEST_CASE_DIR=os.path.join(self.root, "test_case"),
+                                     TEST_CASE_ARCHIVE_DIR=os.path.join(self.root, "test_case_archive"))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        os.mkdir(os.path.join(self.root, "test_case"))
+        self.store = TestCaseStore()
+
+    def put(self, content):
+        path = self.store.tmp_path()
+        with open(path, "w") as f:
+            f.write(content)
+        digest = file_sha256(path)
+        self.store.put(path, digest)
+        return digest
+
+    def create(self, output="3\n"):
+        files = {"1.in": self.put("1 2\n"), "1.out": self.put(output)}
+        info = {"spj": False, "test_cases": {"1": {"input_name": "1.in", "output_name": "1.out"}}}
+        return self.store.create(files, info)
+
+    def test_version(self):
+        archive = TestCaseArchive(self.create(), spj=False)
+        version = archive.version
+        path = archive.build()
+        self.assertTrue(path.endswith(f"-{version}.zip"))
+        # 重复上传相同的内容会刷新 blob 的修改时间，压缩包不需要重新生成
+        self.assertEqual(self.create(), archive.test_case_id)
+        self.assertEqual(archive.version, version)
+        self.assertTrue(archive.is_built())
+        # 特殊判题的压缩包不包含输出文件
+        self.assertNotEqual(TestCaseArchive(archive.test_case_id, spj=True).version, version)
+        self.assertNotEqual(TestCaseArchive(self.create(output="4\n"), spj=False).version, version)
+
+
+class TestCaseZipProcessorTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        settings = override_settings(TEST_CASE_DIR=self.root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def zip(self, files):
+        path = os.path.join(self.root, "upload.zip")
+        with zipfile.ZipFile(path, "w") as f:
+            for name, content in files.items():
+                f.writestr(name, content)
+        return path
+
+    def test_process_zip(self):
+        info, test_case_id = TestCaseZipProcessor().process_zip(self.zip({"1.in": "1 2\r\n", "1.out": "3\r\n"}),
+                                                                spj=False)
+        self.assertEqual([(item["input_name"], item["output_name"]) for item in info], [("1.in", "1.out")])
+        with open(os.path.join(self.root, test_case_id, "1.in")) as f:
+            self.assertEqual(f.read(), "1 2\n")
+
+    def test_empty_zip(self):
+        path = self.zip({"1.in": "1 2\n"})
+        with mock.patch("zipfile.ZipFile.close", autospec=True, side_effect=zipfile.ZipFile.close) as close:
+            try:
+                TestCaseZipProcessor().process_zip(path, spj=False)
+            except APIError as e:
+                # 异常的 traceback 还引用着 zip_file，不会因为垃圾回收而关闭
+                self.assertEqual(e.msg, "Empty file")
+                close.assert_called_once()
+            else:
+                self.fail("APIError not raised")
@@ -1,6 +1,12 @@
+import hashlib
 import re
 from functools import lru_cache
 
+# 处理测试用例时每次读取的字节数
+TEST_CASE_CHUNK_SIZE = 1024 * 1024
+# 并行处理压缩包中测试用例的线程数
+TEST_CASE_PROCESS_WORKERS = 4
+
 
 TEMPLATE_BASE = """//PREPEND BEGIN
 {}
@@ -23,3 +29,55 @@ def parse_problem_template(template_str):
     return {"prepend": prepend[0] if prepend else "",
             "template": template[0] if template else "",
             "append": append[0] if append else ""}
+
+
+def _update_stripped_md5(md5, dst, chunk, pending):
+    """
+    计算去掉末尾空白后的 md5，末尾的空白先不计入，后面出现非空白内容时再从已写入的文件中读回
+    返回当前末尾空白的长度
+    """
+    body = chunk.rstrip()
+    if not body:
+        return pending + len(chunk)
+    if pending:
+        end = dst.tell()
+        dst.seek(end - len(chunk) - pending)
+        while pending:
+            data = dst.read(min(pending, TEST_CASE_CHUNK_SIZE))
+            md5.update(data)
+            pending -= len(data)
+        dst.seek(end)
+    md5.update(body)
+    return len(chunk) - len(body)
+
+
+def normalize_test_case(src, dst, stripped_md5=False):
+    """
+    把 src 逐块写入 dst，同时把 \\r\\n 转换为 \\n，内存占用与文件大小无关
+    dst 需要以 w+b 打开，返回 (转换后的大小, 去掉末尾空白后的 md5, 转换后内容的 sha256)
+    """
+    size = 0
+    sha256 = hashlib.sha256()
+    md5 = hashlib.md5() if stripped_md5 else None
+    pending = 0
+    carry = b""
+    while True:
+        chunk = src.read(TEST_CASE_CHUNK_SIZE)
+        if not chunk:
+            chunk, carry = carry, b""
+            if not chunk:
+                break
+        else:
+            chunk = carry + chunk
+            # \r\n 可能被分在两块中，末尾的 \r 留到下一块处理
+            if chunk.endswith(b"\r"):
+                chunk, carry = chunk[:-1], b"\r"
+            else:
+                carry = b""
+            chunk = chunk.replace(b"\r\n", b"\n")
+        dst.write(chunk)
+        size += len(chunk)
+        sha256.update(chunk)
+        if md5:
+            pending = _update_stripped_md5(md5, dst, chunk, pending)
+    return size, md5.hexdigest() if md5 else None, sha256.hexdigest()
@@ -1,23 +1,26 @@
-import hashlib
-import json
 import os
 # import shutil
 import tempfile
 import zipfile
-from wsgiref.util import FileWrapper
+from concurrent.futures import ThreadPoolExecutor
 
 from django.conf import settings
 from django.db.models import Q
-from django.http import StreamingHttpResponse
+from django.http import FileResponse, HttpResponse
 
 from account.decorators import problem_permission_required, ensure_created_by
 from contest.models import Contest, ContestStatus
 from judge.dispatcher import SPJCompiler
+from judge.spj import get_spj_version
 from submission.models import Submission, JudgeStatus
 from utils.api import APIView, CSRFExemptAPIView, validate_serializer, APIError
 from utils.shortcuts import rand_str, natural_sort_key
 from utils.tasks import delete_files
 from ..models import Problem, ProblemRuleType, ProblemTag
+from ..tasks import build_test_case_archive_task
+from ..test_case_archive import TEST_CASE_ARCHIVE_SYNC_SIZE, TestCaseArchive
+from ..test_case_store import test_case_store
+from ..utils import TEST_CASE_PROCESS_WORKERS, normalize_test_case
 from ..serializers import (CreateContestProblemSerializer, CompileSPJSerializer,
                            CreateProblemSerializer, EditProblemSerializer, EditContestProblemSerializer,
                            ProblemAdminSerializer, TestCaseUploadForm, ContestProblemMakePublicSerializer,
@@ -25,31 +28,40 @@ from ..serializers import (CreateContestProblemSerializer, CompileSPJSerializer,
 
 
 class TestCaseZipProcessor(object):
+    process_workers = TEST_CASE_PROCESS_WORKERS
+
+    def _process_member(self, zip_file, name):
+        """
+        解压到临时文件后按内容存入 test_case_store，返回 (大小, md5, sha256)
+        """
+        path = test_case_store.tmp_path()
+        with zip_file.open(name) as src, open(path, "w+b") as dst:
+            size, md5, digest = normalize_test_case(src, dst, stripped_md5=name.endswith(".out"))
+        test_case_store.put(path, digest)
+        return size, md5, digest
+
     def process_zip(self, uploaded_zip_file, spj, dir=""):
         try:
             zip_file = zipfile.ZipFile(uploaded_zip_file, "r")
         except zipfile.BadZipFile:
             raise APIError("Bad zip file")
-        name_list = zip_file.namelist()
-        test_case_list = self.filter_name_list(name_list, spj=spj, dir=dir)
-        if not test_case_list:
-            raise APIError("Empty file")
-
-        test_case_id = rand_str()
-        test_case_dir = os.path.join(settings.TEST_CASE_DIR, test_case_id)
-        os.mkdir(test_case_dir)
-        os.chmod(test_case_dir, 0o710)
-
         size_cache = {}
         md5_cache = {}
-
-        for item in test_case_list:
-            with open(os.path.join(test_case_dir, item), "wb") as f:
-                content = zip_file.read(f"{dir}{item}").replace(b"\r\n", b"\n")
-                size_cache[item] = len(content)
-                if item.endswith(".out"):
-                    md5_cache[item] = hashlib.md5(content.rstrip()).hexdigest()
-                f.write(content)
+        blobs = {}
+
+        # 文件为空或者解压出错时同样需要关闭
+        with zip_file:
+            name_list = zip_file.namelist()
+            test_case_list = self.filter_name_list(name_list, spj=spj, dir=dir)
+            if not test_case_list:
+                raise APIError("Empty file")
+
+            # 每个文件逐块解压、转换换行符并计算 md5，多个文件并行处理
+            with ThreadPoolExecutor(max_workers=self.process_workers) as executor:
+                futures = {item: executor.submit(self._process_member, zip_file, f"{dir}{item}")
+                           for item in test_case_list}
+                for item, future in futures.items():
+                    size_cache[item], md5_cache[item], blobs[item] = future.result()
         test_case_info = {"spj": spj, "test_cases": {}}
 
         info = []
@@ -71,12 +83,7 @@ class TestCaseZipProcessor(object):
                 info.append(data)
                 test_case_info["test_cases"][str(index + 1)] = data
 
-        with open(os.path.join(test_case_dir, "info"), "w", encoding="utf-8") as f:
-            f.write(json.dumps(test_case_info, indent=4))
-
-        for item in os.listdir(test_case_dir):
-            os.chmod(os.path.join(test_case_dir, item), 0o640)
-
+        test_case_id = test_case_store.create(blobs, test_case_info)
         return info, test_case_id
 
     def filter_name_list(self, name_list, spj, dir=""):
@@ -121,20 +128,24 @@ class TestCaseAPI(CSRFExemptAPIView, TestCaseZipProcessor):
         else:
             ensure_created_by(problem, request.user)
 
-        test_case_dir = os.path.join(settings.TEST_CASE_DIR, problem.test_case_id)
-        if not os.path.isdir(test_case_dir):
+        archive = TestCaseArchive(problem.test_case_id, problem.spj)
+        if not archive.exists():
             return self.error("Test case does not exists")
-        name_list = self.filter_name_list(os.listdir(test_case_dir), problem.spj)
-        name_list.append("info")
-        file_name = os.path.join(test_case_dir, problem.test_case_id + ".zip")
-        with zipfile.ZipFile(file_name, "w") as file:
-            for test_case in name_list:
-                file.write(f"{test_case_dir}/{test_case}", test_case)
-        response = StreamingHttpResponse(FileWrapper(open(file_name, "rb")),
-                                         content_type="application/octet-stream")
-
+        if not archive.is_built():
+            if archive.size() > TEST_CASE_ARCHIVE_SYNC_SIZE:
+                build_test_case_archive_task.send(problem.test_case_id, problem.spj)
+                return self.error("Test case archive is being prepared, please try again later")
+            if not archive.build():
+                return self.error("Test case archive is being prepared, please try again later")
+        path = archive.path
+
+        if settings.TEST_CASE_ARCHIVE_ACCEL_PREFIX:
+            response = HttpResponse(content_type="application/octet-stream")
+            response["X-Accel-Redirect"] = settings.TEST_CASE_ARCHIVE_ACCEL_PREFIX + os.path.basename(path)
+        else:
+            response = FileResponse(open(path, "rb"), content_type="application/octet-stream")
+            response["Content-Length"] = os.path.getsize(path)
         response["Content-Disposition"] = f"attachment; filename=problem_{problem.id}_test_cases.zip"
-        response["Content-Length"] = os.path.getsize(file_name)
         return response
 
     def post(self, request):
@@ -157,7 +168,8 @@ class CompileSPJAPI(APIView):
     @validate_serializer(CompileSPJSerializer)
     def post(self, request):
         data = request.data
-        spj_version = rand_str(8)
+        # 与保存题目时的版本相同，保存后判题服务器可以直接使用这次编译的结果
+        spj_version = get_spj_version(data["spj_language"], data["spj_code"])
         error = SPJCompiler(data["spj_code"], spj_version, data["spj_language"]).compile_spj()
         if error:
             return self.error(error)
@@ -173,8 +185,7 @@ class ProblemBase(APIView):
                 return "Invalid spj"
             if not data["spj_compile_ok"]:
                 return "SPJ code must be compiled successfully"
-            data["spj_version"] = hashlib.md5(
-                (data["spj_language"] + ":" + data["spj_code"]).encode("utf-8")).hexdigest()
+            data["spj_version"] = get_spj_version(data["spj_language"], data["spj_code"])
         else:
             data["spj_language"] = None
             data["spj_code"] = None
@@ -2,9 +2,8 @@ import random
 from django.db.models import Q, Count
 from utils.api import APIView
 from account.decorators import check_contest_permission
-from ..models import ProblemTag, Problem, ProblemRuleType
+from ..models import ProblemTag, Problem, UserProblemStatus
 from ..serializers import ProblemSerializer, TagSerializer, ProblemSafeSerializer
-from contest.models import ContestRuleType
 
 
 class ProblemTagAPI(APIView):
@@ -30,20 +29,17 @@ class ProblemAPI(APIView):
     @staticmethod
     def _add_problem_status(request, queryset_values):
         if request.user.is_authenticated:
-            profile = request.user.userprofile
-            acm_problems_status = profile.acm_problems_status.get("problems", {})
-            oi_problems_status = profile.oi_problems_status.get("problems", {})
             # paginate data
             results = queryset_values.get("results")
             if results is not None:
                 problems = results
             else:
                 problems = [queryset_values, ]
+            problems_status = dict(UserProblemStatus.objects.filter(user_id=request.user.id,
+                                                                    problem_id__in=[item["id"] for item in problems])
+                                   .values_list("problem_id", "status"))
             for problem in problems:
-                if problem["rule_type"] == ProblemRuleType.ACM:
-                    problem["my_status"] = acm_problems_status.get(str(problem["id"]), {}).get("status")
-                else:
-                    problem["my_status"] = oi_problems_status.get(str(problem["id"]), {}).get("status")
+                problem["my_status"] = problems_status.get(problem["id"])
 
     def get(self, request):
         # 问题详情页
@@ -86,13 +82,10 @@ class ProblemAPI(APIView):
 class ContestProblemAPI(APIView):
     def _add_problem_status(self, request, queryset_values):
         if request.user.is_authenticated:
-            profile = request.user.userprofile
-            if self.contest.rule_type == ContestRuleType.ACM:
-                problems_status = profile.acm_problems_status.get("contest_problems", {})
-            else:
-                problems_status = profile.oi_problems_status.get("contest_problems", {})
+            problems_status = dict(UserProblemStatus.objects.filter(user_id=request.user.id, contest=self.contest)
+                                   .values_list("problem_id", "status"))
             for problem in queryset_values:
-                problem["my_status"] = problems_status.get(str(problem["id"]), {}).get("status")
+                problem["my_status"] = problems_status.get(problem["id"])
 
     @check_contest_permission(check_type="problems")
     def get(self, request):
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.25 on 2026-10-18 14:34
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # submission 表很大，并发创建索引不锁表
+    atomic = False
+
+    dependencies = [
+        ('submission', '0013_auto_20241207_0245'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='submission',
+            options={'ordering': ('-create_time', '-id')},
+        ),
+        AddIndexConcurrently(
+            model_name='submission',
+            index=models.Index(fields=['contest', '-create_time', '-id'], name='submission_contest_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='submission',
+            index=models.Index(fields=['problem', '-create_time', '-id'], name='submission_problem_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='submission',
+            index=models.Index(fields=['user_id', '-create_time', '-id'], name='submission_user_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='submission',
+            index=models.Index(fields=['contest', 'result', '-create_time', '-id'], name='submission_result_time_idx'),
+        ),
+    ]
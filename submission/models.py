@@ -53,7 +53,15 @@ class Submission(models.Model):
 
     class Meta:
         db_table = "submission"
-        ordering = ("-create_time",)
+        # id 保证 create_time 相同时顺序确定，游标分页依赖该顺序
+        ordering = ("-create_time", "-id")
+        # 与提交列表的过滤条件对应，create_time 和 id 放在最后，按时间倒序的分页可以直接使用索引
+        indexes = [
+            models.Index(fields=["contest", "-create_time", "-id"], name="submission_contest_time_idx"),
+            models.Index(fields=["problem", "-create_time", "-id"], name="submission_problem_time_idx"),
+            models.Index(fields=["user_id", "-create_time", "-id"], name="submission_user_time_idx"),
+            models.Index(fields=["contest", "result", "-create_time", "-id"], name="submission_result_time_idx"),
+        ]
 
     def __str__(self):
         return self.id
@@ -0,0 +1,359 @@
+import json
+import time
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count
+
+from account.models import User, UserProfile
+from contest.models import ACMContestRank, Contest, ContestRuleType, OIContestRank
+from contest.replay import ContestReplay, UNCOUNTED_RESULTS
+from contest.scoreboard import ContestScoreboard
+from problem.models import Problem, ProblemRuleType, UserProblemStatus
+from utils.cache import cache, RedisScript
+from utils.constants import CacheKey, JudgeLane
+from utils.shortcuts import rand_str
+from .models import JudgeStatus, Submission
+
+# 每次重置并投递的提交数量
+REJUDGE_CHUNK_SIZE = 500
+# 已投递但还没有判完的提交超过该数量时暂停投递
+REJUDGE_MAX_PENDING = 2000
+# 暂停投递后重新检查的间隔（毫秒）
+REJUDGE_RETRY_DELAY = 2000
+# 任务信息在 Redis 中的保存时间
+REJUDGE_JOB_TTL = 7 * 24 * 3600
+
+# 超过该时间（秒）没有任何提交判完时，认为剩余的提交已经丢失，直接重新计算统计
+REJUDGE_STALE_TIMEOUT = 1800
+# 检查任务是否停滞的间隔（毫秒）
+REJUDGE_CHECK_INTERVAL = 60_000
+# 重新计算题目统计期间有新的判题结果时，最多重新读取的次数
+RECOMPUTE_MAX_ATTEMPTS = 3
+# 多次重新读取后仍然有新的判题结果时，延迟后再次重新计算（毫秒）
+RECOMPUTE_RETRY_DELAY = 10_000
+
+# KEYS: job, finished, submission
+# ARGV: field（finished 或 enqueued）, submission_id, now, ttl, job_id
+# 判完一个提交或者全部投递完成后调用，全部投递完成且全部判完时返回 1，只会返回一次
+# 判完的提交 id 记录在 set 中，同一个提交重复投递、重复判题时只计一次，并删除提交属于该任务的标记
+_progress_script = RedisScript("""
+if ARGV[1] == "finished" and redis.call("GET", KEYS[3]) == ARGV[5] then
+    redis.call("DEL", KEYS[3])
+end
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return 0
+end
+if ARGV[1] == "finished" then
+    if redis.call("SADD", KEYS[2], ARGV[2]) == 0 then
+        return 0
+    end
+    redis.call("EXPIRE", KEYS[2], ARGV[4])
+    redis.call("HSET", KEYS[1], "finished", redis.call("SCARD", KEYS[2]), "progress_time", ARGV[3])
+elseif redis.call("HGET", KEYS[1], "status") == "running" then
+    redis.call("HSET", KEYS[1], "status", "enqueued", "progress_time", ARGV[3])
+end
+local status = redis.call("HGET", KEYS[1], "status")
+local finished = tonumber(redis.call("HGET", KEYS[1], "finished") or "0")
+local enqueued = tonumber(redis.call("HGET", KEYS[1], "enqueued") or "0")
+if status == "enqueued" and finished >= enqueued then
+    redis.call("HSET", KEYS[1], "status", "finishing")
+    return 1
+end
+return 0
+""")
+
+# KEYS: job
+# ARGV: now, idle
+# 已经全部投递、但超过 idle 秒没有进展的任务直接进入 finishing
+# 返回 1 表示已经转为 finishing，0 表示还在正常进行，-1 表示任务不处于 enqueued 状态
+_force_finish_script = RedisScript("""
+if redis.call("HGET", KEYS[1], "status") ~= "enqueued" then
+    return -1
+end
+local progress_time = tonumber(redis.call("HGET", KEYS[1], "progress_time") or "0")
+if tonumber(ARGV[1]) - progress_time < tonumber(ARGV[2]) then
+    return 0
+end
+redis.call("HSET", KEYS[1], "status", "finishing", "forced", 1)
+return 1
+""")
+
+
+class RejudgeJobs(object):
+    """
+    批量重判任务，进度保存在 Redis 的 hash 中
+     - bulk_rejudge_task 按 id 顺序分块重置提交并投递到 rejudge 通道，未判完的数量超过 REJUDGE_MAX_PENDING 时延迟后再继续
+     - 重判的提交所属的任务 id 保存在 Redis 中（不写入提交的 statistic_info，避免通过接口返回），
+       判题结束后不再逐条更新统计数据，只记录为已完成
+       无论判题成功、失败还是用户已被禁用，judge_task 结束时都会记录，重复投递的提交只记录一次
+     - 全部判完后由 finish_rejudge_task 根据提交重新计算题目、用户和比赛排名的统计数据
+     - 全部投递后 check_rejudge_task 定期检查，超过 REJUDGE_STALE_TIMEOUT 没有进展时不再等待剩余的提交，
+       管理员也可以通过 finish_now 直接结束等待
+    status: running -> enqueued（全部投递）-> finishing（全部判完，正在重新计算统计）-> done
+    """
+    def __init__(self, prefix=CacheKey.rejudge_job):
+        self.prefix = prefix
+        self.index_key = f"{prefix}:index"
+
+    def _key(self, job_id):
+        return f"{self.prefix}:{job_id}"
+
+    def _finished_key(self, job_id):
+        return f"{self.prefix}:{job_id}:finished"
+
+    def _submission_key(self, submission_id):
+        return f"{self.prefix}:submission:{submission_id}"
+
+    def job_of(self, submission_id):
+        """
+        提交正在被哪个批量重判任务重判，不属于任何任务时返回 None
+        """
+        # cache.get 会按 pickle 解码，这里读取的是原始字符串
+        with cache.pipeline() as pipe:
+            pipe.get(self._submission_key(submission_id))
+            job_id = pipe.execute()[0]
+        return job_id.decode("utf-8") if job_id else None
+
+    def forget(self, submission_id):
+        """
+        单独重判一个提交时调用，之后的判题结果正常更新统计数据
+        """
+        cache.delete(self._submission_key(submission_id))
+
+    def create(self, user_id, problem_id=None, contest_id=None, result=None, start_time=None, end_time=None):
+        job_id = rand_str(16)
+        filters = {"problem_id": problem_id, "contest_id": contest_id, "result": result,
+                   "start_time": start_time.isoformat() if start_time else None,
+                   "end_time": end_time.isoformat() if end_time else None}
+        job = {"id": job_id, "status": "running", "created_by": user_id, "create_time": time.time(),
+               "filters": json.dumps(filters), "total": self.queryset(filters).count(),
+               "enqueued": 0, "finished": 0, "cursor": ""}
+        with cache.pipeline() as pipe:
+            pipe.hset(self._key(job_id), mapping=job)
+            pipe.expire(self._key(job_id), REJUDGE_JOB_TTL)
+            pipe.zadd(self.index_key, {job_id: job["create_time"]})
+            pipe.zremrangebyscore(self.index_key, "-inf", job["create_time"] - REJUDGE_JOB_TTL)
+            pipe.execute()
+        return job_id
+
+    def get(self, job_id):
+        data = {k.decode("utf-8"): v.decode("utf-8") for k, v in cache.hgetall(self._key(job_id)).items()}
+        if not data:
+            return None
+        for field in ("total", "enqueued", "finished"):
+            data[field] = int(data[field])
+        for field in ("create_time", "finish_time"):
+            if field in data:
+                data[field] = float(data[field])
+        data["created_by"] = int(data["created_by"])
+        data["forced"] = bool(data.get("forced"))
+        data["filters"] = json.loads(data["filters"])
+        data.pop("cursor", None)
+        return data
+
+    def recent(self, count=20):
+        jobs = [self.get(job_id.decode("utf-8")) for job_id in cache.zrevrange(self.index_key, 0, count - 1)]
+        return [job for job in jobs if job]
+
+    def queryset(self, filters):
+        qs = Submission.objects.all()
+        if filters["problem_id"]:
+            qs = qs.filter(problem_id=filters["problem_id"])
+        if filters["contest_id"]:
+            qs = qs.filter(contest_id=filters["contest_id"])
+        if filters["result"] is not None:
+            qs = qs.filter(result=filters["result"])
+        if filters["start_time"]:
+            qs = qs.filter(create_time__gte=filters["start_time"])
+        if filters["end_time"]:
+            qs = qs.filter(create_time__lt=filters["end_time"])
+        # 被禁用用户的提交不会判题，不能计入任务
+        return qs.exclude(user_id__in=User.objects.filter(is_disabled=True).values("id"))
+
+    def enqueue_next(self, job_id):
+        """
+        投递下一块提交，返回 (是否还有剩余, 是否需要稍后重试)
+        """
+        # 防止循环引入
+        from judge.tasks import send_judge_task
+
+        key = self._key(job_id)
+        fields = ("status", "filters", "cursor", "enqueued", "finished")
+        status, filters, cursor, enqueued, finished = cache.hmget(key, *fields)
+        if status != b"running":
+            return False, False
+        if int(enqueued) - int(finished) + REJUDGE_CHUNK_SIZE > REJUDGE_MAX_PENDING:
+            return True, True
+
+        qs = self.queryset(json.loads(filters))
+        if cursor:
+            qs = qs.filter(id__gt=cursor.decode("utf-8"))
+        items = list(qs.order_by("id").values_list("id", "problem_id")[:REJUDGE_CHUNK_SIZE])
+        if items:
+            # 先记录提交属于该任务，再用一条 UPDATE 重置整块提交
+            with cache.pipeline() as pipe:
+                for submission_id, _ in items:
+                    pipe.set(self._submission_key(submission_id), job_id, ex=REJUDGE_JOB_TTL)
+                pipe.execute()
+            Submission.objects.filter(id__in=[id for id, _ in items]).update(
+                result=JudgeStatus.PENDING, info={}, statistic_info={})
+            with cache.pipeline() as pipe:
+                pipe.hincrby(key, "enqueued", len(items))
+                pipe.hset(key, "cursor", items[-1][0])
+                pipe.execute()
+            for submission_id, problem_id in items:
+                send_judge_task(submission_id, problem_id, lane=JudgeLane.REJUDGE, rejudge_job=job_id)
+        if len(items) < REJUDGE_CHUNK_SIZE:
+            self._progress(job_id, "enqueued")
+            return False, False
+        return True, False
+
+    def finish_one(self, job_id, submission_id):
+        self._progress(job_id, "finished", submission_id)
+
+    def _progress(self, job_id, field, submission_id=""):
+        # 防止循环引入
+        from submission.tasks import finish_rejudge_task
+
+        keys = [self._key(job_id), self._finished_key(job_id), self._submission_key(submission_id)]
+        if _progress_script(keys=keys, args=[field, submission_id, time.time(), REJUDGE_JOB_TTL, job_id]):
+            finish_rejudge_task.send(job_id)
+
+    def finish_if_stale(self, job_id, idle=REJUDGE_STALE_TIMEOUT):
+        """
+        全部投递后超过 idle 秒没有提交判完时，不再等待剩余的提交，直接重新计算统计
+        返回 1 已结束等待，0 还在正常进行，-1 任务不在等待判题结果
+        """
+        # 防止循环引入
+        from submission.tasks import finish_rejudge_task
+
+        ret = _force_finish_script(keys=[self._key(job_id)], args=[time.time(), idle])
+        if ret == 1:
+            finish_rejudge_task.send(job_id)
+        return ret
+
+    def finish_now(self, job_id):
+        return self.finish_if_stale(job_id, idle=0) == 1
+
+    def finish(self, job_id):
+        job = self.get(job_id)
+        if not job:
+            return
+        filters = job["filters"]
+        contest_id = filters["contest_id"]
+        problem = None
+        if filters["problem_id"]:
+            problem = Problem.objects.get(id=filters["problem_id"])
+            contest_id = problem.contest_id
+        if contest_id:
+            recompute_contest_statistic(Contest.objects.get(id=contest_id))
+        elif not recompute_problem_statistic(problem):
+            # 防止循环引入
+            from submission.tasks import recompute_problem_task
+            recompute_problem_task.send_with_options(args=(problem.id,), delay=RECOMPUTE_RETRY_DELAY)
+        with cache.pipeline() as pipe:
+            pipe.hset(self._key(job_id), mapping={"status": "done", "finish_time": time.time()})
+            pipe.delete(self._finished_key(job_id))
+            pipe.execute()
+
+
+rejudge_jobs = RejudgeJobs()
+
+
+def _problem_counters(rows):
+    """
+    rows 为 (result, count)，返回 Problem 的 submission_number, accepted_number, statistic_info
+    """
+    statistic_info = {str(result): count for result, count in rows if result not in UNCOUNTED_RESULTS}
+    return {"submission_number": sum(statistic_info.values()),
+            "accepted_number": statistic_info.get(str(JudgeStatus.ACCEPTED), 0),
+            "statistic_info": statistic_info}
+
+
+def recompute_problem_statistic(problem):
+    """
+    根据提交重新计算非比赛题目的计数、用户在该题目上的状态，并修正用户的 AC 数和总分
+    重新计算期间判完的提交不进入 statistic_buffer，计算结束后仍有这样的提交时重新读取，返回是否计算完整
+    """
+    # 防止循环引入
+    from judge.statistic import statistic_buffer
+
+    for _ in range(RECOMPUTE_MAX_ATTEMPTS):
+        statistic_buffer.pause(problem.id)
+        try:
+            # 暂停之前已经累加的增量先写入，之后读取的提交已经包含这些结果，不会再累加到重新计算的结果上
+            statistic_buffer.flush(wait=True)
+            _recompute_problem_statistic(problem)
+        finally:
+            skipped = statistic_buffer.resume(problem.id)
+        if not skipped:
+            return True
+    return False
+
+
+def _recompute_problem_statistic(problem):
+    with transaction.atomic():
+        # 锁定题目之后再读取提交，读取和写入在同一个事务中
+        Problem.objects.select_for_update().filter(id=problem.id).values_list("id").get()
+        submissions = Submission.objects.filter(problem_id=problem.id, contest_id__isnull=True) \
+            .exclude(result__in=UNCOUNTED_RESULTS)
+        counters = _problem_counters(submissions.values_list("result").annotate(count=Count("id")).order_by())
+
+        # 与 JudgeDispatcher._update_user_problem_status 一致：AC 之后不再改变，否则为最后一次的结果
+        statuses = {}
+        rows = submissions.order_by("create_time").values_list("user_id", "result", "statistic_info")
+        for user_id, result, statistic_info in rows.iterator(chunk_size=REJUDGE_CHUNK_SIZE):
+            status = statuses.get(user_id)
+            if status and status[0] == JudgeStatus.ACCEPTED:
+                continue
+            statuses[user_id] = (result, statistic_info.get("score", 0))
+
+        is_oi = problem.rule_type == ProblemRuleType.OI
+        Problem.objects.filter(id=problem.id).update(**counters)
+        existing = {item.user_id: item
+                    for item in UserProblemStatus.objects.select_for_update().filter(problem=problem)}
+        user_deltas = defaultdict(lambda: {"accepted_number": 0, "total_score": 0})
+        to_update, to_create = [], []
+        for user_id, (result, score) in statuses.items():
+            item = existing.get(user_id)
+            old_result, old_score = (item.status, item.score) if item else (None, 0)
+            if (old_result == JudgeStatus.ACCEPTED) != (result == JudgeStatus.ACCEPTED):
+                user_deltas[user_id]["accepted_number"] += 1 if result == JudgeStatus.ACCEPTED else -1
+            if is_oi and score != old_score:
+                user_deltas[user_id]["total_score"] += score - old_score
+            if item:
+                if (item.status, item.score) != (result, score):
+                    item.status, item.score = result, score
+                    to_update.append(item)
+            else:
+                to_create.append(UserProblemStatus(user_id=user_id, problem=problem, status=result, score=score))
+        UserProblemStatus.objects.bulk_update(to_update, ["status", "score"], batch_size=REJUDGE_CHUNK_SIZE)
+        UserProblemStatus.objects.bulk_create(to_create, batch_size=REJUDGE_CHUNK_SIZE)
+        for user_id in sorted(user_deltas):
+            deltas = user_deltas[user_id]
+            profile = UserProfile.objects.select_for_update().get(user_id=user_id)
+            profile.accepted_number = max(profile.accepted_number + deltas["accepted_number"], 0)
+            profile.total_score = max(profile.total_score + deltas["total_score"], 0)
+            profile.save(update_fields=["accepted_number", "total_score"])
+
+
+def recompute_contest_statistic(contest):
+    """
+    按提交时间重放比赛中的提交，重新计算题目计数、用户题目状态和排名
+    """
+    model = ACMContestRank if contest.rule_type == ContestRuleType.ACM else OIContestRank
+    with transaction.atomic():
+        # 先锁定题目再读取提交，判题时在同一个题目锁中保存结果并更新统计，读取到的提交与写入的统计一致
+        list(Problem.objects.select_for_update().filter(contest=contest).order_by("id").values_list("id"))
+        replay = ContestReplay(contest).run()
+        for problem_id, counters in replay.problems.items():
+            Problem.objects.filter(id=problem_id).update(**counters)
+        UserProblemStatus.objects.filter(problem_id__in=replay.problem_ids).delete()
+        UserProblemStatus.objects.bulk_create(
+            [UserProblemStatus(user_id=user_id, problem_id=problem_id, contest=contest, status=status, score=score)
+             for (user_id, problem_id), (status, score) in replay.statuses.items()], batch_size=REJUDGE_CHUNK_SIZE)
+        model.objects.filter(contest=contest).delete()
+        model.objects.bulk_create(replay.ranks.values(), batch_size=REJUDGE_CHUNK_SIZE)
+        # 排名缓存在下次访问时重新生成
+        transaction.on_commit(ContestScoreboard(contest).delete)
@@ -11,6 +11,14 @@ class CreateSubmissionSerializer(serializers.Serializer):
     captcha = serializers.CharField(required=False)
 
 
+class BulkRejudgeSerializer(serializers.Serializer):
+    problem_id = serializers.IntegerField(required=False)
+    contest_id = serializers.IntegerField(required=False)
+    result = serializers.IntegerField(required=False)
+    start_time = serializers.DateTimeField(required=False)
+    end_time = serializers.DateTimeField(required=False)
+
+
 class ShareSubmissionSerializer(serializers.Serializer):
     id = serializers.CharField()
     shared = serializers.BooleanField()
@@ -0,0 +1,64 @@
+import json
+import time
+
+from utils.cache import cache
+from utils.constants import CacheKey
+
+# 判题状态在 Redis 中的保存时间，订阅之前已经发布的状态从这里读取
+STATUS_TTL = 120
+# 长轮询的最长等待时间（秒），每个等待中的请求会占用一个 gunicorn 线程
+MAX_WAIT_TIMEOUT = 30
+
+
+class SubmissionStatusChannel(object):
+    """
+    JudgeDispatcher 通过 Redis pub/sub 发布判题状态的变化，等待中的请求订阅后不需要反复查询数据库
+    每次发布的同时把状态保存在 hash 中，订阅之后先读取一次，不会错过订阅之前发布的状态
+    """
+    def __init__(self, prefix=CacheKey.submission_status):
+        self.prefix = prefix
+
+    def _key(self, submission_id):
+        return f"{self.prefix}:{submission_id}"
+
+    def publish(self, submission_id, result, statistic_info=None):
+        key = self._key(submission_id)
+        status = {"result": result, "statistic_info": statistic_info or {}}
+        with cache.pipeline() as pipe:
+            pipe.hset(key, mapping={"result": result, "statistic_info": json.dumps(status["statistic_info"])})
+            pipe.expire(key, STATUS_TTL)
+            pipe.publish(key, json.dumps(status))
+            pipe.execute()
+
+    def get(self, submission_id):
+        data = cache.hgetall(self._key(submission_id))
+        if not data:
+            return None
+        return {"result": int(data[b"result"]), "statistic_info": json.loads(data[b"statistic_info"])}
+
+    def wait(self, submission_id, last_result, timeout):
+        """
+        等待状态变为与 last_result 不同，返回 {"result", "statistic_info"}，超时返回 None
+        """
+        key = self._key(submission_id)
+        pubsub = cache.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(key)
+            status = self.get(submission_id)
+            if status and status["result"] != last_result:
+                return status
+            deadline = time.monotonic() + min(timeout, MAX_WAIT_TIMEOUT)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                message = pubsub.get_message(timeout=remaining)
+                if message and message["type"] == "message":
+                    status = json.loads(message["data"])
+                    if status["result"] != last_result:
+                        return status
+        finally:
+            pubsub.close()
+
+
+submission_status = SubmissionStatusChannel()
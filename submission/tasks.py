@@ -0,0 +1,38 @@
+import dramatiq
+
+from problem.models import Problem
+from utils.shortcuts import DRAMATIQ_WORKER_ARGS
+from .rejudge import (REJUDGE_CHECK_INTERVAL, REJUDGE_RETRY_DELAY, RECOMPUTE_RETRY_DELAY, rejudge_jobs,
+                      recompute_problem_statistic)
+
+
+@dramatiq.actor(**DRAMATIQ_WORKER_ARGS())
+def bulk_rejudge_task(job_id):
+    # 每次只投递一块，剩余的部分重新发送任务继续处理，不长时间占用 worker
+    remaining, wait = rejudge_jobs.enqueue_next(job_id)
+    if remaining:
+        bulk_rejudge_task.send_with_options(args=(job_id,), delay=REJUDGE_RETRY_DELAY if wait else 0)
+    else:
+        check_rejudge_task.send_with_options(args=(job_id,), delay=REJUDGE_CHECK_INTERVAL)
+
+
+@dramatiq.actor(**DRAMATIQ_WORKER_ARGS())
+def check_rejudge_task(job_id):
+    # 全部投递后定期检查，提交丢失导致任务长时间没有进展时不再等待
+    if rejudge_jobs.finish_if_stale(job_id) == 0:
+        check_rejudge_task.send_with_options(args=(job_id,), delay=REJUDGE_CHECK_INTERVAL)
+
+
+@dramatiq.actor(**DRAMATIQ_WORKER_ARGS(time_limit=1800_000))
+def finish_rejudge_task(job_id):
+    rejudge_jobs.finish(job_id)
+
+
+@dramatiq.actor(**DRAMATIQ_WORKER_ARGS(time_limit=1800_000))
+def recompute_problem_task(problem_id):
+    try:
+        problem = Problem.objects.get(id=problem_id)
+    except Problem.DoesNotExist:
+        return
+    if not recompute_problem_statistic(problem):
+        recompute_problem_task.send_with_options(args=(problem_id,), delay=RECOMPUTE_RETRY_DELAY)
@@ -0,0 +1,212 @@
+import time
+from unittest import mock
+
+from account.models import UserProfile
+from problem.models import Problem, ProblemRuleType, UserProblemStatus
+from utils.api.tests import APITestCase
+from .models import JudgeStatus, Submission
+from . import rejudge
+from .rejudge import RejudgeJobs, rejudge_jobs
+
+
+def create_problem(created_by, **kwargs):
+    data = {"_id": "A", "title": "test", "description": "test", "input_description": "test",
+            "output_description": "test", "samples": [], "test_case_id": "test", "test_case_score": [],
+            "time_limit": 1000, "memory_limit": 256, "languages": ["C"], "template": {}, "created_by": created_by,
+            "rule_type": ProblemRuleType.ACM, "visible": True, "difficulty": "Low", "source": "", "hint": ""}
+    data.update(kwargs)
+    return Problem.objects.create(**data)
+
+
+class SubmissionTestMixin(object):
+    def create_submissions(self, user, results):
+        return [Submission.objects.create(user_id=user.id, username=user.username, code="", language="C",
+                                          problem=self.problem, result=result).id
+                for result in results]
+
+    def judge(self, job_id, results):
+        """
+        模拟判题：写入结果并记录完成
+        """
+        for submission_id, result in results.items():
+            Submission.objects.filter(id=submission_id).update(result=result)
+            self.jobs.finish_one(job_id, submission_id)
+
+
+class RejudgeJobsTest(SubmissionTestMixin, APITestCase):
+    def setUp(self):
+        self.admin = self.create_super_admin(login=False)
+        self.user = self.create_user("test", "test123", login=False)
+        self.problem = create_problem(self.admin)
+        self.submissions = self.create_submissions(self.user, [JudgeStatus.WRONG_ANSWER] * 3)
+        self.jobs = RejudgeJobs(prefix=f"test:rejudge_job:{time.time()}")
+        self.sent = []
+        patchers = [mock.patch("judge.tasks.send_judge_task",
+                               lambda submission_id, problem_id, **kwargs: self.sent.append(kwargs["rejudge_job"])),
+                    mock.patch("submission.tasks.finish_rejudge_task.send")]
+        self.finish_task = patchers[1].start()
+        patchers[0].start()
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+    def enqueue_all(self, job_id):
+        while self.jobs.enqueue_next(job_id)[0]:
+            pass
+
+    def test_enqueue_in_chunks(self):
+        job_id = self.jobs.create(self.admin.id, problem_id=self.problem.id)
+        with mock.patch.object(rejudge, "REJUDGE_CHUNK_SIZE", 2):
+            self.assertEqual(self.jobs.enqueue_next(job_id), (True, False))
+            self.assertEqual(self.jobs.get(job_id)["enqueued"], 2)
+            self.assertEqual(self.jobs.enqueue_next(job_id), (False, False))
+        job = self.jobs.get(job_id)
+        self.assertEqual((job["total"], job["enqueued"], job["status"]), (3, 3, "enqueued"))
+        self.assertEqual(self.sent, [job_id] * 3)
+        for submission in Submission.objects.filter(id__in=self.submissions):
+            self.assertEqual(submission.result, JudgeStatus.PENDING)
+            # 任务 id 不写入提交
+            self.assertEqual(submission.statistic_info, {})
+            self.assertEqual(self.jobs.job_of(submission.id), job_id)
+
+    def test_finished_once(self):
+        job_id = self.jobs.create(self.admin.id, problem_id=self.problem.id)
+        self.enqueue_all(job_id)
+        self.jobs.finish_one(job_id, self.submissions[0])
+        self.jobs.finish_one(job_id, self.submissions[0])
+        self.assertEqual(self.jobs.get(job_id)["finished"], 1)
+        self.assertIsNone(self.jobs.job_of(self.submissions[0]))
+        self.finish_task.assert_not_called()
+        self.jobs.finish_one(job_id, self.submissions[1])
+        self.jobs.finish_one(job_id, self.submissions[2])
+        self.assertEqual(self.jobs.get(job_id)["status"], "finishing")
+        self.finish_task.assert_called_once_with(job_id)
+
+    def test_stale_job(self):
+        job_id = self.jobs.create(self.admin.id, problem_id=self.problem.id)
+        # 还在投递的任务不检查
+        self.assertEqual(self.jobs.finish_if_stale(job_id), -1)
+        self.enqueue_all(job_id)
+        self.jobs.finish_one(job_id, self.submissions[0])
+        self.assertEqual(self.jobs.finish_if_stale(job_id), 0)
+        with mock.patch("submission.rejudge.time.time", return_value=time.time() + rejudge.REJUDGE_STALE_TIMEOUT + 1):
+            self.assertEqual(self.jobs.finish_if_stale(job_id), 1)
+        job = self.jobs.get(job_id)
+        self.assertEqual(job["status"], "finishing")
+        self.assertTrue(job["forced"])
+        self.finish_task.assert_called_once_with(job_id)
+        self.assertEqual(self.jobs.finish_if_stale(job_id), -1)
+
+    def test_finish_recomputes_statistic(self):
+        self.problem.submission_number = 100
+        self.problem.save()
+        job_id = self.jobs.create(self.admin.id, problem_id=self.problem.id)
+        self.enqueue_all(job_id)
+        self.judge(job_id, {self.submissions[0]: JudgeStatus.WRONG_ANSWER,
+                            self.submissions[1]: JudgeStatus.ACCEPTED,
+                            self.submissions[2]: JudgeStatus.SYSTEM_ERROR})
+        self.jobs.finish(job_id)
+        self.problem.refresh_from_db()
+        # 系统错误不计入统计
+        self.assertEqual(self.problem.submission_number, 2)
+        self.assertEqual(self.problem.accepted_number, 1)
+        self.assertEqual(self.problem.statistic_info, {str(JudgeStatus.WRONG_ANSWER): 1,
+                                                       str(JudgeStatus.ACCEPTED): 1})
+        status = UserProblemStatus.objects.get(user=self.user, problem=self.problem)
+        self.assertEqual(status.status, JudgeStatus.ACCEPTED)
+        self.assertEqual(UserProfile.objects.get(user=self.user).accepted_number, 1)
+        self.assertEqual(self.jobs.get(job_id)["status"], "done")
+
+
+class BulkRejudgeAPITest(SubmissionTestMixin, APITestCase):
+    def setUp(self):
+        self.admin = self.create_super_admin()
+        self.user = self.create_user("test", "test123", login=False)
+        self.problem = create_problem(self.admin)
+        self.submissions = self.create_submissions(self.user, [JudgeStatus.WRONG_ANSWER] * 2)
+        self.jobs = rejudge_jobs
+        self.url = self.reverse("submission_bulk_rejudge_api")
+        patcher = mock.patch("submission.views.admin.bulk_rejudge_task.send")
+        self.bulk_task = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_create_job(self):
+        resp = self.client.post(self.url, data={"problem_id": self.problem.id})
+        self.assertSuccess(resp)
+        job = resp.data["data"]
+        self.assertEqual((job["status"], job["total"]), ("running", 2))
+        self.bulk_task.assert_called_once_with(job["id"])
+        resp = self.client.get(self.url, data={"id": job["id"]})
+        self.assertSuccess(resp)
+        self.assertEqual(resp.data["data"]["id"], job["id"])
+
+    def test_create_job_without_filter(self):
+        self.assertFailed(self.client.post(self.url, data={}),
+                          "Parameter error, problem_id or contest_id is required")
+        self.assertFailed(self.client.post(self.url, data={"problem_id": self.problem.id + 1}),
+                          "Problem does not exist")
+
+    def test_regular_user(self):
+        self.create_user("user", "user123")
+        self.assertFailed(self.client.post(self.url, data={"problem_id": self.problem.id}))
+        self.bulk_task.assert_not_called()
+
+    def test_finish_now(self):
+        job_id = self.jobs.create(self.admin.id, problem_id=self.problem.id)
+        # 还在投递的任务不能直接结束
+        self.assertFailed(self.client.put(self.url, data={"id": job_id}),
+                          "Rejudge job is not waiting for judge results")
+        with mock.patch("judge.tasks.send_judge_task"):
+            self.jobs.enqueue_next(job_id)
+        with mock.patch("submission.tasks.finish_rejudge_task.send") as finish_task:
+            resp = self.client.put(self.url, data={"id": job_id})
+        self.assertSuccess(resp)
+        self.assertEqual(resp.data["data"]["status"], "finishing")
+        finish_task.assert_called_once_with(job_id)
+        self.assertFailed(self.client.put(self.url, data={"id": "missing"}), "Rejudge job does not exist")
+
+
+class SubmissionStatusAPITest(SubmissionTestMixin, APITestCase):
+    def setUp(self):
+        self.user = self.create_user("test", "test123")
+        self.problem = create_problem(self.user)
+        self.submission_id = self.create_submissions(self.user, [JudgeStatus.PENDING])[0]
+        self.url = self.reverse("submission_status_api")
+
+    def get_status(self, timeout):
+        return self.client.get(self.url, data={"id": self.submission_id, "timeout": timeout})
+
+    def test_invalid_timeout(self):
+        for timeout in ("nan", "inf", "-inf", "abc"):
+            self.assertFailed(self.get_status(timeout), "Invalid parameter")
+
+    def test_timeout_clamped(self):
+        with mock.patch("submission.views.oj.submission_status.wait", return_value=None) as wait:
+            resp = self.get_status("1e9")
+        self.assertSuccess(resp)
+        self.assertFalse(resp.data["data"]["finished"])
+        wait.assert_called_once_with(self.submission_id, JudgeStatus.PENDING, 30)
+        with mock.patch("submission.views.oj.submission_status.wait", return_value=None) as wait:
+            self.get_status("-5")
+        wait.assert_called_once_with(self.submission_id, JudgeStatus.PENDING, 0)
+
+
+class SubmissionListAPITest(SubmissionTestMixin, APITestCase):
+    def setUp(self):
+        self.user = self.create_user("test", "test123")
+        self.problem = create_problem(self.user)
+        self.create_submissions(self.user, [JudgeStatus.ACCEPTED] * 3)
+        self.url = self.reverse("submission_list_api")
+
+    @mock.patch("submission.views.oj.SUBMISSION_LIST_COUNT_LIMIT", 2)
+    def test_count_limit(self):
+        # offset 分页返回准确的总数
+        resp = self.client.get(self.url, data={"limit": 1})
+        self.assertSuccess(resp)
+        self.assertEqual(resp.data["data"]["total"], 3)
+        self.assertNotIn("total_capped", resp.data["data"])
+        # 游标分页的总数有上限
+        resp = self.client.get(self.url, data={"limit": 1, "cursor": ""})
+        self.assertSuccess(resp)
+        self.assertEqual(resp.data["data"]["total"], 2)
+        self.assertTrue(resp.data["data"]["total_capped"])
+        self.assertIsNotNone(resp.data["data"]["next_cursor"])
@@ -1,8 +1,9 @@
 from django.urls import re_path
-from ..views.admin import SubmissionRejudgeAPI
+from ..views.admin import SubmissionRejudgeAPI, BulkRejudgeAPI
 
 urlpatterns = [
     re_path(r"^submission/rejudge?$", SubmissionRejudgeAPI.as_view(), name="submission_rejudge_api"),
+    re_path(r"^submission/rejudge/bulk/?$", BulkRejudgeAPI.as_view(), name="submission_bulk_rejudge_api"),
 ]
 """
     API 说明：
@@ -1,7 +1,13 @@
 from account.decorators import super_admin_required
-from judge.tasks import judge_task
-from utils.api import APIView
+from contest.models import Contest
+from judge.tasks import send_judge_task
+from problem.models import Problem
+from utils.api import APIView, validate_serializer
+from utils.constants import JudgeLane
 from ..models import Submission
+from ..rejudge import rejudge_jobs
+from ..serializers import BulkRejudgeSerializer
+from ..tasks import bulk_rejudge_task
 
 
 class SubmissionRejudgeAPI(APIView):
@@ -16,6 +22,48 @@ class SubmissionRejudgeAPI(APIView):
             return self.error("Submission does not exists")
         submission.statistic_info = {}
         submission.save()
+        rejudge_jobs.forget(submission.id)
 
-        judge_task.send(submission.id, submission.problem.id)
+        send_judge_task(submission.id, submission.problem.id, lane=JudgeLane.REJUDGE)
         return self.success()
+
+
+class BulkRejudgeAPI(APIView):
+    @super_admin_required
+    def get(self, request):
+        """
+        查询批量重判任务的进度，没有 id 时返回最近的任务
+        """
+        job_id = request.GET.get("id")
+        if not job_id:
+            return self.success(rejudge_jobs.recent())
+        job = rejudge_jobs.get(job_id)
+        if not job:
+            return self.error("Rejudge job does not exist")
+        return self.success(job)
+
+    @super_admin_required
+    @validate_serializer(BulkRejudgeSerializer)
+    def post(self, request):
+        data = request.data
+        if not data.get("problem_id") and not data.get("contest_id"):
+            return self.error("Parameter error, problem_id or contest_id is required")
+        if data.get("problem_id") and not Problem.objects.filter(id=data["problem_id"]).exists():
+            return self.error("Problem does not exist")
+        if data.get("contest_id") and not Contest.objects.filter(id=data["contest_id"]).exists():
+            return self.error("Contest does not exist")
+        job_id = rejudge_jobs.create(request.user.id, **data)
+        bulk_rejudge_task.send(job_id)
+        return self.success(rejudge_jobs.get(job_id))
+
+    @super_admin_required
+    def put(self, request):
+        """
+        不再等待还没有判完的提交，直接根据已有的结果重新计算统计数据
+        """
+        job_id = request.data.get("id")
+        if not job_id or not rejudge_jobs.get(job_id):
+            return self.error("Rejudge job does not exist")
+        if not rejudge_jobs.finish_now(job_id):
+            return self.error("Rejudge job is not waiting for judge results")
+        return self.success(rejudge_jobs.get(job_id))
@@ -1,18 +1,33 @@
 import ipaddress
+import math
 
 from account.decorators import login_required, check_contest_permission
+from account.models import User
 from contest.models import ContestStatus, ContestRuleType
-from judge.tasks import judge_task
+from judge.tasks import send_judge_task
 from options.options import SysOptions
 from problem.models import Problem, ProblemRuleType
 from utils.api import APIView, validate_serializer
-from utils.cache import cache
 from utils.captcha import Captcha
+from utils.constants import JudgeLane
 from utils.throttling import TokenBucket
-from ..models import Submission
+from ..models import JudgeStatus, Submission
 from ..serializers import (CreateSubmissionSerializer, SubmissionModelSerializer,
                            ShareSubmissionSerializer)
 from ..serializers import SubmissionSafeModelSerializer, SubmissionListSerializer
+from ..status import MAX_WAIT_TIMEOUT, submission_status
+
+DEFAULT_STATUS_WAIT_TIMEOUT = 15
+UNFINISHED_RESULTS = (JudgeStatus.PENDING, JudgeStatus.JUDGING)
+# 提交列表的游标分页字段，与 Submission 的索引和默认排序一致
+SUBMISSION_LIST_KEYSET = ("create_time", "id")
+# 使用游标分页的请求，提交列表的总数最多统计到该数量，避免大表上的全量 COUNT(*)
+# 超过时返回 total_capped 为 True；使用 offset 分页的请求仍然返回准确的总数
+SUBMISSION_LIST_COUNT_LIMIT = 10000
+
+
+def submission_count_limit(request):
+    return SUBMISSION_LIST_COUNT_LIMIT if "cursor" in request.GET else None
 
 
 class SubmissionAPI(APIView):
@@ -21,14 +36,12 @@ class SubmissionAPI(APIView):
         auth_method = getattr(request, "auth_method", "")
         if auth_method == "api_key":
             return
-        user_bucket = TokenBucket(key=str(request.user.id),
-                                  redis_conn=cache, **SysOptions.throttling["user"])
+        user_bucket = TokenBucket(key=str(request.user.id), **SysOptions.throttling["user"])
         can_consume, wait = user_bucket.consume()
         if not can_consume:
             return "Please wait %d seconds" % (int(wait))
 
-        # ip_bucket = TokenBucket(key=request.session["ip"],
-        #                         redis_conn=cache, **SysOptions.throttling["ip"])
+        # ip_bucket = TokenBucket(key=request.session["ip"], **SysOptions.throttling["ip"])
         # can_consume, wait = ip_bucket.consume()
         # if not can_consume:
         #     return "Captcha is required"
@@ -79,7 +92,10 @@ class SubmissionAPI(APIView):
                                                contest_id=data.get("contest_id"))
         # use this for debug
         # JudgeDispatcher(submission.id, problem.id).judge()
-        judge_task.send(submission.id, problem.id)
+        lane = JudgeLane.PRACTICE
+        if data.get("contest_id") and contest.status == ContestStatus.CONTEST_UNDERWAY:
+            lane = JudgeLane.CONTEST
+        send_judge_task(submission.id, problem.id, lane=lane)
         if hide_id:
             return self.success()
         else:
@@ -124,6 +140,51 @@ class SubmissionAPI(APIView):
         return self.success()
 
 
+class SubmissionStatusAPI(APIView):
+    @login_required
+    def get(self, request):
+        """
+        长轮询判题状态，代替反复请求 SubmissionAPI
+        result 为客户端已知的状态，状态变化或者等待 timeout 秒后返回 {result, statistic_info, finished}
+        """
+        submission_id = request.GET.get("id")
+        if not submission_id:
+            return self.error("Parameter id doesn't exist")
+        try:
+            # 只读取权限检查和返回需要的字段，不读取代码和判题详情
+            submission = Submission.objects.select_related("problem", "contest") \
+                .only("id", "user_id", "result", "statistic_info", "shared",
+                      "problem__created_by_id", "problem__share_submission",
+                      "contest__start_time", "contest__end_time").get(id=submission_id)
+        except Submission.DoesNotExist:
+            return self.error("Submission doesn't exist")
+        if not submission.check_user_permission(request.user):
+            return self.error("No permission for this submission")
+        try:
+            last_result = int(request.GET.get("result", submission.result))
+            timeout = float(request.GET.get("timeout", DEFAULT_STATUS_WAIT_TIMEOUT))
+        except ValueError:
+            return self.error("Invalid parameter")
+        # float() 接受 nan 和 inf
+        if not math.isfinite(timeout):
+            return self.error("Invalid parameter")
+        timeout = min(max(timeout, 0), MAX_WAIT_TIMEOUT)
+
+        data = {"result": submission.result, "statistic_info": submission.statistic_info}
+        if submission.result == last_result and submission.result in UNFINISHED_RESULTS:
+            data = submission_status.wait(submission.id, last_result, timeout) or data
+        data["finished"] = data["result"] not in UNFINISHED_RESULTS
+        return self.success(data)
+
+
+def search_user_ids(username):
+    """
+    submission 表的 username 没有索引，ILIKE '%username%' 需要扫描整张表
+    先通过 user 表的 pg_trgm 索引找到匹配的用户，再按 user_id 的索引过滤提交
+    """
+    return User.objects.filter(username__icontains=username).values("id")
+
+
 class SubmissionListAPI(APIView):
     def get(self, request):
         if not request.GET.get("limit"):
@@ -145,10 +206,11 @@ class SubmissionListAPI(APIView):
         if (myself and myself == "1") or not SysOptions.submission_list_show_all:
             submissions = submissions.filter(user_id=request.user.id)
         elif username:
-            submissions = submissions.filter(username__icontains=username)
+            submissions = submissions.filter(user_id__in=search_user_ids(username))
         if result:
             submissions = submissions.filter(result=result)
-        data = self.paginate_data(request, submissions)
+        data = self.paginate_data(request, submissions, keyset=SUBMISSION_LIST_KEYSET,
+                                  count_limit=submission_count_limit(request))
         data["results"] = SubmissionListSerializer(data["results"], many=True, user=request.user).data
         return self.success(data)
 
@@ -175,7 +237,7 @@ class ContestSubmissionListAPI(APIView):
         if myself and myself == "1":
             submissions = submissions.filter(user_id=request.user.id)
         elif username:
-            submissions = submissions.filter(username__icontains=username)
+            submissions = submissions.filter(user_id__in=search_user_ids(username))
         if result:
             submissions = submissions.filter(result=result)
 
@@ -188,7 +250,8 @@ class ContestSubmissionListAPI(APIView):
             if not contest.real_time_rank and not request.user.is_contest_admin(contest):
                 submissions = submissions.filter(user_id=request.user.id)
 
-        data = self.paginate_data(request, submissions)
+        data = self.paginate_data(request, submissions, keyset=SUBMISSION_LIST_KEYSET,
+                                  count_limit=submission_count_limit(request))
         data["results"] = SubmissionListSerializer(data["results"], many=True, user=request.user).data
         return self.success(data)
 
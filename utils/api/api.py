@@ -1,8 +1,14 @@
+import base64
 import functools
 import json
 import logging
 
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.db.models import Q
 from django.http import HttpResponse, QueryDict
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import View
@@ -40,6 +46,15 @@ class URLEncodedParser(object):
         return QueryDict(body)
 
 
+class RawJSONResponse(HttpResponse):
+    """
+    内容为已经序列化好的 json，data 与 JSONResponse.response 设置的一致，读取时才解析
+    """
+    @property
+    def data(self):
+        return json.loads(self.content)
+
+
 class JSONResponse(object):
     content_type = ContentType.json_response
 
@@ -49,6 +64,10 @@ class JSONResponse(object):
         resp.data = data
         return resp
 
+    @classmethod
+    def raw_response(cls, data):
+        return RawJSONResponse(data, content_type=cls.content_type)
+
 
 class APIView(View):
     """
@@ -85,6 +104,12 @@ class APIView(View):
     def success(self, data=None):
         return self.response({"error": None, "data": data})
 
+    def success_raw(self, data):
+        """
+        data 为已经序列化好的 json 字符串，用于返回缓存的结果，避免重复序列化
+        """
+        return self.response_class.raw_response(f'{{"error": null, "data": {data}}}')
+
     def error(self, msg="error", err="error"):
         return self.response({"error": err, "data": msg})
 
@@ -110,12 +135,9 @@ class APIView(View):
     def server_error(self):
         return self.error(err="server-error", msg="server error")
 
-    def paginate_data(self, request, query_set, object_serializer=None):
+    def get_limit_offset(self, request):
         """
-        :param request: django的request
-        :param query_set: django model的query set或者其他list like objects
-        :param object_serializer: 用来序列化query set, 如果为None, 则直接对query set切片
-        :return:
+        从 request 中解析分页参数，返回 (limit, offset)
         """
         try:
             limit = int(request.GET.get("limit", "10"))
@@ -129,14 +151,87 @@ class APIView(View):
             offset = 0
         if offset < 0:
             offset = 0
-        results = query_set[offset:offset + limit]
-        if object_serializer:
-            count = query_set.count()
-            results = object_serializer(results, many=True).data
+        return limit, offset
+
+    def _encode_cursor(self, item, keyset):
+        # datetime 保留完整的微秒，否则相同毫秒内的数据会被跳过
+        values = [getattr(item, field) for field in keyset]
+        content = json.dumps(values, default=lambda value: value.isoformat())
+        return base64.urlsafe_b64encode(content.encode("utf-8")).decode("ascii")
+
+    def _decode_cursor_value(self, model, field, value):
+        model_field = model._meta.get_field(field)
+        if isinstance(model_field, models.DateTimeField):
+            try:
+                value = parse_datetime(value) if isinstance(value, str) else None
+            except ValueError:
+                value = None
+            # _encode_cursor 生成的时间都带有时区
+            if value is None or timezone.is_naive(value):
+                raise APIError("Invalid cursor")
+            return value
+        if isinstance(model_field, (models.CharField, models.TextField)):
+            if not isinstance(value, str):
+                raise APIError("Invalid cursor")
+            return value
+        if not isinstance(value, (str, int, float)) or isinstance(value, bool):
+            raise APIError("Invalid cursor")
+        try:
+            return model_field.to_python(value)
+        except ValidationError:
+            raise APIError("Invalid cursor")
+
+    def _decode_cursor(self, cursor, model, keyset):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        except (ValueError, UnicodeError):
+            raise APIError("Invalid cursor")
+        if not isinstance(values, list) or len(values) != len(keyset):
+            raise APIError("Invalid cursor")
+        values = [self._decode_cursor_value(model, field, value) for field, value in zip(keyset, values)]
+        # (a, b) < (x, y) 展开为 a < x OR (a = x AND b < y)
+        condition = Q()
+        for index, field in enumerate(keyset):
+            item = Q(**{f"{field}__lt": values[index]})
+            for prev_field, prev_value in zip(keyset[:index], values[:index]):
+                item &= Q(**{prev_field: prev_value})
+            condition |= item
+        return condition
+
+    def paginate_data(self, request, query_set, object_serializer=None, keyset=None, count_limit=None):
+        """
+        :param request: django的request
+        :param query_set: django model的query set或者其他list like objects
+        :param object_serializer: 用来序列化query set, 如果为None, 则直接对query set切片
+        :param keyset: 游标分页使用的字段，例如 ("create_time", "id")，按这些字段倒序排列
+                       请求中有 cursor 参数时（第一页为空字符串）不使用 offset，而是从 cursor 之后开始读取，
+                       返回的 next_cursor 用于请求下一页，最后一页为 None
+        :param count_limit: 总数最多统计到该数量，超过时 total 为 count_limit，total_capped 为 True
+        :return:
+        """
+        limit, offset = self.get_limit_offset(request)
+        cursor = request.GET.get("cursor") if keyset else None
+        if cursor is not None:
+            page = query_set.order_by(*[f"-{field}" for field in keyset])
+            if cursor:
+                page = page.filter(self._decode_cursor(cursor, query_set.model, keyset))
+            results = list(page[:limit])
+            next_cursor = self._encode_cursor(results[-1], keyset) if len(results) == limit else None
+        else:
+            results = query_set[offset:offset + limit]
+
+        if count_limit:
+            count = query_set.order_by()[:count_limit + 1].count()
         else:
             count = query_set.count()
+        if object_serializer:
+            results = object_serializer(results, many=True).data
         data = {"results": results,
-                "total": count}
+                "total": min(count, count_limit) if count_limit else count}
+        if count_limit:
+            data["total_capped"] = count > count_limit
+        if cursor is not None:
+            data["next_cursor"] = next_cursor
         return data
 
     def dispatch(self, request, *args, **kwargs):
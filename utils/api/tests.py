@@ -1,8 +1,14 @@
+import base64
+import json
+
 from django.urls import reverse
+from django.test import RequestFactory
 from django.test.testcases import TestCase
+from django.utils import timezone
 from rest_framework.test import APIClient
 
 from account.models import AdminType, ProblemPermission, User, UserProfile
+from .api import APIError, APIView
 
 
 class APITestCase(TestCase):
@@ -38,3 +44,54 @@ class APITestCase(TestCase):
         self.assertTrue(response.data["error"] is not None)
         if msg:
             self.assertEqual(response.data["data"], msg)
+
+
+class PaginateDataTest(TestCase):
+    keyset = ("create_time", "id")
+
+    def setUp(self):
+        User.objects.bulk_create([User(username=f"user{i}") for i in range(5)])
+        # 一部分数据的 create_time 相同，游标需要用 id 区分
+        User.objects.filter(username__in=["user1", "user2", "user3"]).update(create_time=timezone.now())
+        self.users = User.objects.order_by("-create_time", "-id")
+        self.view = APIView()
+
+    def paginate(self, count_limit=None, **params):
+        request = RequestFactory().get("/", params)
+        return self.view.paginate_data(request, User.objects.all(), keyset=self.keyset, count_limit=count_limit)
+
+    def test_keyset_pages(self):
+        ids = []
+        cursor = ""
+        while cursor is not None:
+            data = self.paginate(limit=2, cursor=cursor)
+            ids.extend(user.id for user in data["results"])
+            cursor = data["next_cursor"]
+        self.assertEqual(ids, [user.id for user in self.users])
+
+    def test_capped_count(self):
+        data = self.paginate(count_limit=3, limit=2, cursor="")
+        self.assertEqual(data["total"], 3)
+        self.assertTrue(data["total_capped"])
+        data = self.paginate(count_limit=10, limit=2)
+        self.assertEqual(data["total"], 5)
+        self.assertFalse(data["total_capped"])
+        self.assertNotIn("next_cursor", data)
+
+    def test_invalid_cursor(self):
+        def encode(values):
+            return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+        for cursor in ["!!!", encode({"a": 1}), encode(["not-a-date", "x"]), encode([[1], {}]),
+                       encode(["2026-13-01T00:00:00+00:00", 1]), encode(["2026-01-01T00:00:00", 1]),
+                       encode([timezone.now().isoformat(), [1]]), encode([timezone.now().isoformat(), "x"])]:
+            with self.assertRaisesMessage(APIError, "Invalid cursor"):
+                self.paginate(limit=2, cursor=cursor)
+
+
+class SuccessRawTest(TestCase):
+    def test_data(self):
+        resp = APIView().success_raw('{"results": [], "total": 0}')
+        self.assertEqual(json.loads(resp.content), {"error": None, "data": {"results": [], "total": 0}})
+        # 与 success 一样可以通过 data 读取
+        self.assertEqual(resp.data, {"error": None, "data": {"results": [], "total": 0}})
@@ -25,3 +25,17 @@ class MyRedisCache(RedisCache):
 
     def __getattr__(self, item):
         return getattr(self.client, item)
+
+
+class RedisScript(object):
+    """
+    Lua 脚本，第一次调用时才注册，之后通过 EVALSHA 执行
+    """
+    def __init__(self, source):
+        self.source = source
+        self._script = None
+
+    def __call__(self, keys=(), args=()):
+        if self._script is None:
+            self._script = cache.register_script(self.source)
+        return self._script(keys=keys, args=args)
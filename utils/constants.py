@@ -21,10 +21,28 @@ class ContestRuleType(Choices):
     OI = "OI"
 
 
+class JudgeLane(Choices):
+    # 正在进行的比赛
+    CONTEST = "contest"
+    # 普通练习
+    PRACTICE = "practice"
+    # 重判等后台任务
+    REJUDGE = "rejudge"
+
+
 class CacheKey:
     waiting_queue = "waiting_queue"
     contest_rank_cache = "contest_rank_cache"
     website_config = "website_config"
+    judge_server_slots = "judge_server_slots"
+    statistic_delta = "statistic_delta"
+    test_case_archive_lock = "test_case_archive_lock"
+    test_case_journal = "test_case_journal"
+    judge_server_spj = "judge_server_spj"
+    judge_server_config = "judge_server_config"
+    rejudge_job = "rejudge_job"
+    submission_status = "submission_status"
+    options_invalidate = "options_invalidate"
 
 
 class Difficulty(Choices):
@@ -0,0 +1,86 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from account.models import AdminType, User, UserProfile
+from contest.models import Contest, ACMContestRank
+from contest.scoreboard import ContestScoreboard
+from contest.serializers import ACMContestRankSerializer
+from utils.shortcuts import rand_str
+
+
+class Command(BaseCommand):
+    help = "Benchmark contest rank page latency, legacy queryset + serializer vs cached scoreboard pages"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--participants", type=int, default=5000)
+        parser.add_argument("--problems", type=int, default=10)
+        parser.add_argument("--limit", type=int, default=50)
+        parser.add_argument("--requests", type=int, default=200)
+
+    def _measure(self, func, requests):
+        latencies = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            func()
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        return latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000
+
+    def _report(self, name, ret):
+        self.stdout.write(f"{name:<24} p50={ret[0]:.3f}ms p99={ret[1]:.3f}ms")
+
+    def _create_contest(self, participants, problems):
+        prefix = f"bench_{rand_str(6)}"
+        creator = User.objects.create(username=f"{prefix}_admin", admin_type=AdminType.SUPER_ADMIN)
+        start_time = timezone.now()
+        contest = Contest.objects.create(title=prefix, description="", real_time_rank=True, rule_type="ACM",
+                                         start_time=start_time, end_time=start_time + timedelta(hours=5),
+                                         created_by=creator)
+        User.objects.bulk_create([User(username=f"{prefix}_{i}") for i in range(participants)])
+        users = list(User.objects.filter(username__startswith=f"{prefix}_").exclude(id=creator.id))
+        UserProfile.objects.bulk_create([UserProfile(user=user, real_name=user.username) for user in users])
+        ranks = []
+        for index, user in enumerate(users):
+            accepted = index % (problems + 1)
+            info = {str(p): {"is_ac": p < accepted, "ac_time": 60 * p, "error_number": index % 3, "is_first_ac": False}
+                    for p in range(problems)}
+            ranks.append(ACMContestRank(user=user, contest=contest, accepted_number=accepted,
+                                        submission_number=accepted + index % 3, total_time=index, submission_info=info))
+        ACMContestRank.objects.bulk_create(ranks, batch_size=1000)
+        return contest, prefix
+
+    def handle(self, *args, **options):
+        limit, requests = options["limit"], options["requests"]
+        self.stdout.write(f"creating contest with {options['participants']} participants")
+        contest, prefix = self._create_contest(options["participants"], options["problems"])
+        scoreboard = ContestScoreboard(contest)
+        try:
+            def legacy():
+                qs = scoreboard.get_rank_queryset()
+                ACMContestRankSerializer(qs[0:limit], many=True, is_contest_admin=False).data
+                qs.count()
+
+            self._report("legacy queryset", self._measure(legacy, requests))
+
+            def cold():
+                scoreboard.delete()
+                scoreboard.page_json(0, limit, False)
+
+            self._report("rebuild from database", self._measure(cold, max(requests // 20, 1)))
+
+            rank = ACMContestRank.objects.filter(contest=contest).select_related("user__userprofile").first()
+
+            def miss():
+                scoreboard.update(rank, rank.user)
+                scoreboard.page_json(0, limit, False)
+
+            self._report("update + page miss", self._measure(miss, requests))
+            scoreboard.page_json(0, limit, False)
+            self._report("cached page", self._measure(lambda: scoreboard.page_json(0, limit, False), requests))
+        finally:
+            scoreboard.delete()
+            contest.delete()
+            User.objects.filter(username__startswith=f"{prefix}_").delete()
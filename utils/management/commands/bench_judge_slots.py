@@ -0,0 +1,72 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from conf.models import JudgeServer
+from judge.slots import JudgeSlotAllocator
+from utils.shortcuts import rand_str
+
+
+class Command(BaseCommand):
+    help = "Benchmark judge server slot claim/release throughput under concurrent dispatchers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=str, default="1,8,64")
+        parser.add_argument("--servers", type=int, default=4)
+        parser.add_argument("--cpu-core", type=int, default=8)
+        parser.add_argument("--requests", type=int, default=5000)
+        parser.add_argument("--judge-time", type=float, default=0, help="simulated judge time in ms")
+
+    def _run(self, allocator, concurrency, total, judge_time):
+        latencies = []
+        misses = [0]
+        lock = threading.Lock()
+        per_thread = max(total // concurrency, 1)
+
+        def dispatcher():
+            local_latencies = []
+            local_misses = 0
+            for _ in range(per_thread):
+                start = time.perf_counter()
+                slot = allocator.claim()
+                local_latencies.append(time.perf_counter() - start)
+                if not slot:
+                    local_misses += 1
+                    continue
+                if judge_time:
+                    time.sleep(judge_time / 1000)
+                allocator.release(slot)
+            with lock:
+                latencies.extend(local_latencies)
+                misses[0] += local_misses
+
+        threads = [threading.Thread(target=dispatcher) for _ in range(concurrency)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        cost = time.perf_counter() - start
+
+        latencies.sort()
+        return {"dispatches": len(latencies),
+                "throughput": len(latencies) / cost,
+                "misses": misses[0],
+                "p50": latencies[len(latencies) // 2] * 1000,
+                "p99": latencies[int(len(latencies) * 0.99)] * 1000}
+
+    def handle(self, *args, **options):
+        allocator = JudgeSlotAllocator(prefix=f"benchmark:judge_server_slots:{rand_str(8)}")
+        for index in range(options["servers"]):
+            server = JudgeServer(id=index + 1, hostname=f"benchmark-{index}", cpu_core=options["cpu_core"],
+                                 service_url=f"http://benchmark-{index}:8080", is_disabled=False)
+            allocator.heartbeat(server)
+        try:
+            for concurrency in [int(item) for item in options["concurrency"].split(",")]:
+                ret = self._run(allocator, concurrency, options["requests"], options["judge_time"])
+                self.stdout.write(f"concurrency={concurrency:<4} dispatches={ret['dispatches']:<7} "
+                                  f"throughput={ret['throughput']:.0f}/s misses={ret['misses']:<6} "
+                                  f"claim_p50={ret['p50']:.3f}ms claim_p99={ret['p99']:.3f}ms")
+        finally:
+            allocator.clear()
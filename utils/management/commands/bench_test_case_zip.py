@@ -0,0 +1,91 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from problem.test_case_store import test_case_store
+from problem.views.admin import TestCaseZipProcessor
+
+
+class LegacyTestCaseZipProcessor(TestCaseZipProcessor):
+    """
+    原来的实现：整个文件读入内存后再转换换行符和计算 md5
+    """
+    def _process_member(self, zip_file, name):
+        content = zip_file.read(name).replace(b"\r\n", b"\n")
+        digest = hashlib.sha256(content).hexdigest()
+        path = test_case_store.tmp_path()
+        with open(path, "wb") as f:
+            f.write(content)
+        test_case_store.put(path, digest)
+        md5 = hashlib.md5(content.rstrip()).hexdigest() if name.endswith(".out") else None
+        return len(content), md5, digest
+
+
+class Command(BaseCommand):
+    help = "Benchmark test case zip processing on a synthetic archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size-mb", type=int, default=1024, help="total uncompressed size")
+        parser.add_argument("--cases", type=int, default=8, help="number of in/out pairs")
+        parser.add_argument("--workers", type=str, default="1,4")
+        parser.add_argument("--compression", choices=["deflated", "stored"], default="deflated")
+        parser.add_argument("--legacy", action="store_true", help="also run the read-everything implementation")
+
+    def _make_archive(self, path, size_mb, cases, compression):
+        line = b"1234567890 " * 9 + b"\r\n"
+        member_size = size_mb * 1024 * 1024 // (cases * 2)
+        block = line * (1024 * 1024 // len(line))
+        method = zipfile.ZIP_DEFLATED if compression == "deflated" else zipfile.ZIP_STORED
+        with zipfile.ZipFile(path, "w", method) as zf:
+            for index in range(1, cases + 1):
+                for suffix in ("in", "out"):
+                    with zf.open(f"{index}.{suffix}", "w", force_zip64=True) as f:
+                        written = 0
+                        while written < member_size:
+                            f.write(block)
+                            written += len(block)
+                        f.write(b"\r\n  \r\n")
+
+    def _run(self, processor, archive):
+        test_case_dir = tempfile.mkdtemp()
+        try:
+            with override_settings(TEST_CASE_DIR=test_case_dir):
+                tracemalloc.start()
+                start = time.perf_counter()
+                info, _ = processor.process_zip(archive, spj=False)
+                cost = time.perf_counter() - start
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+        finally:
+            shutil.rmtree(test_case_dir)
+        return cost, peak, info
+
+    def handle(self, *args, **options):
+        archive = os.path.join(tempfile.gettempdir(), f"bench_test_case_{os.getpid()}.zip")
+        self.stdout.write(f"creating {options['size_mb']}MB archive with {options['cases']} cases")
+        self._make_archive(archive, options["size_mb"], options["cases"], options["compression"])
+        try:
+            processors = [(f"streaming workers={workers}", TestCaseZipProcessor(), int(workers))
+                          for workers in options["workers"].split(",")]
+            if options["legacy"]:
+                processors.append(("legacy workers=1", LegacyTestCaseZipProcessor(), 1))
+            expected = None
+            for name, processor, workers in processors:
+                processor.process_workers = workers
+                cost, peak, info = self._run(processor, archive)
+                md5 = [item["stripped_output_md5"] for item in info]
+                if expected is None:
+                    expected = md5
+                status = "ok" if md5 == expected else "MISMATCH"
+                throughput = options["size_mb"] / cost
+                self.stdout.write(f"{name:<24} time={cost:.2f}s throughput={throughput:.0f}MB/s "
+                                  f"peak_memory={peak / 1024 / 1024:.1f}MB md5={status}")
+        finally:
+            os.remove(archive)
@@ -0,0 +1,94 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from utils.cache import cache
+from utils.shortcuts import rand_str
+from utils.throttling import TokenBucket
+
+
+class LegacyTokenBucket(object):
+    """
+    原来逐个字段 HGET/HSET 的实现，只用于对比
+    """
+    def __init__(self, key, capacity, fill_rate, default_capacity):
+        self._key = key
+        self._capacity = capacity
+        self._fill_rate = fill_rate
+        self._default_capacity = default_capacity
+
+    def _get(self, field):
+        return cache.hget(self._key, field)
+
+    def _set(self, field, value):
+        cache.hset(self._key, field, value)
+
+    def consume(self, num=1):
+        last_capacity = self._get("last_capacity")
+        if last_capacity is None:
+            self._set("last_capacity", self._default_capacity)
+            self._set("last_timestamp", time.time())
+            last_capacity = self._default_capacity
+        last_capacity = float(last_capacity)
+        if last_capacity >= num:
+            self._set("last_capacity", float(self._get("last_capacity")) - num)
+            return True, 0
+        now = time.time()
+        cur_num = min(float(self._get("last_capacity")) +
+                      self._fill_rate * (now - float(self._get("last_timestamp"))), self._capacity)
+        if cur_num >= num:
+            self._set("last_capacity", cur_num - num)
+            self._set("last_timestamp", now)
+            return True, 0
+        return False, (num - cur_num) / self._fill_rate
+
+
+class Command(BaseCommand):
+    help = "Benchmark token bucket consume latency and over-granting under concurrent consumers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=str, default="1,8,64")
+        parser.add_argument("--requests", type=int, default=5000)
+        parser.add_argument("--capacity", type=int, default=100)
+
+    def _run(self, bucket_class, concurrency, total, capacity):
+        # fill_rate 很小，测试期间几乎不补充，成功次数应该等于初始容量
+        key = f"benchmark:token_bucket:{rand_str(8)}"
+        latencies = []
+        granted = [0]
+        lock = threading.Lock()
+        per_thread = max(total // concurrency, 1)
+
+        def consumer():
+            bucket = bucket_class(key=key, capacity=capacity, fill_rate=1e-6, default_capacity=capacity)
+            local_latencies = []
+            local_granted = 0
+            for _ in range(per_thread):
+                start = time.perf_counter()
+                ok, _ = bucket.consume()
+                local_latencies.append(time.perf_counter() - start)
+                local_granted += ok
+            with lock:
+                latencies.extend(local_latencies)
+                granted[0] += local_granted
+
+        threads = [threading.Thread(target=consumer) for _ in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        cache.delete(key)
+
+        latencies.sort()
+        return {"granted": granted[0],
+                "p50": latencies[len(latencies) // 2] * 1000,
+                "p99": latencies[int(len(latencies) * 0.99)] * 1000}
+
+    def handle(self, *args, **options):
+        capacity = options["capacity"]
+        for concurrency in [int(item) for item in options["concurrency"].split(",")]:
+            for name, bucket_class in (("legacy", LegacyTokenBucket), ("lua", TokenBucket)):
+                ret = self._run(bucket_class, concurrency, options["requests"], capacity)
+                self.stdout.write(f"{name:<7} concurrency={concurrency:<4} granted={ret['granted']}/{capacity} "
+                                  f"p50={ret['p50']:.3f}ms p99={ret['p99']:.3f}ms")
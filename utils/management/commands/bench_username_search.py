@@ -0,0 +1,81 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from account.models import User
+from problem.models import Problem
+from submission.models import Submission
+from submission.views.oj import search_user_ids
+from utils.shortcuts import rand_str
+
+
+class Command(BaseCommand):
+    help = "Benchmark submission list username search, ILIKE on submission.username vs trigram indexed user_id lookup"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=50000)
+        parser.add_argument("--submissions", type=int, default=10000000)
+        parser.add_argument("--limit", type=int, default=20)
+        parser.add_argument("--count-limit", type=int, default=10000)
+        parser.add_argument("--requests", type=int, default=20)
+        parser.add_argument("--explain", action="store_true")
+
+    def _measure(self, func, requests):
+        latencies = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            func()
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        return latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000
+
+    def _report(self, name, ret):
+        self.stdout.write(f"{name:<24} p50={ret[0]:.3f}ms p99={ret[1]:.3f}ms")
+
+    def _populate(self, prefix, users, submissions):
+        problem = Problem.objects.order_by("id").first()
+        if not problem:
+            raise CommandError("At least one problem is needed")
+        User.objects.bulk_create([User(username=f"{prefix}_{i}") for i in range(users)], batch_size=5000)
+        # 10M 行使用 generate_series 在数据库中生成，按顺序轮流分配给 users 个用户
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO submission (id, problem_id, create_time, user_id, username, code, result, info,
+                                        language, shared, statistic_info)
+                SELECT %s || g, %s, now() - g * interval '1 second', u.id, u.username, '', 0, '{}', 'C', false, '{}'
+                FROM generate_series(1, %s) g
+                JOIN (SELECT id, username, row_number() OVER (ORDER BY id) - 1 AS i
+                      FROM "user" WHERE username LIKE %s) u ON u.i = g %% %s
+            """, [prefix, problem.id, submissions, f"{prefix}\\_%", users])
+            cursor.execute('ANALYZE submission, "user"')
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("PostgreSQL is needed, pg_trgm indexes are not available on " + connection.vendor)
+        users, limit, requests = options["users"], options["limit"], options["requests"]
+        count_limit = options["count_limit"]
+        prefix = f"bench_{rand_str(6)}"
+        self.stdout.write(f"creating {users} users and {options['submissions']} submissions")
+        start = time.perf_counter()
+        self._populate(prefix, users, options["submissions"])
+        self.stdout.write(f"populated in {time.perf_counter() - start:.1f}s")
+
+        keyword = f"{prefix}_{users // 2}"
+        base = Submission.objects.filter(contest_id__isnull=True)
+        queries = [("ILIKE submission.username", base.filter(username__icontains=keyword)),
+                   ("user_id IN trigram lookup", base.filter(user_id__in=search_user_ids(keyword)))]
+        try:
+            for name, qs in queries:
+                if options["explain"]:
+                    self.stdout.write(qs[:limit].explain(analyze=True))
+
+                def run():
+                    list(qs.values_list("id", flat=True)[:limit])
+                    qs[:count_limit].count()
+
+                self._report(name, self._measure(run, requests))
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute("DELETE FROM submission WHERE id LIKE %s", [f"{prefix}%"])
+            User.objects.filter(username__startswith=f"{prefix}_").delete()
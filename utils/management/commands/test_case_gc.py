@@ -0,0 +1,33 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from problem.models import Problem
+from problem.test_case_archive import TestCaseArchive
+from problem.test_case_store import GC_GRACE_PERIOD, test_case_store
+
+
+class Command(BaseCommand):
+    help = "Remove test cases and download archives no problem references, and blobs no test case references"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--grace", type=int, default=GC_GRACE_PERIOD,
+                            help="seconds an unreferenced test case or blob is kept")
+        parser.add_argument("--adopt", action="store_true",
+                            help="convert test case directories created before the blob store into blob hard links")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        referenced_ids = set(Problem.objects.values_list("test_case_id", flat=True))
+        if options["adopt"] and not options["dry_run"]:
+            created = 0
+            for test_case_id in referenced_ids:
+                if test_case_id and os.path.isfile(os.path.join(test_case_store.root, test_case_id, "info")):
+                    created += test_case_store.adopt(test_case_id)
+            self.stdout.write(f"adopted test cases, {created} new blobs")
+        stats = test_case_store.gc(referenced_ids, grace=options["grace"], dry_run=options["dry_run"])
+        if not options["dry_run"]:
+            stats["archives"] = TestCaseArchive.gc(referenced_ids)
+        self.stdout.write(f"test cases: {stats['test_cases']}, blobs: {stats['blobs']} "
+                          f"({stats['blob_bytes'] / 1024 / 1024:.1f}MB), manifests: {stats['manifests']}, "
+                          f"tmp files: {stats['tmp']}, archives: {stats.get('archives', 0)}")
@@ -0,0 +1,55 @@
+import time
+from unittest import mock
+
+from django.test import TestCase
+
+from .cache import cache
+from .throttling import MAX_IDLE_TTL, TokenBucket
+
+
+class TokenBucketTest(TestCase):
+    def setUp(self):
+        self.key = f"test:token_bucket:{time.time()}"
+        self.addCleanup(cache.delete, self.key)
+        self.now = time.time()
+
+    def consume(self, bucket, num=1, after=0):
+        with mock.patch("utils.throttling.time.time", return_value=self.now + after):
+            return bucket.consume(num)
+
+    def test_consume_and_refill(self):
+        bucket = TokenBucket(self.key, capacity=2, fill_rate=0.5, default_capacity=2)
+        self.assertEqual(self.consume(bucket), (True, 0))
+        self.assertEqual(self.consume(bucket), (True, 0))
+        self.assertEqual(self.consume(bucket), (False, 2))
+        # 1 秒之后补充了半个 token，还需要等待 1 秒
+        self.assertEqual(self.consume(bucket, after=1), (False, 1))
+        self.assertEqual(self.consume(bucket, after=2), (True, 0))
+        # 补充的 token 不超过容量
+        self.assertEqual(self.consume(bucket, num=3, after=100), (False, 2))
+
+    def test_new_bucket_is_full(self):
+        bucket = TokenBucket(self.key, capacity=3, fill_rate=1, default_capacity=1)
+        self.assertTrue(self.consume(bucket, num=3)[0])
+        self.assertFalse(self.consume(bucket)[0])
+        # 补满后 key 过期，之后的请求与新建的 bucket 一样是满的
+        cache.delete(self.key)
+        self.assertTrue(self.consume(bucket, num=3, after=3)[0])
+
+    def test_clock_skew(self):
+        bucket = TokenBucket(self.key, capacity=1, fill_rate=1, default_capacity=1)
+        self.assertTrue(self.consume(bucket, after=10)[0])
+        # 其他机器的时钟落后时不补充 token
+        self.assertFalse(self.consume(bucket)[0])
+
+    def test_idle_key_expires(self):
+        bucket = TokenBucket(self.key, capacity=10, fill_rate=2, default_capacity=10)
+        self.consume(bucket, num=4)
+        # 3 秒之后补满，key 随之过期
+        self.assertEqual(cache.ttl(self.key), 3)
+
+    def test_no_fill(self):
+        bucket = TokenBucket(self.key, capacity=1, fill_rate=0, default_capacity=1)
+        self.assertTrue(self.consume(bucket)[0])
+        self.assertEqual(self.consume(bucket), (False, MAX_IDLE_TTL))
+        self.assertEqual(cache.ttl(self.key), MAX_IDLE_TTL)
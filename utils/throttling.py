@@ -1,55 +1,68 @@
 import time
 
+from utils.cache import RedisScript
+
+# 补充 token 并尝试消耗，只有一次往返，多个进程同时消耗同一个 key 也不会多发 token
+# KEYS: bucket
+# ARGV: capacity, fill_rate, now, num, max_ttl
+# 返回 {是否成功, 需要等待的秒数}，Lua 的小数返回时会被截断为整数，所以等待时间以字符串返回
+_consume_script = RedisScript("""
+local capacity = tonumber(ARGV[1])
+local fill_rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local num = tonumber(ARGV[4])
+local max_ttl = tonumber(ARGV[5])
+
+local state = redis.call("HMGET", KEYS[1], "last_capacity", "last_timestamp")
+local tokens = tonumber(state[1])
+local timestamp = tonumber(state[2])
+-- key 在补满时过期，不存在的 bucket 就是满的
+if tokens == nil or timestamp == nil then
+    tokens = capacity
+    timestamp = now
+end
+-- 不同机器的时钟可能有偏差，时间倒退时不补充
+tokens = math.min(capacity, tokens + math.max(now - timestamp, 0) * fill_rate)
+
+local allowed = 0
+local wait = 0
+if tokens >= num then
+    tokens = tokens - num
+    allowed = 1
+elseif fill_rate > 0 then
+    wait = (num - tokens) / fill_rate
+else
+    wait = max_ttl
+end
+redis.call("HSET", KEYS[1], "last_capacity", tokens, "last_timestamp", now)
+
+-- 补满之后的状态与新建的 bucket 没有区别，key 在补满时过期
+local ttl = max_ttl
+if fill_rate > 0 then
+    ttl = math.min(math.ceil((capacity - tokens) / fill_rate) + 1, max_ttl)
+end
+redis.call("EXPIRE", KEYS[1], ttl)
+return {allowed, tostring(wait)}
+""")
+
+# 空闲 key 最长保留时间（秒）
+MAX_IDLE_TTL = 7 * 24 * 3600
+
 
 class TokenBucket:
     """
-    注意：对于单个key的操作不是线程安全的
+    基于 Redis 的令牌桶，检查和消耗在一个 Lua 脚本中原子完成
+    空闲的 key 在 token 补满之后过期，Redis 内存不会随用户数量一直增长
     """
-    def __init__(self, key, capacity, fill_rate, default_capacity, redis_conn):
+    def __init__(self, key, capacity, fill_rate, default_capacity=None):
         """
-        :param capacity: 最大容量
+        :param capacity: 最大容量，也是新建的 bucket 的容量
         :param fill_rate: 填充速度/每秒
-        :param default_capacity: 初始容量
-        :param redis_conn: redis connection
+        :param default_capacity: 不再使用，保留是为了兼容 throttling 选项中已有的配置
         """
         self._key = key
         self._capacity = capacity
         self._fill_rate = fill_rate
-        self._default_capacity = default_capacity
-        self._redis_conn = redis_conn
-
-        self._last_capacity_key = "last_capacity"
-        self._last_timestamp_key = "last_timestamp"
-
-    def _init_key(self):
-        self._last_capacity = self._default_capacity
-        now = time.time()
-        self._last_timestamp = now
-        return self._default_capacity, now
-
-    @property
-    def _last_capacity(self):
-        last_capacity = self._redis_conn.hget(self._key, self._last_capacity_key)
-        if last_capacity is None:
-            return self._init_key()[0]
-        else:
-            return float(last_capacity)
-
-    @_last_capacity.setter
-    def _last_capacity(self, value):
-        self._redis_conn.hset(self._key, self._last_capacity_key, value)
-
-    @property
-    def _last_timestamp(self):
-        return float(self._redis_conn.hget(self._key, self._last_timestamp_key))
-
-    @_last_timestamp.setter
-    def _last_timestamp(self, value):
-        self._redis_conn.hset(self._key, self._last_timestamp_key, value)
-
-    def _try_to_fill(self, now):
-        delta = self._fill_rate * (now - self._last_timestamp)
-        return min(self._last_capacity + delta, self._capacity)
 
     def consume(self, num=1):
         """
@@ -57,16 +70,6 @@ class TokenBucket:
         :param num:
         :return: result: bool, wait_time: float
         """
-        # print("capacity ", self.fill(time.time()))
-        if self._last_capacity >= num:
-            self._last_capacity -= num
-            return True, 0
-        else:
-            now = time.time()
-            cur_num = self._try_to_fill(now)
-            if cur_num >= num:
-                self._last_capacity = cur_num - num
-                self._last_timestamp = now
-                return True, 0
-            else:
-                return False, (num - cur_num) / self._fill_rate
+        allowed, wait = _consume_script(keys=[self._key],
+                                        args=[self._capacity, self._fill_rate, time.time(), num, MAX_IDLE_TTL])
+        return bool(allowed), float(wait)